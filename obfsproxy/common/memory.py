@@ -0,0 +1,115 @@
+import obfsproxy.common.log as logging
+import obfsproxy.common.metrics as metrics
+
+log = logging.get_obfslogger()
+
+"""
+Per-circuit and process-wide memory budgets.
+
+Transports report the number of bytes they hold on behalf of a circuit
+(queued data, partially reassembled messages, ...) whenever they append
+to or drain their buffers. The circuit charges them to the process-wide
+MemoryBudget, which tells it how much it should degrade:
+
+  OK            Nothing to do.
+  PAUSE_READS   Stop reading from both connections of the circuit.
+  DROP_PADDING  Also stop sending padding.
+  CLOSE         Tear the circuit down.
+
+The level is picked from the worse of the circuit's usage relative to
+the per-circuit budget, and the process' total usage relative to the
+process-wide budget: exceeding a budget pauses reads, exceeding it by
+DROP_PADDING_RATIO drops padding, and exceeding it by CLOSE_RATIO closes
+the circuit. Since usage is checked on every append, the process-wide
+budget hits the circuits that keep growing while it is exceeded.
+
+A budget of 0 disables it.
+"""
+
+DEFAULT_CIRCUIT_BUDGET = 4 * 1024**2 # bytes
+DEFAULT_PROCESS_BUDGET = 256 * 1024**2 # bytes
+
+DROP_PADDING_RATIO = 1.5
+CLOSE_RATIO = 2.0
+
+# Shedding levels, in the order the circuit degrades.
+OK = 0
+PAUSE_READS = 1
+DROP_PADDING = 2
+CLOSE = 3
+
+LEVEL_NAMES = {OK: 'ok', PAUSE_READS: 'pause_reads',
+               DROP_PADDING: 'drop_padding', CLOSE: 'close'}
+
+shedding_events = metrics.registry.counter(
+    'obfsproxy_memory_shedding_total',
+    'Number of times a circuit degraded because it exceeded a memory budget.',
+    ('transport', 'action'))
+
+class MemoryBudget(object):
+    """
+    Keeps track of the memory used by all circuits.
+
+    Attributes:
+    circuit_budget: Bytes a single circuit may use.
+    process_budget: Bytes all circuits together may use.
+    used: Bytes currently used by all circuits.
+    """
+
+    def __init__(self, circuit_budget=DEFAULT_CIRCUIT_BUDGET,
+                 process_budget=DEFAULT_PROCESS_BUDGET):
+        self.circuit_budget = circuit_budget
+        self.process_budget = process_budget
+        self.used = 0
+
+    def configure(self, circuit_budget, process_budget):
+        """Set the budgets. Throws ValueError if they are negative."""
+
+        if circuit_budget < 0 or process_budget < 0:
+            raise ValueError("Memory budgets can't be negative.")
+        self.circuit_budget = circuit_budget
+        self.process_budget = process_budget
+
+    def charge(self, old, new):
+        """
+        A circuit went from using 'old' bytes to using 'new' bytes.
+        Return the shedding level it should be at.
+        """
+
+        self.used += new - old
+        return self.level(new)
+
+    def release(self, old):
+        """A circuit that used 'old' bytes went away."""
+
+        self.used -= old
+
+    def level(self, circuit_used):
+        """
+        Return the shedding level of a circuit using 'circuit_used'
+        bytes, given the current total usage.
+        """
+
+        if circuit_used <= 0:
+            return OK
+
+        ratio = 0
+        if self.circuit_budget:
+            ratio = float(circuit_used) / self.circuit_budget
+        if self.process_budget:
+            ratio = max(ratio, float(self.used) / self.process_budget)
+
+        if ratio > CLOSE_RATIO:
+            return CLOSE
+        if ratio > DROP_PADDING_RATIO:
+            return DROP_PADDING
+        if ratio > 1:
+            return PAUSE_READS
+        return OK
+
+budget = MemoryBudget()
+
+metrics.registry.gauge(
+    'obfsproxy_memory_budget_used_bytes',
+    'Bytes held by all circuits, as charged to the process-wide memory budget.',
+    function=lambda: budget.used)
@@ -0,0 +1,323 @@
+"""metrics code"""
+
+import bisect
+
+import obfsproxy.common.log as logging
+
+log = logging.get_obfslogger()
+
+"""
+A small metrics registry for obfsproxy.
+
+Metrics are plain Python objects updated from the reactor thread, so
+updating them is just a dictionary lookup and an addition: no locks
+and no formatting happen until someone scrapes the endpoint.  Each
+metric may carry a fixed tuple of label names; samples are keyed by
+the tuple of label values passed to inc()/set()/observe().
+
+The registry can be exposed in the Prometheus text exposition format
+with listen_metrics_endpoint().
+"""
+
+def _escape(value):
+    """Escape a label value for the Prometheus text format."""
+
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+def _format_labels(labelnames, labelvalues, extra=None):
+    """Return the '{a="b",...}' part of a sample line."""
+
+    pairs = ['%s="%s"' % (name, _escape(value))
+             for name, value in zip(labelnames, labelvalues)]
+    if extra:
+        pairs.append('%s="%s"' % extra)
+    if not pairs:
+        return ''
+    return '{%s}' % ','.join(pairs)
+
+def _format_value(value):
+    """Format a sample value the way Prometheus expects it."""
+
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+class Metric(object):
+    """
+    Base class for all metrics.
+
+    Attributes:
+    name: The metric name, as exposed to Prometheus.
+    documentation: The HELP string of the metric.
+    labelnames: Tuple of label names.
+    """
+
+    type_name = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+
+    def _check_labels(self, labels):
+        if len(labels) != len(self.labelnames):
+            raise ValueError("%s: expected labels %s, got %s" %
+                             (self.name, self.labelnames, labels))
+
+    def get(self, labels=()):
+        """Return the current value of the sample with 'labels'."""
+
+        return self.values.get(tuple(labels), 0)
+
+    def samples(self):
+        """Yield (suffix, labelvalues, extra_label, value) tuples."""
+
+        for labels, value in sorted(self.values.items()):
+            yield ('', labels, None, value)
+
+    def render(self):
+        """Return this metric in the Prometheus text format."""
+
+        lines = ["# HELP %s %s" % (self.name, self.documentation),
+                 "# TYPE %s %s" % (self.name, self.type_name)]
+        for suffix, labels, extra, value in self.samples():
+            lines.append("%s%s%s %s" % (self.name, suffix,
+                                        _format_labels(self.labelnames, labels, extra),
+                                        _format_value(value)))
+        return '\n'.join(lines)
+
+    def reset(self):
+        """Forget all samples."""
+
+        self.values = {}
+
+class Counter(Metric):
+    """A monotonically increasing value."""
+
+    type_name = 'counter'
+
+    def inc(self, labels=(), amount=1):
+        """Increment the sample with 'labels' by 'amount'."""
+
+        if amount < 0:
+            raise ValueError("%s: counters can only go up." % self.name)
+        values = self.values
+        try:
+            values[labels] += amount
+        except KeyError:
+            self._check_labels(labels)
+            values[labels] = amount
+
+class Gauge(Metric):
+    """
+    A value that can go up and down.
+
+    A gauge can also be backed by a function, in which case it is
+    only evaluated when the registry is rendered.
+    """
+
+    type_name = 'gauge'
+
+    def __init__(self, name, documentation, labelnames=(), function=None):
+        Metric.__init__(self, name, documentation, labelnames)
+        self.function = function
+
+    def set(self, labels=(), value=0):
+        """Set the sample with 'labels' to 'value'."""
+
+        self._check_labels(labels)
+        self.values[labels] = value
+
+    def inc(self, labels=(), amount=1):
+        """Increment the sample with 'labels' by 'amount'."""
+
+        values = self.values
+        try:
+            values[labels] += amount
+        except KeyError:
+            self._check_labels(labels)
+            values[labels] = amount
+
+    def dec(self, labels=(), amount=1):
+        """Decrement the sample with 'labels' by 'amount'."""
+
+        self.inc(labels, -amount)
+
+    def set_function(self, function):
+        """Compute the (label-less) value of this gauge with 'function'."""
+
+        self.function = function
+
+    def get(self, labels=()):
+        if self.function:
+            return self.function()
+        return Metric.get(self, labels)
+
+    def samples(self):
+        if self.function:
+            try:
+                yield ('', (), None, self.function())
+            except Exception as err:
+                log.debug("metrics: Could not compute %s (%s)." % (self.name, err))
+            return
+        for sample in Metric.samples(self):
+            yield sample
+
+class Histogram(Metric):
+    """
+    A histogram with fixed bucket boundaries.
+
+    'buckets' is a sorted sequence of upper bounds. An implicit +Inf
+    bucket is always added.
+    """
+
+    type_name = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=()):
+        Metric.__init__(self, name, documentation, labelnames)
+        buckets = [float(b) for b in buckets]
+        if buckets != sorted(buckets):
+            raise ValueError("%s: buckets must be sorted." % self.name)
+        if not buckets or buckets[-1] != float('inf'):
+            buckets.append(float('inf'))
+        self.buckets = tuple(buckets)
+
+    def observe(self, labels=(), value=0):
+        """Add the observation 'value' to the sample with 'labels'."""
+
+        try:
+            state = self.values[labels]
+        except KeyError:
+            self._check_labels(labels)
+            # [per-bucket counts..., sum, count]
+            state = self.values[labels] = [0] * (len(self.buckets) + 2)
+        state[bisect.bisect_left(self.buckets, value)] += 1
+        state[-2] += value
+        state[-1] += 1
+
+    def get(self, labels=()):
+        """Return the number of observations of the sample with 'labels'."""
+
+        state = self.values.get(tuple(labels))
+        return state[-1] if state else 0
+
+    def samples(self):
+        for labels, state in sorted(self.values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, state):
+                cumulative += count
+                yield ('_bucket', labels, ('le', _format_value(bound)), cumulative)
+            yield ('_sum', labels, None, state[-2])
+            yield ('_count', labels, None, state[-1])
+
+class MetricsRegistry(object):
+    """
+    Holds all the metrics of obfsproxy.
+
+    The factory methods are idempotent: asking twice for the same
+    metric name returns the same object, so that modules can declare
+    their metrics at import time.
+    """
+
+    def __init__(self):
+        self.metrics = {}
+
+    def _get_or_create(self, cls, name, *args, **kwargs):
+        metric = self.metrics.get(name)
+        if metric is None:
+            metric = self.metrics[name] = cls(name, *args, **kwargs)
+        elif not isinstance(metric, cls):
+            raise ValueError("Metric '%s' is already registered as a %s." %
+                             (name, metric.type_name))
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._get_or_create(Counter, name, documentation, labelnames)
+
+    def gauge(self, name, documentation, labelnames=(), function=None):
+        return self._get_or_create(Gauge, name, documentation, labelnames,
+                                   function=function)
+
+    def histogram(self, name, documentation, labelnames=(), buckets=()):
+        return self._get_or_create(Histogram, name, documentation, labelnames,
+                                   buckets=buckets)
+
+    def render(self):
+        """Return all metrics in the Prometheus text exposition format."""
+
+        return ''.join(self.metrics[name].render() + '\n'
+                       for name in sorted(self.metrics))
+
+    def reset(self):
+        """Forget all samples of all metrics (mostly useful for tests)."""
+
+        for metric in self.metrics.values():
+            metric.reset()
+
+def parse_endpoint(spec):
+    """
+    Parse a metrics endpoint specification.
+
+    'spec' is either 'unix:<path>' or '[<host>:]<port>'. If the host
+    is omitted, we bind to the loopback interface.
+
+    Return a tuple ('unix', path) or ('tcp', (host, port)).
+    Throws ValueError if 'spec' is not valid.
+    """
+
+    if spec.startswith('unix:'):
+        path = spec[len('unix:'):]
+        if not path:
+            raise ValueError("Empty unix socket path in metrics endpoint.")
+        return ('unix', path)
+
+    host, _, port = spec.rpartition(':')
+    host = host.strip('[]') or '127.0.0.1'
+    try:
+        port = int(port)
+    except ValueError:
+        raise ValueError("Invalid metrics endpoint '%s'." % spec)
+    if not (0 <= port <= 65535):
+        raise ValueError("Invalid port in metrics endpoint '%s'." % spec)
+    return ('tcp', (host, port))
+
+def listen_metrics_endpoint(spec, metrics_registry=None):
+    """
+    Serve 'metrics_registry' (or the global registry) in the
+    Prometheus text format on the endpoint described by 'spec' (see
+    parse_endpoint()).
+
+    Return the listening port object.
+    """
+
+    # Inline imports so that this module can be used without twisted.web.
+    from twisted.internet import reactor
+    from twisted.web import resource, server
+
+    metrics_registry = metrics_registry or registry
+
+    class MetricsResource(resource.Resource):
+        isLeaf = True
+
+        def render_GET(self, request):
+            request.setHeader(b'content-type', b'text/plain; version=0.0.4; charset=utf-8')
+            return metrics_registry.render().encode('utf-8')
+
+    site = server.Site(MetricsResource())
+    site.noisy = False
+
+    kind, where = parse_endpoint(spec)
+    if kind == 'unix':
+        port = reactor.listenUNIX(where, site, mode=0o600)
+        log.info("Serving metrics on unix socket '%s'." % where)
+    else:
+        host, portnum = where
+        port = reactor.listenTCP(portnum, site, interface=host)
+        log.info("Serving metrics on %s:%d." % (log.safe_addr_str(host), port.getHost().port))
+    return port
+
+# A metrics registry singleton.
+registry = MetricsRegistry()
@@ -1,6 +1,8 @@
 try:
+    import gmpy2
     from gmpy2 import mpz as mpz
 except ImportError:
+    gmpy2 = None
     try:
         from gmpy import mpz as mpz
     except ImportError:
@@ -8,6 +10,11 @@ except ImportError:
             return x
         pass
 
+# `True' if gmpy2 can release the GIL during long computations (>= 2.1),
+# which lets other threads run while `powMod' computes.
+RELEASES_GIL = gmpy2 is not None and \
+               hasattr(gmpy2.get_context(), 'allow_release_gil')
+
 def powMod( x, y, mod ):
     """
     (Efficiently) Calculate and return `x' to the power of `y' mod `mod'.
@@ -17,6 +24,10 @@ def powMod( x, y, mod ):
     built-in exponentiation is used.
     """
 
+    if RELEASES_GIL:
+        # The context is per thread.
+        gmpy2.get_context().allow_release_gil = True
+
     x = mpz(x)
     y = mpz(y)
     mod = mpz(mod)
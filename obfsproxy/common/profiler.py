@@ -0,0 +1,256 @@
+"""sampling profiler code"""
+
+import os
+import sys
+import threading
+import time
+
+import obfsproxy.common.log as logging
+import obfsproxy.common.metrics as metrics
+
+log = logging.get_obfslogger()
+
+"""
+An on-demand statistical profiler for the reactor thread.
+
+While a profile is running, a helper thread wakes up every few
+milliseconds, grabs the current stack of the reactor thread with
+sys._current_frames() and counts it. The reactor itself is never
+interrupted, so the overhead is limited to the sampler briefly holding
+the GIL.
+
+The result is written in the "collapsed stack" format understood by
+flamegraph.pl and speedscope: one line per unique stack, frames
+separated by ';', followed by the number of samples. Every stack is
+prefixed with the name of the pluggable transport found in it (if any)
+and a bucket of the number of circuits that transport had open, so
+that the hot spots of different transports can be compared.
+"""
+
+DEFAULT_DURATION = 30 # seconds
+DEFAULT_INTERVAL = 5 # milliseconds
+MAX_DURATION = 600 # seconds
+
+def _frame_name(code):
+    """Return the flamegraph name of the code object 'code'."""
+
+    return "%s:%s" % (os.path.basename(code.co_filename), code.co_name)
+
+def _circuits_bucket(transport_name):
+    """
+    Return the number of active circuits of 'transport_name' rounded
+    down to a power of two, to keep the number of distinct stacks low.
+    """
+
+    gauge = metrics.registry.metrics.get('obfsproxy_circuits_active')
+    n = int(gauge.get((transport_name,))) if gauge else 0
+    if n <= 0:
+        return "0"
+    low = 1 << (n.bit_length() - 1)
+    return "%d-%d" % (low, 2 * low - 1)
+
+def _transport_in_stack(frames):
+    """
+    Return the class name of the innermost pluggable transport found
+    in the list of 'frames' (outermost first), or None.
+    """
+
+    # Inline import so that the profiler does not pull in the transports.
+    from obfsproxy.transports.base import BaseTransport
+
+    for frame in reversed(frames):
+        if 'self' not in frame.f_code.co_varnames:
+            continue
+        obj = frame.f_locals.get('self')
+        if isinstance(obj, BaseTransport):
+            return obj.__class__.__name__
+    return None
+
+class StackSampler(object):
+    """
+    Samples the stack of the thread 'thread_id' and aggregates the
+    samples as collapsed stacks.
+
+    Attributes:
+    thread_id: The identifier of the sampled thread.
+    interval: Seconds between two samples.
+    stacks: Dictionary mapping collapsed stacks to sample counts.
+    n_samples: Total number of samples taken.
+    """
+
+    def __init__(self, thread_id, interval=DEFAULT_INTERVAL / 1000.0):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = {}
+        self.n_samples = 0
+
+    def sample(self):
+        """Take a single sample of the thread's stack."""
+
+        frame = sys._current_frames().get(self.thread_id)
+        if frame is None:
+            return
+
+        frames = []
+        while frame is not None:
+            frames.append(frame)
+            frame = frame.f_back
+        frames.reverse()
+
+        transport = _transport_in_stack(frames)
+        if transport:
+            labels = ["transport=%s" % transport,
+                      "circuits=%s" % _circuits_bucket(transport)]
+        else:
+            labels = ["transport=none"]
+
+        key = ';'.join(labels + [_frame_name(f.f_code) for f in frames])
+        self.stacks[key] = self.stacks.get(key, 0) + 1
+        self.n_samples += 1
+
+    def run(self, duration):
+        """Sample for 'duration' seconds. Blocks the calling thread."""
+
+        deadline = time.monotonic() + duration
+        while time.monotonic() < deadline:
+            self.sample()
+            time.sleep(self.interval)
+
+    def collapsed(self):
+        """Return the samples in the collapsed stack format."""
+
+        return ''.join("%s %d\n" % (stack, count)
+                       for stack, count in sorted(self.stacks.items()))
+
+class Profiler(object):
+    """
+    Runs at most one sampling session at a time against the reactor
+    thread.
+
+    Must be created and used from the reactor thread.
+    """
+
+    def __init__(self, output_dir=None):
+        self.output_dir = output_dir
+        self.reactor_thread_id = threading.get_ident()
+        self.running = False
+
+    def profile(self, duration=DEFAULT_DURATION, interval=DEFAULT_INTERVAL):
+        """
+        Sample the reactor for 'duration' seconds, every 'interval'
+        milliseconds.
+
+        Return a Deferred that fires with the collapsed stacks as a
+        string. Throws ProfilerBusy if a profile is already running.
+        """
+
+        from twisted.internet import threads
+
+        if self.running:
+            raise ProfilerBusy("A profile is already running.")
+        duration = min(max(float(duration), 0), MAX_DURATION)
+        interval = max(float(interval), 1) / 1000.0
+
+        log.info("Profiler: sampling the reactor for %s seconds every %s ms." %
+                 (duration, interval * 1000))
+        self.running = True
+        sampler = StackSampler(self.reactor_thread_id, interval)
+
+        def done(result):
+            self.running = False
+            log.info("Profiler: took %d samples." % sampler.n_samples)
+            return result
+
+        d = threads.deferToThread(sampler.run, duration)
+        d.addCallback(lambda _: sampler.collapsed())
+        d.addBoth(done)
+        return d
+
+    def profile_to_file(self, duration=DEFAULT_DURATION, interval=DEFAULT_INTERVAL):
+        """Like profile(), but write the output to a file in 'output_dir'."""
+
+        path = os.path.join(self.output_dir or os.getcwd(),
+                            "obfsproxy-%d-%s.folded" % (os.getpid(), time.strftime("%Y%m%d-%H%M%S")))
+
+        def write(collapsed):
+            with open(path, 'w') as f:
+                f.write(collapsed)
+            log.warning("Profiler: wrote collapsed stacks to '%s'." % path)
+
+        def failed(failure):
+            log.warning("Profiler: could not write profile (%s)." % failure.getErrorMessage())
+
+        d = self.profile(duration, interval)
+        d.addCallback(write)
+        d.addErrback(failed)
+        return d
+
+    def install_signal_handler(self, signum, duration=DEFAULT_DURATION, interval=DEFAULT_INTERVAL):
+        """Start profile_to_file() whenever we receive signal 'signum'."""
+
+        import signal
+        from twisted.internet import reactor
+
+        def start():
+            try:
+                self.profile_to_file(duration, interval)
+            except ProfilerBusy as err:
+                log.warning("Profiler: %s" % err)
+
+        signal.signal(signum, lambda *_: reactor.callFromThread(start))
+
+    def listen(self, spec):
+        """
+        Serve profiles over HTTP on the endpoint 'spec' (see
+        metrics.parse_endpoint()).
+
+        'GET /?seconds=N&interval=M' samples for N seconds every M
+        milliseconds and returns the collapsed stacks.
+        """
+
+        from twisted.internet import reactor
+        from twisted.web import resource, server
+
+        profiler = self
+
+        def get_arg(request, name, default):
+            try:
+                return float(request.args[name.encode('ascii')][0])
+            except (KeyError, IndexError, ValueError):
+                return default
+
+        class ProfileResource(resource.Resource):
+            isLeaf = True
+
+            def render_GET(self, request):
+                request.setHeader(b'content-type', b'text/plain; charset=utf-8')
+                try:
+                    d = profiler.profile(get_arg(request, 'seconds', DEFAULT_DURATION),
+                                         get_arg(request, 'interval', DEFAULT_INTERVAL))
+                except ProfilerBusy as err:
+                    request.setResponseCode(503)
+                    return str(err).encode('utf-8')
+
+                def finish(collapsed):
+                    if not request.finished:
+                        request.write(collapsed.encode('utf-8'))
+                        request.finish()
+
+                d.addCallback(finish)
+                d.addErrback(lambda failure: log.warning("Profiler: %s" % failure.getErrorMessage()))
+                return server.NOT_DONE_YET
+
+        site = server.Site(ProfileResource())
+        site.noisy = False
+
+        kind, where = metrics.parse_endpoint(spec)
+        if kind == 'unix':
+            port = reactor.listenUNIX(where, site, mode=0o600)
+            log.info("Serving profiles on unix socket '%s'." % where)
+        else:
+            host, portnum = where
+            port = reactor.listenTCP(portnum, site, interface=host)
+            log.info("Serving profiles on %s:%d." % (log.safe_addr_str(host), port.getHost().port))
+        return port
+
+class ProfilerBusy(Exception): pass
@@ -32,6 +32,12 @@ class TransportConfig( object ):
         # connect to. See pyptlib.client_config.parseProxyURI().
         self.proxy = None
 
+        # Socket options (obfsproxy.network.sockopts.SocketOptions) for
+        # the upstream and downstream connections of this listener.
+        # None means the process-wide defaults.
+        self.upstreamSocketOptions = None
+        self.downstreamSocketOptions = None
+
     def setProxy( self, proxy ):
         """
         Set the given 'proxy'.
@@ -39,6 +45,15 @@ class TransportConfig( object ):
 
         self.proxy = proxy
 
+    def setSocketOptions( self, upstream, downstream ):
+        """
+        Set the socket options of the `upstream' and `downstream'
+        connections.
+        """
+
+        self.upstreamSocketOptions = upstream
+        self.downstreamSocketOptions = downstream
+
     def setStateLocation( self, stateLocation ):
         """
         Set the given `stateLocation'.
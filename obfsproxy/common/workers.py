@@ -0,0 +1,117 @@
+"""
+Workers that run the CPU-bound math of handshakes outside the reactor.
+
+The UniformDH handshakes of obfs3 and ScrambleSuit cost a 1536-bit
+modular exponentiation. Run on the reactor, it delays every other
+circuit, including the timers of the padding defenses. 'run' hands a
+function to a worker and returns a Deferred that fires on the reactor
+with its result.
+
+Threads are enough when the math releases the GIL (gmpy2, see
+modexp.RELEASES_GIL). Otherwise, the work goes to a pool of processes,
+so that the workers don't compete with the reactor for the interpreter.
+Functions run in processes must be picklable (module-level), and so
+must their arguments and results.
+"""
+
+import multiprocessing
+from concurrent import futures
+
+from twisted.internet import defer, reactor, threads
+from twisted.python import failure
+
+import obfsproxy.common.log as logging
+import obfsproxy.common.metrics as metrics
+import obfsproxy.common.modexp as modexp
+
+log = logging.get_obfslogger()
+
+AUTO = 'auto'
+THREADS = 'threads'
+PROCESSES = 'processes'
+MODES = (AUTO, THREADS, PROCESSES)
+
+mode = AUTO # One of MODES.
+processes = 0 # Size of the process pool. 0 means one per CPU.
+
+_executor = None
+_pending = 0
+
+metrics.registry.gauge(
+    'obfsproxy_workers_pending', 'Number of handshake computations waiting for a worker.',
+    function=lambda: _pending)
+
+def configure(worker_mode=AUTO, pool_size=0):
+    """
+    Run the work in 'worker_mode' workers, with 'pool_size' processes
+    if they are processes. Throws ValueError if the values are invalid.
+    """
+    global mode, processes
+
+    if worker_mode not in MODES or pool_size < 0:
+        raise ValueError("Invalid worker settings (mode: %s, processes: %s)." % (worker_mode, pool_size))
+    shutdown()
+    mode = worker_mode
+    processes = pool_size
+
+def current_mode():
+    """Return THREADS or PROCESSES: the workers that 'run' uses."""
+    if mode != AUTO:
+        return mode
+    return THREADS if modexp.RELEASES_GIL else PROCESSES
+
+def run(f, *args, mode=None):
+    """
+    Call 'f(*args)' in a worker. Return a Deferred that fires with the
+    result of the call, or fails with the exception it raised.
+
+    'mode' (THREADS or PROCESSES) overrides 'current_mode', for work
+    that holds the GIL whatever math library is installed.
+    """
+    global _pending
+
+    if (mode or current_mode()) == THREADS:
+        d = threads.deferToThread(f, *args)
+    else:
+        d = defer.Deferred()
+        future = _get_executor().submit(f, *args)
+        future.add_done_callback(lambda future: reactor.callFromThread(_fire, d, future))
+
+    _pending += 1
+    d.addBoth(_done)
+    return d
+
+def _done(result):
+    global _pending
+    _pending -= 1
+    return result
+
+def _fire(d, future):
+    try:
+        result = future.result()
+    except Exception as err:
+        d.errback(failure.Failure(err))
+    else:
+        d.callback(result)
+
+def _get_executor():
+    global _executor
+
+    if _executor is None:
+        # Forking the reactor's process would copy its sockets and
+        # threads into the workers.
+        context = None
+        if 'forkserver' in multiprocessing.get_all_start_methods():
+            context = multiprocessing.get_context('forkserver')
+        _executor = futures.ProcessPoolExecutor(processes or None, mp_context=context)
+        reactor.addSystemEventTrigger('before', 'shutdown', shutdown)
+        log.debug("Started a pool of %s handshake worker processes.", processes or "one per CPU")
+    return _executor
+
+def shutdown():
+    """Stop the worker processes, if they were started."""
+    global _executor
+
+    if _executor is not None:
+        _executor.shutdown(wait=False)
+        _executor = None
@@ -16,8 +16,14 @@ import pprint
 
 log = logging.get_obfslogger()
 
-def do_managed_server():
-    """Start the managed-proxy protocol as a server."""
+def do_managed_server(upstream_unix_socket=None):
+    """
+    Start the managed-proxy protocol as a server.
+
+    If 'upstream_unix_socket' is set, connect to the ORPort (or the
+    Extended ORPort) through that unix socket instead of the TCP port
+    that tor gave us.
+    """
 
     should_start_event_loop = False
 
@@ -35,6 +41,13 @@ def do_managed_server():
     orport = ptserver.config.getORPort()
     server_transport_options = ptserver.config.getServerTransportOptions()
 
+    if upstream_unix_socket:
+        log.debug("Connecting to tor through unix socket '%s'." % upstream_unix_socket)
+        if ext_orport:
+            ext_orport = "unix:%s" % upstream_unix_socket
+        else:
+            orport = "unix:%s" % upstream_unix_socket
+
     for transport, transport_bindaddr in list(ptserver.getBindAddresses().items()):
 
         # Will hold configuration parameters for the pluggable transport module.
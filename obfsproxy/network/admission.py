@@ -0,0 +1,287 @@
+from collections import deque
+
+from twisted.internet import defer, reactor
+
+import obfsproxy.common.log as logging
+import obfsproxy.common.metrics as metrics
+
+log = logging.get_obfslogger()
+
+"""
+Admission control of expensive server-side handshakes.
+
+UniformDH (obfs3, ScrambleSuit), ScrambleSuit's ticket decryption and
+obfs2's key stretching cost milliseconds of CPU each. Without a limit,
+a scan or a reconnect storm starts as many of them as it opens
+connections, and the established circuits, padded ones included, wait
+behind them.
+
+A HandshakeAdmission admits the handshake of a new circuit if:
+
+- a token bucket refilled at 'rate' handshakes per second (with bursts
+  of 'burst' handshakes) has a token, globally and for the source IP;
+- fewer than 'max_inflight' handshakes are in flight, globally and
+  fewer than 'max_inflight_per_ip' for the source IP.
+
+A handshake stays in flight from its admission until the transport
+reports it completed (Circuit.handshakeCompleted) or the circuit
+closes. Circuits that can't be admitted right away wait in a bounded
+FIFO queue, without reading from their connection, for at most
+'queue_timeout' seconds. Then they are rejected: see Circuit for how
+rejected circuits are closed without giving probers a distinctive
+answer.
+
+Every limit is disabled by default (0).
+"""
+
+DEFAULT_QUEUE_TIMEOUT = 10 # seconds
+DEFAULT_QUEUE_SIZE = 1024 # circuits
+
+# Rejected circuits are closed after a random delay of up to this many
+# seconds, rather than right away (see Circuit.requestAdmission).
+REJECT_MAX_DELAY = 30
+
+# Seconds added to the refill time of a bucket before retrying.
+RETRY_SLACK = 0.001
+
+# Per-IP buckets are forgotten once full, when there are more than
+# this many of them.
+MAX_TRACKED_SOURCES = 4096
+
+handshakes = metrics.registry.counter(
+    'obfsproxy_handshakes_total',
+    'Number of handshakes admitted, queued and dropped by the admission control.', ('result',))
+metrics.registry.gauge(
+    'obfsproxy_handshakes_inflight', 'Number of admitted handshakes in flight.',
+    function=lambda: control.inflight_total)
+metrics.registry.gauge(
+    'obfsproxy_handshakes_queued', 'Number of handshakes waiting for admission.',
+    function=lambda: len(control.queue))
+
+class HandshakeRejected(Exception):
+    """The handshake could not be admitted in time."""
+
+class TokenBucket(object):
+    """
+    Hold up to 'burst' tokens, refilled at 'rate' tokens per second.
+    """
+
+    def __init__(self, rate, burst, now):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.last = now
+
+    def refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+        self.last = now
+
+    def ready(self, now):
+        """Return True if a token is available at 'now'."""
+        self.refill(now)
+        return self.tokens >= 1
+
+    def take(self):
+        self.tokens -= 1
+
+    def full(self, now):
+        self.refill(now)
+        return self.tokens >= self.burst
+
+    def wait_time(self, now):
+        """Return the seconds until a token is available."""
+        self.refill(now)
+        return max(0, (1 - self.tokens) / self.rate)
+
+class HandshakeAdmission(object):
+    """
+    Token buckets and concurrency caps on handshakes, globally and per
+    source IP.
+
+    Attributes:
+    inflight: source IP -> number of its handshakes in flight.
+    inflight_total: number of handshakes in flight.
+    queue: deque of (source IP, Deferred, timeout call) of the
+           handshakes waiting for admission, oldest first.
+    """
+
+    def __init__(self, clock=reactor):
+        self.clock = clock
+        self.inflight = {}
+        self.inflight_total = 0
+        self.queue = deque()
+        self._buckets = {}
+        self._bucket = None
+        self._retry = None
+        self.configure()
+
+    def configure(self, rate=0, burst=0, rate_per_ip=0, burst_per_ip=0,
+                  max_inflight=0, max_inflight_per_ip=0,
+                  queue_timeout=DEFAULT_QUEUE_TIMEOUT, queue_size=DEFAULT_QUEUE_SIZE):
+        """
+        Set the limits; 0 disables a limit. A burst of 0 means a burst
+        of max(1, rate). A 'queue_timeout' of 0 rejects the handshakes
+        that can't be admitted right away.
+
+        Throws ValueError if the values are invalid.
+        """
+        values = (rate, burst, rate_per_ip, burst_per_ip, max_inflight,
+                  max_inflight_per_ip, queue_timeout, queue_size)
+        if any(value < 0 for value in values):
+            raise ValueError("Invalid handshake admission settings: %s." % (values,))
+
+        self.rate, self.rate_per_ip = rate, rate_per_ip
+        self.burst = burst or max(1, rate)
+        self.burst_per_ip = burst_per_ip or max(1, rate_per_ip)
+        self.max_inflight, self.max_inflight_per_ip = max_inflight, max_inflight_per_ip
+        self.queue_timeout, self.queue_size = queue_timeout, queue_size
+
+        now = self.clock.seconds()
+        self._bucket = TokenBucket(self.rate, self.burst, now) if self.rate else None
+        self._buckets = {}
+
+    @property
+    def enabled(self):
+        return bool(self.rate or self.rate_per_ip or self.max_inflight or self.max_inflight_per_ip)
+
+    def _source_bucket(self, host, now):
+        bucket = self._buckets.get(host)
+        if bucket is None:
+            if len(self._buckets) >= MAX_TRACKED_SOURCES:
+                self._forget_full_buckets(now)
+            bucket = self._buckets[host] = TokenBucket(self.rate_per_ip, self.burst_per_ip, now)
+        return bucket
+
+    def _forget_full_buckets(self, now):
+        for host, bucket in list(self._buckets.items()):
+            if bucket.full(now):
+                del self._buckets[host]
+
+    def _can_admit(self, host, now):
+        """Return True if the handshake of 'host' can start at 'now'."""
+        if self.max_inflight and self.inflight_total >= self.max_inflight:
+            return False
+        if self.max_inflight_per_ip and self.inflight.get(host, 0) >= self.max_inflight_per_ip:
+            return False
+        if self._bucket and not self._bucket.ready(now):
+            return False
+        if self.rate_per_ip and not self._source_bucket(host, now).ready(now):
+            return False
+        return True
+
+    def _start(self, host):
+        if self._bucket:
+            self._bucket.take()
+        if self.rate_per_ip:
+            self._buckets[host].take()
+        self.inflight[host] = self.inflight.get(host, 0) + 1
+        self.inflight_total += 1
+        handshakes.inc(('admitted',))
+
+    def admit(self, host):
+        """
+        Return a Deferred that fires when the handshake of a circuit
+        from 'host' is admitted, or fails with HandshakeRejected.
+
+        Every admitted handshake must be released with 'release'.
+        Cancel the Deferred to give up waiting.
+        """
+        now = self.clock.seconds()
+        # The queued handshakes are held back by the limits of their
+        # source, or they would have been admitted by 'process_queue'.
+        if self._can_admit(host, now):
+            self._start(host)
+            return defer.succeed(host)
+
+        if not self.queue_timeout or len(self.queue) >= self.queue_size:
+            handshakes.inc(('dropped',))
+            return defer.fail(HandshakeRejected("Handshake from %s not admitted." %
+                                                log.safe_addr_str(host)))
+
+        handshakes.inc(('queued',))
+        entry = [host, None, None]
+        entry[1] = defer.Deferred(lambda d: self._unqueue(entry))
+        entry[2] = self.clock.callLater(self.queue_timeout, self._expire, entry)
+        self.queue.append(entry)
+        self._schedule_retry(now)
+        return entry[1]
+
+    def release(self, host):
+        """The handshake of a circuit from 'host' is over."""
+        count = self.inflight.get(host, 0)
+        if not count:
+            return
+        if count == 1:
+            del self.inflight[host]
+        else:
+            self.inflight[host] = count - 1
+        self.inflight_total -= 1
+        self.process_queue()
+
+    def _unqueue(self, entry):
+        self.queue.remove(entry)
+        if entry[2].active():
+            entry[2].cancel()
+
+    def _expire(self, entry):
+        self.queue.remove(entry)
+        handshakes.inc(('dropped',))
+        entry[1].errback(HandshakeRejected("Handshake from %s timed out in the queue." %
+                                           log.safe_addr_str(entry[0])))
+
+    def process_queue(self):
+        """
+        Admit the queued handshakes that can start now, oldest first.
+
+        A handshake held back by the limits of its source IP doesn't
+        hold back the handshakes of other sources.
+        """
+        self._retry = None
+        now = self.clock.seconds()
+        for entry in list(self.queue):
+            if self.max_inflight and self.inflight_total >= self.max_inflight:
+                break
+            if self._bucket and not self._bucket.ready(now):
+                break
+            if not self._can_admit(entry[0], now):
+                continue
+            self._unqueue(entry)
+            self._start(entry[0])
+            entry[1].callback(entry[0])
+        self._schedule_retry(now)
+
+    def _schedule_retry(self, now):
+        """Process the queue again when the token buckets have refilled."""
+        if not self.queue or (self._retry and self._retry.active()):
+            return
+        delays = []
+        if self._bucket:
+            delays.append(self._bucket.wait_time(now))
+        if self.rate_per_ip:
+            delays.extend(self._source_bucket(entry[0], now).wait_time(now)
+                          for entry in self.queue)
+        delays = [delay for delay in delays if delay > 0]
+        if delays:
+            # Past the refill, so that rounding doesn't leave us short.
+            self._retry = self.clock.callLater(min(delays) + RETRY_SLACK, self.process_queue)
+
+def parse_rate(spec):
+    """
+    Parse a 'RATE[,BURST]' handshake rate (handshakes per second).
+    Return (rate, burst), with a burst of 0 if it's not given. Throws
+    ValueError if 'spec' is invalid.
+    """
+    parts = spec.split(',')
+    if len(parts) > 2:
+        raise ValueError("Invalid handshake rate: %s." % spec)
+    rate = float(parts[0])
+    burst = int(parts[1]) if len(parts) == 2 else 0
+    if rate < 0 or burst < 0:
+        raise ValueError("Invalid handshake rate: %s." % spec)
+    return rate, burst
+
+control = HandshakeAdmission()
+
+def configure(*args, **kwargs):
+    """Configure the process-wide admission control (see HandshakeAdmission.configure)."""
+    control.configure(*args, **kwargs)
@@ -1,14 +1,34 @@
+from collections import deque
+
+def _to_bytes(data):
+    """Return 'data' as an immutable bytes object."""
+    if isinstance(data, bytes):
+        return data
+    if isinstance(data, str):
+        return bytes(data, encoding='utf-8')
+    # bytearray, memoryview, ...: copy, since the caller may reuse them.
+    return bytes(data)
+
 class Buffer(object):
     """
     A Buffer is a simple FIFO buffer. You write() stuff to it, and you
     read() them back. You can also peek() or drain() data.
+
+    Internally, the buffer is a deque of immutable chunks (as they were
+    written) and an offset into the first chunk. Writing never copies
+    the data that is already buffered, draining only drops the chunks
+    that were fully consumed, and reads only join chunks when the
+    requested data spans more than one of them.
     """
 
-    def __init__(self, data=''):
+    def __init__(self, data=b''):
         """
         Initialize a buffer with 'data'.
         """
-        self.buffer = bytes(data, encoding='utf-8')
+        self._chunks = deque()
+        self._offset = 0 # Bytes of self._chunks[0] already consumed.
+        self._len = 0
+        self.write(data)
 
     def read(self, n=-1):
         """
@@ -18,23 +38,48 @@ class Buffer(object):
         If 'n' is larger than the size of the buffer, read and return
         the whole buffer.
         """
+        data = self.peek(n)
+        self.drain(len(data))
+        return data
 
-        if (n < 0) or (n > len(self.buffer)):
-            the_whole_buffer = self.buffer
-            self.buffer = bytes('', encoding='utf-8')
-            return the_whole_buffer
+    def read_views(self, n=-1):
+        """
+        Read 'n' bytes from the buffer and return them as a list of
+        memoryviews, without copying them. The result is meant to be
+        passed to writeSequence().
 
-        data = self.buffer[:n]
-        self.buffer = self.buffer[n:]
-        return data
+        If 'n' is negative, read the whole buffer.
+        If 'n' is larger than the size of the buffer, read the whole
+        buffer.
+        """
+        if (n < 0) or (n > self._len):
+            n = self._len
+
+        views = []
+        while n > 0:
+            chunk = self._chunks[0]
+            available = len(chunk) - self._offset
+            if available > n:
+                views.append(memoryview(chunk)[self._offset:self._offset + n])
+                self._offset += n
+                self._len -= n
+                break
+            views.append(memoryview(chunk)[self._offset:])
+            self._chunks.popleft()
+            self._offset = 0
+            self._len -= available
+            n -= available
+
+        return views
 
     def write(self, data):
         """
         Append 'data' to the buffer.
         """
-        if type(data) == str:
-            data = bytes(data, encoding='utf-8')
-        self.buffer = self.buffer + data
+        data = _to_bytes(data)
+        if data:
+            self._chunks.append(data)
+            self._len += len(data)
 
     def peek(self, n=-1):
         """
@@ -44,11 +89,38 @@ class Buffer(object):
         If 'n' is larger than the size of the buffer, return the whole
         buffer.
         """
+        if (n < 0) or (n > self._len):
+            n = self._len
+        if n == 0:
+            return b''
 
-        if (n < 0) or (n > len(self.buffer)):
-            return self.buffer
+        # Fast path: the data is in the first chunk.
+        first = self._chunks[0]
+        if len(first) - self._offset >= n:
+            if self._offset == 0 and len(first) == n:
+                return first
+            return first[self._offset:self._offset + n]
 
-        return self.buffer[:n]
+        parts = []
+        remaining = n
+        offset = self._offset
+        for chunk in self._chunks:
+            part = chunk[offset:offset + remaining] if (offset or len(chunk) > remaining) else chunk
+            parts.append(part)
+            remaining -= len(part)
+            offset = 0
+            if remaining == 0:
+                break
+        data = b''.join(parts)
+
+        # If we just joined the whole buffer, keep the joined chunk so
+        # that peeking again (a common pattern while waiting for a
+        # complete message) does not have to join again.
+        if n == self._len:
+            self._chunks = deque([data])
+            self._offset = 0
+
+        return data
 
     def drain(self, n=-1):
         """
@@ -58,20 +130,26 @@ class Buffer(object):
         If 'n' is larger than the size of the buffer, drain the whole
         buffer.
         """
-        if (n < 0) or (n > len(self.buffer)):
-            self.buffer = bytes('', encoding='utf-8')
+        if (n < 0) or (n >= self._len):
+            self._chunks.clear()
+            self._offset = 0
+            self._len = 0
             return
 
-        self.buffer = self.buffer[n:]
+        self._len -= n
+        n += self._offset
+        while n >= len(self._chunks[0]):
+            n -= len(self._chunks.popleft())
+        self._offset = n
         return
 
     def __len__(self):
         """Returns length of buffer. Used in len()."""
-        return len(self.buffer)
+        return self._len
 
     def __bool__(self):
         """
         Returns True if the buffer is non-empty.
         Used in truth-value testing.
         """
-        return True if len(self.buffer) else False
+        return self._len > 0
@@ -356,8 +356,12 @@ class ExtORPortClientFactory(network.StaticDestinationClientFactory):
 
 class ExtORPortServerFactory(network.StaticDestinationClientFactory):
     def __init__(self, ext_or_addrport, ext_or_cookie_file, transport_name, transport_class, pt_config):
-        self.ext_or_host = ext_or_addrport[0]
-        self.ext_or_port = ext_or_addrport[1]
+        self.ext_or_unix_path = network.unix_socket_path(ext_or_addrport)
+        if self.ext_or_unix_path:
+            self.ext_or_host = self.ext_or_port = None
+        else:
+            self.ext_or_host = ext_or_addrport[0]
+            self.ext_or_port = ext_or_addrport[1]
         self.cookie_file = ext_or_cookie_file
 
         self.transport_name = transport_name
@@ -372,11 +376,14 @@ class ExtORPortServerFactory(network.StaticDestinationClientFactory):
     def buildProtocol(self, addr):
         log.debug("%s: New connection from %s:%d." % (self.name, log.safe_addr_str(addr.host), addr.port))
 
-        circuit = network.Circuit(self.transport_class())
+        circuit = network.Circuit(self.transport_class(), self.pt_config)
 
         # XXX instantiates a new factory for each client
         clientFactory = ExtORPortClientFactory(circuit, self.cookie_file, addr, self.transport_name)
-        reactor.connectTCP(self.ext_or_host, self.ext_or_port, clientFactory)
+        if self.ext_or_unix_path:
+            reactor.connectUNIX(self.ext_or_unix_path, clientFactory)
+        else:
+            reactor.connectTCP(self.ext_or_host, self.ext_or_port, clientFactory)
 
         return network.StaticDestinationProtocol(circuit, 'server', addr)
 
@@ -2,6 +2,7 @@ import obfsproxy.network.network as network
 import obfsproxy.transports.transports as transports
 import obfsproxy.network.socks as socks
 import obfsproxy.network.extended_orport as extended_orport
+import obfsproxy.network.sockopts as sockopts
 
 from twisted.internet import reactor
 
@@ -10,9 +11,11 @@ def launch_transport_listener(transport, bindaddr, role, remote_addrport, pt_con
     Launch a listener for 'transport' in role 'role' (socks/client/server/ext_server).
 
     If 'bindaddr' is set, then listen on bindaddr. Otherwise, listen
-    on an ephemeral port on localhost.
+    on an ephemeral port on localhost. In 'socks' role, 'bindaddr' can
+    also be a 'unix:<path>' address.
     'remote_addrport' is the TCP/IP address of the other end of the
-    circuit. It's not used if we are in 'socks' role.
+    circuit, or a 'unix:<path>' address. It's not used if we are in
+    'socks' role.
 
     'pt_config' contains configuration options (such as the state location)
     which are of interest to the pluggable transport.
@@ -21,7 +24,8 @@ def launch_transport_listener(transport, bindaddr, role, remote_addrport, pt_con
     ORPort Authentication cookie is stored. It's only used in
     'ext_server' mode.
 
-    Return a tuple (addr, port) representing where we managed to bind.
+    Return a tuple (addr, port) representing where we managed to bind,
+    or the 'unix:<path>' address if we listen on a unix socket.
 
     Throws obfsproxy.transports.transports.TransportNotFound if the
     transport could not be found.
@@ -31,8 +35,11 @@ def launch_transport_listener(transport, bindaddr, role, remote_addrport, pt_con
     """
 
     transport_class = transports.get_transport_class(transport, role)
-    listen_host = bindaddr[0] if bindaddr else 'localhost'
-    listen_port = int(bindaddr[1]) if bindaddr else 0
+    unix_path = network.unix_socket_path(bindaddr)
+    assert(not unix_path or role == 'socks')
+    if not unix_path:
+        listen_host = bindaddr[0] if bindaddr else 'localhost'
+        listen_port = int(bindaddr[1]) if bindaddr else 0
 
     if role == 'socks':
         factory = socks.OBFSSOCKSv5Factory(transport_class, pt_config)
@@ -43,6 +50,17 @@ def launch_transport_listener(transport, bindaddr, role, remote_addrport, pt_con
         assert(remote_addrport)
         factory = network.StaticDestinationServerFactory(remote_addrport, role, transport_class, pt_config)
 
-    addrport = reactor.listenTCP(listen_port, factory, interface=listen_host)
+    if unix_path:
+        # Only our user (tor) may connect.
+        addrport = reactor.listenUNIX(unix_path, factory, mode=0o600, wantPID=True)
+    else:
+        addrport = reactor.listenTCP(listen_port, factory, interface=listen_host)
+
+    # Connections we accept are upstream on the client side, and
+    # downstream on the server side.
+    upstream_options, downstream_options = sockopts.for_config(pt_config)
+    sockopts.apply_to_listener(addrport, upstream_options if role in ('socks', 'client') else downstream_options)
 
+    if unix_path:
+        return bindaddr
     return (addrport.getHost().host, addrport.getHost().port)
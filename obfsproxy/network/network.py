@@ -1,14 +1,48 @@
+import random
+
+from zope.interface import implementer
+
 from twisted.internet import reactor
+from twisted.internet.interfaces import IPushProducer
 from twisted.internet.protocol import Protocol, Factory
 
 import obfsproxy.common.log as logging
 import obfsproxy.common.heartbeat as heartbeat
+import obfsproxy.common.memory as memory
+import obfsproxy.common.metrics as metrics
 
+import obfsproxy.network.admission as admission
 import obfsproxy.network.buffer as obfs_buf
+import obfsproxy.network.pool as pool
+import obfsproxy.network.sockopts as sockopts
 import obfsproxy.transports.base as base
 
 log = logging.get_obfslogger()
 
+circuits_active = metrics.registry.gauge(
+    'obfsproxy_circuits_active', 'Number of circuits currently open.', ('transport',))
+circuits_opened = metrics.registry.counter(
+    'obfsproxy_circuits_opened_total', 'Number of circuits opened.', ('transport',))
+circuits_closed = metrics.registry.counter(
+    'obfsproxy_circuits_closed_total', 'Number of circuits closed.', ('transport',))
+backpressure_pauses = metrics.registry.counter(
+    'obfsproxy_backpressure_pauses_total', 'Number of times reading from a connection was paused.',
+    ('transport', 'reason'))
+metrics.registry.gauge(
+    'obfsproxy_reactor_delayed_calls', 'Number of timers pending in the reactor.',
+    function=lambda: len(reactor.getDelayedCalls()))
+
+# Reasons for not reading from a connection.
+PAUSE_PEER = 'peer' # The other connection of the circuit can't keep up.
+PAUSE_TRANSPORT = 'transport' # The transport queued too much data.
+PAUSE_MEMORY = 'memory' # The circuit exceeds its memory budget.
+PAUSE_ADMISSION = 'admission' # The handshake waits for admission.
+
+UNIX_ADDR_PREFIX = 'unix:' # Prefix of unix socket addresses.
+
+HIGH_WATER_MARK = 256 * 1024 # bytes
+LOW_WATER_MARK = 64 * 1024 # bytes
+
 """
 Networking subsystem:
 
@@ -70,20 +104,54 @@ class Circuit(Protocol):
     Attributes:
     transport: the pluggable transport we should use to
                obfuscate traffic on this circuit.
+    pt_config: the configuration of the listener the circuit belongs
+               to, or None.
 
     downstream: the downstream connection
     upstream: the upstream connection
+
+    high_water_mark: stop reading from upstream when the transport has
+                     queued more than this many bytes.
+    low_water_mark: resume reading from upstream when the transport has
+                    queued at most this many bytes.
+
+    memory_used: bytes our transport holds, as last charged to the
+                 memory budgets.
+    shedding_level: how much the circuit is currently degraded
+                    (memory.OK, memory.PAUSE_READS, ...).
+
+    admission: Deferred of the admission of our handshake, while we
+               wait for it (see requestAdmission).
+    rejected: True if our handshake was not admitted. The circuit is
+              never completed then.
+    handshake_source: source IP of our admitted handshake while it
+                      is in flight, or None.
     """
 
-    def __init__(self, transport):
+    high_water_mark = HIGH_WATER_MARK
+    low_water_mark = LOW_WATER_MARK
+
+    def __init__(self, transport, pt_config=None):
         self.transport = transport # takes a transport
+        self.pt_config = pt_config
         self.downstream = None # takes a connection
         self.upstream = None # takes a connection
 
         self.closed = False # True if the circuit is closed.
 
+        self.memory_used = 0
+        self.shedding_level = memory.OK
+
+        self.admission = None
+        self.rejected = False
+        self.handshake_source = None
+
         self.name = "circ_%s" % hex(id(self))
 
+        self.metrics_labels = (transport.__class__.__name__,)
+        circuits_opened.inc(self.metrics_labels)
+        circuits_active.inc(self.metrics_labels)
+
     def setDownstreamConnection(self, conn):
         """
         Set the downstream connection of a circuit.
@@ -113,7 +181,67 @@ class Circuit(Protocol):
         Return True if the circuit is completed.
         """
 
-        return self.downstream and self.upstream
+        return (self.downstream and self.upstream and not self.admission
+                and not self.rejected)
+
+    def requestAdmission(self, conn, host):
+        """
+        Hold the circuit until the handshake admission control admits
+        the handshake of the downstream connection 'conn' from 'host'.
+
+        Only transports with an expensive handshake go through admission
+        control. Meanwhile, we don't read from 'conn'. If the handshake
+        is rejected, we keep ignoring the peer and close the circuit
+        after a random delay, as an unauthenticated probe would see.
+        """
+        if not (admission.control.enabled and self.transport.expensiveHandshake):
+            return
+
+        conn.pauseReading(PAUSE_ADMISSION)
+        self.admission = admission.control.admit(host)
+        self.admission.addCallbacks(self._admitted, self._rejected, callbackArgs=(conn,))
+
+    def _admitted(self, host, conn):
+        self.admission = None
+        self.handshake_source = host
+        if self.closed:
+            self.handshakeCompleted()
+            return
+
+        conn.resumeReading(PAUSE_ADMISSION)
+        if self.circuitIsReady():
+            self.circuitCompleted(conn)
+
+    def _rejected(self, failure):
+        self.admission = None
+        self.rejected = True
+        if self.closed:
+            return
+        failure.trap(admission.HandshakeRejected)
+        log.info("%s: %s" % (self.name, failure.getErrorMessage()))
+        reactor.callLater(random.uniform(0, admission.REJECT_MAX_DELAY), self.close)
+
+    def handshakeCompleted(self):
+        """
+        Called by transports when their handshake is over, whether it
+        succeeded or not: it no longer counts against the admission
+        control.
+        """
+        if self.handshake_source is not None:
+            admission.control.release(self.handshake_source)
+            self.handshake_source = None
+
+    def otherConnection(self, conn):
+        """
+        Return the connection of the circuit that is not 'conn', or None
+        if it is not set yet.
+        """
+
+        if conn is self.upstream:
+            return self.downstream
+        if conn is self.downstream:
+            return self.upstream
+        return None
 
     def circuitCompleted(self, conn_to_flush):
         """
@@ -129,17 +257,24 @@ class Circuit(Protocol):
         # Set us as the circuit of our pluggable transport instance.
         self.transport.circuit = self
 
+        # Tune the sockets before anything gets written to them.
+        upstream_options, downstream_options = sockopts.for_config(self.pt_config)
+        upstream_options.apply(self.upstream.transport)
+        downstream_options.apply(self.downstream.transport)
+
+        # Let each connection throttle the other one.
+        self.upstream.registerAsProducer()
+        self.downstream.registerAsProducer()
+
         # Call the transport-specific circuitConnected method since
         # this is a good time to perform a handshake.
         self.transport.circuitConnected()
 
-        # Do a dummy dataReceived on the initiating connection in case
-        # it has any buffered data that must be flushed to the network.
-        #
-        # (We use callLater because we want to return back to the
-        # event loop so that any messages we send in circuitConnected get sent
-        # to the network immediately.)
-        reactor.callLater(0.01, conn_to_flush.dataReceived, '')
+        # Flush any data that the initiating connection buffered while
+        # the circuit was incomplete. Whatever circuitConnected() wrote
+        # is already queued on the transport, so it still goes first.
+        if not self.closed and conn_to_flush.buffer:
+            conn_to_flush.dataReceived(b'')
 
     def dataReceived(self, data, conn):
         """
@@ -159,13 +294,75 @@ class Circuit(Protocol):
             if conn is self.downstream:
                 log.debug("%s: downstream: Received %d bytes." % (self.name, len(data)))
                 self.transport.receivedDownstream(data)
+                self.updateMemoryUsage()
             else:
                 log.debug("%s: upstream: Received %d bytes." % (self.name, len(data)))
                 self.transport.receivedUpstream(data)
+                self.updateBackpressure()
+                self.updateMemoryUsage()
         except base.PluggableTransportError as err: # Our transport didn't like that data.
             log.info("%s: %s: Closing circuit." % (self.name, str(err)))
             self.close()
 
+    def updateBackpressure(self):
+        """
+        Pause or resume reading from the upstream connection, depending
+        on how much upstream data our transport has queued.
+
+        Called whenever we pass upstream data to the transport, and by
+        transports whenever their queue shrinks.
+        """
+        if self.closed or not self.upstream:
+            return
+
+        queued = self.transport.getQueuedBytes()
+        if queued > self.high_water_mark:
+            self.upstream.pauseReading(PAUSE_TRANSPORT)
+        elif queued <= self.low_water_mark:
+            self.upstream.resumeReading(PAUSE_TRANSPORT)
+
+    def updateMemoryUsage(self):
+        """
+        Charge the memory held by our transport to the memory budgets,
+        and degrade or recover the circuit accordingly.
+
+        Transports call this whenever they append to or drain their
+        buffers.
+        """
+        if self.closed:
+            return
+
+        used = self.transport.getMemoryUsage()
+        level = memory.budget.charge(self.memory_used, used)
+        self.memory_used = used
+        if level == self.shedding_level:
+            return
+
+        if level > self.shedding_level:
+            log.info("%s: Using %d bytes of memory: %s." %
+                     (self.name, used, memory.LEVEL_NAMES[level]))
+            memory.shedding_events.inc(self.metrics_labels + (memory.LEVEL_NAMES[level],))
+        self.shedding_level = level
+
+        if level >= memory.CLOSE:
+            self.close()
+            return
+
+        for conn in (self.upstream, self.downstream):
+            if not conn:
+                continue
+            if level >= memory.PAUSE_READS:
+                conn.pauseReading(PAUSE_MEMORY)
+            else:
+                conn.resumeReading(PAUSE_MEMORY)
+
+    def shouldDropPadding(self):
+        """
+        Return True if the transport should not send padding, because
+        the circuit exceeds its memory budget.
+        """
+        return self.shedding_level >= memory.DROP_PADDING
+
     def close(self, reason=None, side=None):
         """
         Tear down the circuit. The reason for the torn down circuit is given in
@@ -178,6 +375,13 @@ class Circuit(Protocol):
         log.debug("%s: Tearing down circuit." % self.name)
 
         self.closed = True
+        circuits_closed.inc(self.metrics_labels)
+        circuits_active.dec(self.metrics_labels)
+        if self.admission:
+            self.admission.cancel()
+        self.handshakeCompleted()
+        memory.budget.release(self.memory_used)
+        self.memory_used = 0
 
         if self.downstream:
             self.downstream.close()
@@ -186,21 +390,29 @@ class Circuit(Protocol):
 
         self.transport.circuitDestroyed(reason, side)
 
+@implementer(IPushProducer)
 class GenericProtocol(Protocol, object):
     """
     Generic obfsproxy connection. Contains useful methods and attributes.
 
+    The connection is the producer of its own transport (see
+    registerAsProducer()): when Twisted tells us to pause producing,
+    we pause reading from the other connection of the circuit.
+
     Attributes:
     circuit: The circuit object this connection belongs to.
     buffer: Buffer that holds data that can't be proxied right
             away. This can happen because the circuit is not yet
             complete, or because the pluggable transport needs more
             data before deciding what to do.
+    pause_reasons: Set of the reasons (PAUSE_*) we are currently not
+                   reading from this connection.
     """
     def __init__(self, circuit):
         self.circuit = circuit
         self.buffer = obfs_buf.Buffer()
         self.closed = False # True if connection is closed.
+        self.pause_reasons = set()
 
     def connectionLost(self, reason):
         log.debug("%s: Connection was lost (%s)." % (self.name, reason.getErrorMessage()))
@@ -222,6 +434,73 @@ class GenericProtocol(Protocol, object):
 
         self.transport.write(buf)
 
+    def writeSequence(self, bufs):
+        """
+        Write the list of buffers 'bufs' (e.g. the memoryviews returned by
+        Buffer.read_views()) to the underlying transport without joining them.
+        """
+        if self.closed:
+            log.debug("%s: Calling writeSequence() while connection is closed. Ignoring.", self.name)
+            return
+
+        log.debug("%s: Writing %d bytes." % (self.name, sum(len(buf) for buf in bufs)))
+
+        self.transport.writeSequence(bufs)
+
+    def registerAsProducer(self):
+        """
+        Register us as the streaming producer of our transport, so that
+        we get told when its outgoing buffer fills up and drains.
+        """
+        self.transport.registerProducer(self, True)
+
+    def pauseProducing(self):
+        """
+        Our outgoing buffer is full: stop reading from the other side.
+        """
+        other = self.circuit.otherConnection(self)
+        if other:
+            other.pauseReading(PAUSE_PEER)
+
+    def resumeProducing(self):
+        """
+        Our outgoing buffer drained: resume reading from the other side.
+        """
+        other = self.circuit.otherConnection(self)
+        if other:
+            other.resumeReading(PAUSE_PEER)
+
+    def stopProducing(self):
+        """
+        Our transport is going away. connectionLost() will close us.
+        """
+
+    def pauseReading(self, reason):
+        """
+        Stop reading from the network because of 'reason' (PAUSE_*).
+        """
+        if self.closed or reason in self.pause_reasons:
+            return
+
+        if not self.pause_reasons:
+            log.debug("%s: Pausing reads (%s)." % (self.name, reason))
+            self.transport.pauseProducing()
+        self.pause_reasons.add(reason)
+        backpressure_pauses.inc(self.circuit.metrics_labels + (reason,))
+
+    def resumeReading(self, reason):
+        """
+        'reason' (PAUSE_*) for not reading from the network went away.
+        Resume reading if there is no other reason left.
+        """
+        if self.closed or reason not in self.pause_reasons:
+            return
+
+        self.pause_reasons.discard(reason)
+        if not self.pause_reasons:
+            log.debug("%s: Resuming reads (%s)." % (self.name, reason))
+            self.transport.resumeProducing()
+
     def close(self, also_close_circuit=True):
         """
         Close the connection.
@@ -286,6 +565,7 @@ class StaticDestinationProtocol(GenericProtocol):
             # Gather some statistics for our heartbeat.
             heartbeat.heartbeat.register_connection(self.peer_addr.host)
 
+            self.circuit.requestAdmission(self, self.peer_addr.host)
             self.circuit.setDownstreamConnection(self)
         elif self.mode == 'server':
             log.debug("%s: connectionMade (server): " \
@@ -355,14 +635,21 @@ class StaticDestinationServerFactory(Factory):
     remote_host: The IP/DNS information of the host on the other side
                  of the circuit.
     remote_port: The TCP port fo the host on the other side of the circuit.
+    remote_unix_path: The path of the unix socket on the other side of
+                      the circuit, if we connect to a unix socket
+                      instead of remote_host:remote_port.
     mode: 'server' or 'client'
     transport: the pluggable transport we should use to
                obfuscate traffic on this connection.
     pt_config: an object containing config options for the transport.
     """
     def __init__(self, remote_addrport, mode, transport_class, pt_config):
-        self.remote_host = remote_addrport[0]
-        self.remote_port = int(remote_addrport[1])
+        self.remote_unix_path = unix_socket_path(remote_addrport)
+        if self.remote_unix_path:
+            self.remote_host = self.remote_port = None
+        else:
+            self.remote_host = remote_addrport[0]
+            self.remote_port = int(remote_addrport[1])
         self.mode = mode
         self.transport_class = transport_class
         self.pt_config = pt_config
@@ -374,14 +661,34 @@ class StaticDestinationServerFactory(Factory):
     def startFactory(self):
         log.debug("%s: Starting up static destination server factory." % self.name)
 
+        # Client mode always connects to the same bridge: warm up the pool.
+        connection_pool = self.getConnectionPool()
+        if connection_pool:
+            connection_pool.warm(self.remote_host, self.remote_port)
+
+    def getConnectionPool(self):
+        """
+        Return the pool of pre-connected downstream connections to use,
+        or None. Only the client side pools connections.
+        """
+        if self.mode != 'client' or self.remote_unix_path:
+            return None
+        return pool.get_pool(self.pt_config.proxy)
+
     def buildProtocol(self, addr):
         log.debug("%s: New connection from %s:%d." % (self.name, log.safe_addr_str(addr.host), addr.port))
-        circuit = Circuit(self.transport_class())
+        circuit = Circuit(self.transport_class(), self.pt_config)
 
         # XXX instantiates a new factory for each client
         clientFactory = StaticDestinationClientFactory(circuit, self.mode)
 
-        if self.pt_config.proxy:
+        connection_pool = self.getConnectionPool()
+        d = connection_pool.claim(self.remote_host, self.remote_port, clientFactory) if connection_pool else None
+        if d:
+            d.addErrback(lambda failure: clientFactory.clientConnectionFailed(None, failure))
+        elif self.remote_unix_path:
+            reactor.connectUNIX(self.remote_unix_path, clientFactory)
+        elif self.pt_config.proxy:
             create_proxy_client(self.remote_host, self.remote_port,
                                 self.pt_config.proxy,
                                 clientFactory)
@@ -390,6 +697,15 @@ class StaticDestinationServerFactory(Factory):
 
         return StaticDestinationProtocol(circuit, self.mode, addr)
 
+def unix_socket_path(addr):
+    """
+    Return the path of the 'unix:<path>' address 'addr', or None if
+    'addr' is a (host, port) pair.
+    """
+    if isinstance(addr, str) and addr.startswith(UNIX_ADDR_PREFIX):
+        return addr[len(UNIX_ADDR_PREFIX):]
+    return None
+
 def create_proxy_client(host, port, proxy_spec, instance):
     """
     host:
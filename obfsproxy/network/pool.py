@@ -0,0 +1,263 @@
+from collections import deque
+
+from twisted.internet import reactor, defer, error, protocol
+
+import obfsproxy.common.log as logging
+import obfsproxy.common.metrics as metrics
+
+log = logging.get_obfslogger()
+
+"""
+Pool of pre-connected downstream connections, for client mode.
+
+Opening a downstream connection costs a TCP handshake to the bridge,
+plus the proxy handshake if we use an outgoing proxy, before the
+transport can even start its own handshake. A ConnectionPool keeps a
+few of these connections established in advance for each bridge we
+are using, so that new circuits can claim one instantly.
+
+A pooled connection is a plain connected socket: nothing has been sent
+over it yet, so it can be handed to any transport. While it's idle, a
+_PooledConnection protocol holds it; when it's claimed, the real
+protocol is attached to its transport and the _PooledConnection
+forwards it the events it gets.
+
+Pools are refilled in the background after every claim. Bridges that
+were not used for 'idle_ttl' seconds are not refilled anymore, and idle
+connections are closed after 'idle_ttl' seconds.
+"""
+
+DEFAULT_IDLE_TTL = 60 # seconds
+
+pool_size = 0 # Pooled connections per bridge. 0 disables pooling.
+pool_idle_ttl = DEFAULT_IDLE_TTL
+
+_pools = {} # Outgoing proxy -> ConnectionPool
+
+pool_claims = metrics.registry.counter(
+    'obfsproxy_pool_claims_total',
+    'Number of downstream connections requested from the connection pool.', ('result',))
+pool_expired = metrics.registry.counter(
+    'obfsproxy_pool_expired_total', 'Number of idle pooled connections closed.')
+metrics.registry.gauge(
+    'obfsproxy_pool_idle_connections', 'Number of idle pooled connections.',
+    function=lambda: sum(len(p) for p in list(_pools.values())))
+
+def configure(size, idle_ttl=DEFAULT_IDLE_TTL):
+    """
+    Keep 'size' pre-connected connections per bridge, for at most
+    'idle_ttl' seconds. Throws ValueError if the values are invalid.
+    """
+    global pool_size, pool_idle_ttl
+
+    if size < 0 or idle_ttl <= 0:
+        raise ValueError("Invalid connection pool settings (size: %s, idle TTL: %s)." % (size, idle_ttl))
+    pool_size = size
+    pool_idle_ttl = idle_ttl
+
+def get_pool(proxy=None):
+    """
+    Return the ConnectionPool for connections through the outgoing
+    'proxy' (see pyptlib.client_config.parseProxyURI()), or None if
+    pooling is disabled.
+    """
+
+    if pool_size <= 0:
+        return None
+    if proxy not in _pools:
+        _pools[proxy] = ConnectionPool(pool_size, pool_idle_ttl, proxy)
+    return _pools[proxy]
+
+class _PooledConnection(protocol.Protocol):
+    """
+    Holds an idle pooled connection, and relays the events of the
+    connection to the protocol that claims it.
+
+    Attributes:
+    pool: The ConnectionPool we belong to.
+    key: The (host, port) we are connected to.
+    owner: The protocol that claimed us, if any.
+    expiry: The call that closes us if we stay idle for too long.
+    lost: True if the connection was lost.
+    """
+
+    def __init__(self, pool, key):
+        self.pool = pool
+        self.key = key
+        self.owner = None
+        self.expiry = None
+        self.lost = False
+
+    def connectionMade(self):
+        if hasattr(self.transport, 'setTcpKeepAlive'):
+            self.transport.setTcpKeepAlive(True)
+
+    def dataReceived(self, data):
+        if self.owner:
+            self.owner.dataReceived(data)
+            return
+
+        # The bridge is not supposed to talk first.
+        log.debug("Pooled connection received data while idle. Closing it.")
+        self.pool.discard(self)
+        self.transport.loseConnection()
+
+    def connectionLost(self, reason):
+        self.lost = True
+        if self.owner:
+            self.owner.connectionLost(reason)
+        else:
+            self.pool.discard(self)
+
+    def attach(self, owner):
+        """Hand our connection over to the protocol 'owner'."""
+
+        self.owner = owner
+        owner.makeConnection(self.transport)
+
+class _PooledConnectionFactory(protocol.Factory):
+    """Builds _PooledConnections. Used when connecting through a proxy."""
+
+    def __init__(self, pool, key):
+        self.pool = pool
+        self.key = key
+
+    def buildProtocol(self, addr):
+        return _PooledConnection(self.pool, self.key)
+
+class ConnectionPool(object):
+    """
+    Pre-connected downstream connections to the bridges we use.
+
+    Attributes:
+    size: Number of connections to keep per bridge.
+    idle_ttl: Seconds an idle connection (or an unused bridge) is kept.
+    proxy: The outgoing proxy to connect through, or None.
+    idle: Dictionary mapping (host, port) to a deque of idle connections.
+    pending: Dictionary mapping (host, port) to the number of
+             connections in progress.
+    last_used: Dictionary mapping (host, port) to the last time a
+               connection to it was requested.
+    """
+
+    def __init__(self, size, idle_ttl=DEFAULT_IDLE_TTL, proxy=None, reactor=reactor):
+        self.size = size
+        self.idle_ttl = idle_ttl
+        self.proxy = proxy
+        self.reactor = reactor
+
+        self.idle = {}
+        self.pending = {}
+        self.last_used = {}
+
+    def warm(self, host, port):
+        """Start keeping connections to 'host':'port'."""
+
+        key = (host, port)
+        self.last_used[key] = self.reactor.seconds()
+        self._refill(key)
+
+    def claim(self, host, port, factory):
+        """
+        Connect a protocol of 'factory' to 'host':'port' using a pooled
+        connection.
+
+        Return a Deferred that fires with the protocol once it's
+        connected, or None if there was no pooled connection; the caller
+        should then connect as usual. The pool gets refilled in both
+        cases.
+        """
+
+        key = (host, port)
+        self.last_used[key] = self.reactor.seconds()
+        self.reactor.callLater(0, self._refill, key)
+
+        conn = None
+        idle = self.idle.get(key)
+        while idle and not conn:
+            conn = idle.popleft()
+            if conn.lost:
+                conn = None
+        if not conn:
+            pool_claims.inc(('miss',))
+            return None
+
+        pool_claims.inc(('hit',))
+        if conn.expiry and conn.expiry.active():
+            conn.expiry.cancel()
+
+        # Let the caller finish setting up before the protocol gets
+        # connected, as it would with a fresh connection.
+        d = defer.Deferred()
+        self.reactor.callLater(0, self._hand_over, conn, factory, d)
+        return d
+
+    def _hand_over(self, conn, factory, d):
+        if conn.lost:
+            d.errback(error.ConnectError(string="Pooled connection was lost."))
+            return
+
+        owner = factory.buildProtocol(conn.transport.getPeer())
+        conn.attach(owner)
+        d.callback(owner)
+
+    def discard(self, conn):
+        """Forget about the idle connection 'conn'."""
+
+        idle = self.idle.get(conn.key)
+        if idle and conn in idle:
+            idle.remove(conn)
+        if conn.expiry and conn.expiry.active():
+            conn.expiry.cancel()
+
+    def _refill(self, key):
+        """Open connections to 'key' until we have 'size' of them."""
+
+        last_used = self.last_used.get(key)
+        if last_used is None:
+            return
+        if self.reactor.seconds() - last_used > self.idle_ttl:
+            log.debug("Stopped pooling connections to an unused bridge.")
+            del self.last_used[key]
+            return
+
+        missing = self.size - len(self.idle.get(key, ())) - self.pending.get(key, 0)
+        for _ in range(missing):
+            self._connect(key)
+
+    def _connect(self, key):
+        # Inline import since network.py imports us.
+        import obfsproxy.network.network as network
+
+        host, port = key
+        self.pending[key] = self.pending.get(key, 0) + 1
+        if self.proxy:
+            d = network.create_proxy_client(host, port, self.proxy,
+                                            _PooledConnectionFactory(self, key))
+        else:
+            d = protocol.ClientCreator(self.reactor, _PooledConnection, self, key).connectTCP(host, port)
+        d.addCallbacks(self._connected, self._failed, callbackArgs=(key,), errbackArgs=(key,))
+
+    def _connected(self, conn, key):
+        self.pending[key] -= 1
+        if conn.lost:
+            return
+
+        conn.expiry = self.reactor.callLater(self.idle_ttl, self._expire, conn)
+        self.idle.setdefault(key, deque()).append(conn)
+
+    def _failed(self, failure, key):
+        # Don't retry right away: the next claim will.
+        self.pending[key] -= 1
+        log.debug("Could not open a pooled connection (%s)." % failure.getErrorMessage())
+
+    def _expire(self, conn):
+        self.discard(conn)
+        pool_expired.inc()
+        conn.transport.loseConnection()
+        self._refill(conn.key)
+
+    def __len__(self):
+        """Return the number of idle connections."""
+
+        return sum(len(idle) for idle in list(self.idle.values()))
@@ -0,0 +1,161 @@
+import socket
+import sys
+
+import obfsproxy.common.log as logging
+
+log = logging.get_obfslogger()
+
+"""
+Socket tuning.
+
+The timing of the padding sent by the wfpad defenses is easily blurred
+by the kernel: Nagle's algorithm holds small messages back until the
+previous ones are acknowledged, delayed ACKs hold the acknowledgements
+back, and large send buffers queue messages long after we "sent" them.
+
+A SocketOptions object is a set of options that gets applied to the
+sockets of a kind of connection. Each circuit applies one set to its
+upstream socket and one set to its downstream socket when it is
+completed (see network.Circuit), and listeners apply the buffer sizes
+of the connections they accept to their listening socket, so that the
+TCP window scale is negotiated accordingly.
+
+Options are specified as comma-separated 'name[=value]' strings, e.g.
+'nodelay,notsent_lowat=16384'. A bare name means 1. The options are:
+
+  nodelay        TCP_NODELAY: disable Nagle's algorithm.
+  quickack       TCP_QUICKACK: disable delayed ACKs. Linux clears it
+                 again over time, so this is only a hint.
+  keepalive      SO_KEEPALIVE.
+  sndbuf         SO_SNDBUF, in bytes.
+  rcvbuf         SO_RCVBUF, in bytes.
+  notsent_lowat  TCP_NOTSENT_LOWAT, in bytes: limit the unsent data
+                 queued in the kernel, so that our writes reflect what
+                 is on the wire.
+
+Options that the platform does not support are skipped.
+"""
+
+DEFAULT_UPSTREAM = 'nodelay'
+DEFAULT_DOWNSTREAM = 'nodelay'
+
+# TCP_NOTSENT_LOWAT is missing from the socket module of older Pythons.
+_TCP_NOTSENT_LOWAT = getattr(socket, 'TCP_NOTSENT_LOWAT',
+                             25 if sys.platform.startswith('linux') else None)
+
+# Option name -> (level, optname, whether it's a TCP-only option)
+OPTIONS = {
+    'nodelay': (socket.IPPROTO_TCP, getattr(socket, 'TCP_NODELAY', None), True),
+    'quickack': (socket.IPPROTO_TCP, getattr(socket, 'TCP_QUICKACK', None), True),
+    'keepalive': (socket.SOL_SOCKET, socket.SO_KEEPALIVE, True),
+    'sndbuf': (socket.SOL_SOCKET, socket.SO_SNDBUF, False),
+    'rcvbuf': (socket.SOL_SOCKET, socket.SO_RCVBUF, False),
+    'notsent_lowat': (socket.IPPROTO_TCP, _TCP_NOTSENT_LOWAT, True),
+}
+
+# Options that must be set on the listening socket to take effect on
+# the handshake of the connections it accepts.
+LISTENER_OPTIONS = ('sndbuf', 'rcvbuf')
+
+class SocketOptions(object):
+    """
+    A set of socket options.
+
+    Attributes:
+    options: Dictionary mapping option names (see OPTIONS) to values.
+    """
+
+    def __init__(self, options=None):
+        self.options = dict(options or {})
+
+    @classmethod
+    def parse(cls, spec):
+        """
+        Return the SocketOptions described by the string 'spec'.
+        Throws ValueError if 'spec' is invalid.
+        """
+
+        options = {}
+        for item in (spec or '').split(','):
+            item = item.strip()
+            if not item:
+                continue
+            name, _, value = item.partition('=')
+            name = name.strip().lower()
+            if name not in OPTIONS:
+                raise ValueError("Unknown socket option '%s'." % name)
+            try:
+                options[name] = int(value) if value else 1
+            except ValueError:
+                raise ValueError("Invalid value for socket option '%s': '%s'." % (name, value))
+            if options[name] < 0:
+                raise ValueError("Invalid value for socket option '%s': '%s'." % (name, value))
+        return cls(options)
+
+    def apply(self, transport, names=None):
+        """
+        Set our options (or the ones in 'names') on the socket of the
+        Twisted 'transport'. Does nothing if the transport is not backed
+        by a socket (e.g. if it goes through a proxy wrapper).
+        """
+
+        sock = get_socket(transport)
+        if sock is None:
+            return
+
+        is_tcp = sock.family in (socket.AF_INET, socket.AF_INET6)
+        for name, value in list(self.options.items()):
+            if names is not None and name not in names:
+                continue
+            level, optname, tcp_only = OPTIONS[name]
+            if optname is None or (tcp_only and not is_tcp):
+                continue
+            try:
+                sock.setsockopt(level, optname, value)
+            except (OSError, socket.error) as err:
+                log.debug("Could not set socket option %s=%d (%s)." % (name, value, err))
+
+    def __str__(self):
+        return ','.join("%s=%d" % item for item in sorted(self.options.items()))
+
+def get_socket(transport):
+    """
+    Return the socket of the Twisted 'transport', or None if it is not
+    backed by a socket.
+    """
+
+    get_handle = getattr(transport, 'getHandle', None)
+    if get_handle is None:
+        return None
+    sock = get_handle()
+    return sock if isinstance(sock, socket.socket) else None
+
+upstream = SocketOptions.parse(DEFAULT_UPSTREAM)
+downstream = SocketOptions.parse(DEFAULT_DOWNSTREAM)
+
+def configure(upstream_spec, downstream_spec):
+    """
+    Set the default options of upstream and downstream sockets.
+    Throws ValueError if a spec is invalid.
+    """
+    global upstream, downstream
+
+    upstream, downstream = SocketOptions.parse(upstream_spec), SocketOptions.parse(downstream_spec)
+
+def for_config(pt_config):
+    """
+    Return the (upstream, downstream) SocketOptions to use for the
+    listener configured by 'pt_config', which can override the defaults.
+    """
+
+    up = pt_config and pt_config.upstreamSocketOptions
+    down = pt_config and pt_config.downstreamSocketOptions
+    return (up or upstream, down or downstream)
+
+def apply_to_listener(port, options):
+    """
+    Set the options of 'options' that affect accepted connections on
+    the listening Twisted 'port'.
+    """
+
+    options.apply(port, LISTENER_OPTIONS)
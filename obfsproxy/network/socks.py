@@ -4,6 +4,7 @@ from twisted.internet import reactor, protocol
 
 import obfsproxy.common.log as logging
 import obfsproxy.network.network as network
+import obfsproxy.network.pool as pool
 import obfsproxy.network.socks5 as socks5
 import obfsproxy.transports.base as base
 
@@ -106,6 +107,16 @@ class OBFSSOCKSv5Protocol(socks5.SOCKSv5Protocol, network.GenericProtocol):
         self.buffer.write(data)
         self.circuit.dataReceived(self.buffer, self)
 
+    def processEarlyData(self, data):
+        """
+        The client sent data right after its CONNECT request. Hand it to
+        the circuit as soon as it is complete (see set_up_circuit()),
+        instead of waiting for the client to receive our reply.
+        """
+        self.buffer.write(data)
+        if self.circuit.circuitIsReady():
+            self.circuit.dataReceived(self.buffer, self)
+
     def processRfc1929Auth(self, uname, passwd):
         """
         Handle the Pluggable Transport variant of RFC1929 Username/Password
@@ -148,9 +159,16 @@ class OBFSSOCKSv5Protocol(socks5.SOCKSv5Protocol, network.GenericProtocol):
         Instantiate the outgoing connection.
 
         This is overriden so that our sub-classed SOCKSv5Outgoing gets created,
-        and a proxy is optionally used for the outgoing connection.
+        a pre-connected connection is used if there is one, and a proxy is
+        optionally used for the outgoing connection.
         """
 
+        connection_pool = pool.get_pool(self.pt_config.proxy)
+        if connection_pool:
+            d = connection_pool.claim(addr, port, OBFSSOCKSv5OutgoingFactory(self))
+            if d:
+                return d
+
         if self.pt_config.proxy:
             instance = OBFSSOCKSv5OutgoingFactory(self)
             return network.create_proxy_client(addr, port, self.pt_config.proxy, instance)
@@ -161,6 +179,10 @@ class OBFSSOCKSv5Protocol(socks5.SOCKSv5Protocol, network.GenericProtocol):
         self.circuit.setDownstreamConnection(otherConn)
         self.circuit.setUpstreamConnection(self)
 
+        # Pass on the data the client pipelined while we were connecting.
+        if self.buffer:
+            self.circuit.dataReceived(self.buffer, self)
+
 class OBFSSOCKSv5Factory(protocol.Factory):
     """
     A SOCKSv5 factory.
@@ -179,6 +201,6 @@ class OBFSSOCKSv5Factory(protocol.Factory):
     def buildProtocol(self, addr):
         log.debug("%s: New connection." % self.name)
 
-        circuit = network.Circuit(self.transport_class())
+        circuit = network.Circuit(self.transport_class(), self.pt_config)
 
         return OBFSSOCKSv5Protocol(circuit, self.pt_config)
@@ -166,6 +166,10 @@ class SOCKSv5Protocol(protocol.Protocol):
         if self.state == self.ST_ESTABLISHED:
             self.processEstablishedData(data)
             return
+        if self.state == self.ST_CONNECTING:
+            # The client did not wait for our reply.
+            self.processEarlyData(data)
+            return
 
         self.buf.add(data)
         if self.state == self.ST_READ_METHODS:
@@ -174,10 +178,6 @@ class SOCKSv5Protocol(protocol.Protocol):
             self.processAuthentication()
         elif self.state == self.ST_READ_REQUEST:
             self.processRequest()
-        elif self.state == self.ST_CONNECTING:
-            # This only happens when the client is busted
-            log.error("Client sent data before receiving response")
-            self.transport.loseConnection()
         else:
             log.error("Invalid state in SOCKS5 Server: '%d'" % self.state)
             self.transport.loseConnection()
@@ -186,6 +186,17 @@ class SOCKSv5Protocol(protocol.Protocol):
         assert self.otherConn
         self.otherConn.write(data)
 
+    def processEarlyData(self, data):
+        """
+        Handle data the client sent after its CONNECT request, without
+        waiting for our reply.
+
+        By default, it's kept in the buffer and proxied once the
+        connection is established. Subclasses can forward it earlier.
+        """
+
+        self.buf.add(data)
+
     def processMethodSelect(self):
         """
         Parse Version Identifier/Method Selection Message, and send a response
@@ -391,11 +402,9 @@ class SOCKSv5Protocol(protocol.Protocol):
             return
         port = msg.get_uint16(True)
 
-        # Ensure there is no trailing garbage
-        if len(msg) > 0:
-            log.error("Peer sent trailing garbage after request")
-            self.transport.loseConnection()
-            return
+        # Anything after the request is data that the client pipelined
+        # without waiting for our reply.
+        early_data = msg.get(len(msg))
         self.buf.clear()
 
         if cmd == _SOCKS_CMD_CONNECT:
@@ -408,6 +417,10 @@ class SOCKSv5Protocol(protocol.Protocol):
             # Should *NEVER* happen
             log.error("Unimplemented command received")
             self.transport.loseConnection()
+            return
+
+        if early_data and self.state == self.ST_CONNECTING:
+            self.processEarlyData(early_data)
 
     def processCmdConnect(self, addr, port):
         """
@@ -478,6 +491,12 @@ class SOCKSv5Protocol(protocol.Protocol):
 
         if reply == SOCKSv5Reply.Succeeded:
             self.state = self.ST_ESTABLISHED
+
+            # Proxy the data we got while connecting.
+            if self.buf:
+                data = bytes(self.buf)
+                self.buf.clear()
+                self.processEstablishedData(data)
         else:
             self.transport.loseConnection()
 
@@ -495,6 +514,8 @@ class _ByteBuffer(bytearray):
     """
     A byte buffer, based on bytearray.  get_* always removes reads from the
     head (and is destructive), and add_* appends to the tail.
+
+    Parsers should use peek() instead, which returns a _ByteReader.
     """
 
     def add_uint8(self, val):
@@ -592,11 +613,12 @@ class _ByteBuffer(bytearray):
         return bytes(ret)
 
     def peek(self):
-        """Clone the buffer."""
+        """
+        Return a _ByteReader over the buffer.  Reading from it neither
+        modifies nor copies the buffer.
+        """
 
-        ret = _ByteBuffer()
-        ret[:] = self
-        return ret
+        return _ByteReader(self)
 
     def clear(self):
         """Clear the contents of the buffer."""
@@ -605,3 +627,65 @@ class _ByteBuffer(bytearray):
 
     def __repr__(self):
         return self.decode('ISO-8859-1')
+
+
+class _ByteReader(object):
+    """
+    A read cursor over a byte buffer.  get_* read from the cursor and
+    advance it, so a message is parsed in place, without reslicing the
+    buffer.  The buffer must not be modified while the reader is in use.
+    """
+
+    __slots__ = ['buf', 'pos']
+
+    def __init__(self, buf):
+        self.buf = buf
+        self.pos = 0
+
+    def get_uint8(self):
+        """Read a uint8_t and advance the cursor."""
+
+        ret = self.buf[self.pos]
+        self.pos += 1
+        return ret
+
+    def get_uint16(self, ntohs=False):
+        """
+        Read a uint16_t and advance the cursor.
+
+        Kwargs:
+            ntohs (bool): Convert from network byte order?
+        """
+
+        ret = struct.unpack_from("!H" if ntohs else "H", self.buf, self.pos)[0]
+        self.pos += 2
+        return ret
+
+    def get_uint32(self, ntohl=False):
+        """
+        Read a uint32_t and advance the cursor.
+
+        Kwargs:
+            ntohl (bool): Convert from network byte order?
+        """
+
+        ret = struct.unpack_from("!I" if ntohl else "I", self.buf, self.pos)[0]
+        self.pos += 4
+        return ret
+
+    def get(self, length):
+        """
+        Read bytes and advance the cursor.
+
+        Args:
+            length (int): The number of bytes to read.
+        """
+
+        ret = bytes(self.buf[self.pos:self.pos + length])
+        self.pos += len(ret)
+        return ret
+
+    def __len__(self):
+        """Return the number of bytes left to read."""
+
+        return len(self.buf) - self.pos
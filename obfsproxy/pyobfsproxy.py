@@ -7,15 +7,24 @@ It is designed to be a drop-in replacement for the obfsproxy executable.
 Currently, not all of the obfsproxy command line options have been implemented.
 """
 
+import signal
 import sys
 
+import obfsproxy.network.admission as admission
 import obfsproxy.network.launch_transport as launch_transport
 import obfsproxy.network.network as network
+import obfsproxy.network.pool as pool
+import obfsproxy.network.sockopts as sockopts
+import obfsproxy.transports.obfs3_dh as obfs3_dh
 import obfsproxy.transports.transports as transports
 import obfsproxy.common.log as logging
 import obfsproxy.common.argparser as argparser
 import obfsproxy.common.heartbeat as heartbeat
+import obfsproxy.common.memory as memory
+import obfsproxy.common.metrics as metrics
+import obfsproxy.common.profiler as profiler
 import obfsproxy.common.transport_config as transport_config
+import obfsproxy.common.workers as workers
 import obfsproxy.managed.server as managed_server
 import obfsproxy.managed.client as managed_client
 from obfsproxy import __version__
@@ -56,6 +65,74 @@ def set_up_cli_parsing():
 
     parser.add_argument('--proxy', action='store', dest='proxy',
                         help='Outgoing proxy (<proxy_type>://[<user_name>][:<password>][@]<ip>:<port>)')
+    parser.add_argument('--metrics-endpoint', action='store', dest='metrics_endpoint',
+                        help='serve Prometheus metrics on this endpoint ([<ip>:]<port> or unix:<path>)')
+    parser.add_argument('--profile-endpoint', action='store', dest='profile_endpoint',
+                        help='serve on-demand reactor profiles on this endpoint ([<ip>:]<port> or unix:<path>)')
+    parser.add_argument('--profile-on-signal', action='store_true', default=False,
+                        dest='profile_on_signal',
+                        help='profile the reactor when receiving SIGUSR2 and write the '
+                             'collapsed stacks to the data directory')
+    parser.add_argument('--profile-duration', type=float, default=profiler.DEFAULT_DURATION,
+                        dest='profile_duration',
+                        help='seconds to profile for on SIGUSR2 (default: %(default)s)')
+    parser.add_argument('--profile-interval', type=float, default=profiler.DEFAULT_INTERVAL,
+                        dest='profile_interval',
+                        help='milliseconds between two stack samples (default: %(default)s)')
+    parser.add_argument('--circuit-memory-budget', type=int, default=memory.DEFAULT_CIRCUIT_BUDGET,
+                        dest='circuit_memory_budget',
+                        help='bytes a single circuit may buffer before it gets throttled, '
+                             'then stops padding, then gets closed; 0 disables (default: %(default)s)')
+    parser.add_argument('--process-memory-budget', type=int, default=memory.DEFAULT_PROCESS_BUDGET,
+                        dest='process_memory_budget',
+                        help='bytes all circuits together may buffer; 0 disables (default: %(default)s)')
+    parser.add_argument('--upstream-sockopts', default=sockopts.DEFAULT_UPSTREAM,
+                        dest='upstream_sockopts',
+                        help='socket options of connections to and from tor, e.g. '
+                             '"nodelay,quickack,sndbuf=65536" (default: %(default)s)')
+    parser.add_argument('--downstream-sockopts', default=sockopts.DEFAULT_DOWNSTREAM,
+                        dest='downstream_sockopts',
+                        help='socket options of connections to and from the other obfsproxy, e.g. '
+                             '"nodelay,notsent_lowat=16384" (default: %(default)s)')
+    parser.add_argument('--upstream-unix-socket', dest='upstream_unix_socket',
+                        help="managed server: connect to tor's ORPort (or Extended ORPort) "
+                             "through this unix socket instead of over TCP")
+    parser.add_argument('--pool-size', type=int, default=0, dest='pool_size',
+                        help='client side: keep this many connections to each bridge '
+                             'established in advance; 0 disables (default: %(default)s)')
+    parser.add_argument('--pool-idle-ttl', type=float, default=pool.DEFAULT_IDLE_TTL,
+                        dest='pool_idle_ttl',
+                        help='seconds to keep idle pooled connections, and to keep pooling '
+                             'connections to a bridge that is not used (default: %(default)s)')
+    parser.add_argument('--dh-pool-size', type=int, default=0, dest='dh_pool_size',
+                        help='keep this many UniformDH keypairs (obfs3, ScrambleSuit) '
+                             'generated in advance; 0 disables (default: %(default)s)')
+    parser.add_argument('--handshake-workers', choices=workers.MODES, default=workers.AUTO,
+                        dest='handshake_workers',
+                        help='compute the UniformDH secrets of handshakes in threads, or in '
+                             'processes; auto uses threads if gmpy2 releases the GIL '
+                             '(default: %(default)s)')
+    parser.add_argument('--handshake-processes', type=int, default=0, dest='handshake_processes',
+                        help='number of handshake worker processes; 0 means one per CPU '
+                             '(default: %(default)s)')
+    parser.add_argument('--handshake-rate', type=admission.parse_rate, default=(0, 0),
+                        dest='handshake_rate', metavar='RATE[,BURST]',
+                        help='server side: admit at most RATE expensive handshakes per second, '
+                             'in bursts of BURST; 0 disables (default: 0)')
+    parser.add_argument('--handshake-rate-per-ip', type=admission.parse_rate, default=(0, 0),
+                        dest='handshake_rate_per_ip', metavar='RATE[,BURST]',
+                        help='server side: like --handshake-rate, for each source IP (default: 0)')
+    parser.add_argument('--max-handshakes', type=int, default=0, dest='max_handshakes',
+                        help='server side: maximum number of expensive handshakes in flight; '
+                             '0 disables (default: %(default)s)')
+    parser.add_argument('--max-handshakes-per-ip', type=int, default=0, dest='max_handshakes_per_ip',
+                        help='server side: like --max-handshakes, for each source IP '
+                             '(default: %(default)s)')
+    parser.add_argument('--handshake-queue-timeout', type=float,
+                        default=admission.DEFAULT_QUEUE_TIMEOUT, dest='handshake_queue_timeout',
+                        help='seconds a handshake over the limits may wait for admission '
+                             'before its connection is dropped; 0 drops it right away '
+                             '(default: %(default)s)')
 
     # Managed mode is a subparser for now because there are no
     # optional subparsers: bugs.python.org/issue9253
@@ -71,7 +148,7 @@ def set_up_cli_parsing():
 
     return parser
 
-def do_managed_mode():
+def do_managed_mode(args):
     """This function starts obfsproxy's managed-mode functionality."""
 
     if checkClientMode():
@@ -79,7 +156,7 @@ def do_managed_mode():
         managed_client.do_managed_client()
     else:
         log.info('Entering server managed-mode.')
-        managed_server.do_managed_server()
+        managed_server.do_managed_server(args.upstream_unix_socket)
 
 def do_external_mode(args):
     """This function starts obfsproxy's external-mode functionality."""
@@ -101,9 +178,12 @@ def do_external_mode(args):
     # Run setup() method.
     run_transport_setup(pt_config, args.name)
 
-    launch_transport.launch_transport_listener(args.name, args.listen_addr, args.mode, args.dest, pt_config, args.ext_cookie_file)
-    log.info("Launched '%s' listener at '%s:%s' for transport '%s'." % \
-                 (args.mode, log.safe_addr_str(args.listen_addr[0]), args.listen_addr[1], args.name))
+    addrport = launch_transport.launch_transport_listener(args.name, args.listen_addr, args.mode, args.dest, pt_config, args.ext_cookie_file)
+    if isinstance(addrport, str): # unix socket
+        log.info("Launched '%s' listener at '%s' for transport '%s'." % (args.mode, addrport, args.name))
+    else:
+        log.info("Launched '%s' listener at '%s:%s' for transport '%s'." % \
+                     (args.mode, log.safe_addr_str(addrport[0]), addrport[1], args.name))
     reactor.run()
 
 def consider_cli_args(args):
@@ -144,6 +224,33 @@ def consider_cli_args(args):
             log.error("Failed to parse proxy specifier: %s", e)
             sys.exit(1)
 
+    for endpoint in (args.metrics_endpoint, args.profile_endpoint):
+        if not endpoint:
+            continue
+        try:
+            metrics.parse_endpoint(endpoint)
+        except ValueError as err:
+            log.error("Failed to parse endpoint: %s", err)
+            sys.exit(1)
+
+    try:
+        memory.budget.configure(args.circuit_memory_budget, args.process_memory_budget)
+        pool.configure(args.pool_size, args.pool_idle_ttl)
+        obfs3_dh.keypairs.configure(args.dh_pool_size)
+        workers.configure(args.handshake_workers, args.handshake_processes)
+        admission.configure(args.handshake_rate[0], args.handshake_rate[1],
+                            args.handshake_rate_per_ip[0], args.handshake_rate_per_ip[1],
+                            args.max_handshakes, args.max_handshakes_per_ip,
+                            args.handshake_queue_timeout)
+        sockopts.configure(args.upstream_sockopts, args.downstream_sockopts)
+    except ValueError as err:
+        log.error(err)
+        sys.exit(1)
+
+    if args.profile_on_signal and not hasattr(signal, 'SIGUSR2'):
+        log.error("--profile-on-signal is not supported on this platform.")
+        sys.exit(1)
+
 def run_transport_setup(pt_config, transport_name):
     """Run the setup() method for our transports."""
     for transport, transport_class in list(transports.transports.items()):
@@ -171,9 +278,22 @@ def pyobfsproxy():
     l = task.LoopingCall(heartbeat.heartbeat.talk)
     l.start(3600.0, now=False)  # do heartbeat every hour
 
+    # Expose our metrics, if asked to.
+    if args.metrics_endpoint:
+        metrics.listen_metrics_endpoint(args.metrics_endpoint)
+
+    # Set up the on-demand profiler, if asked to.
+    if args.profile_endpoint or args.profile_on_signal:
+        prof = profiler.Profiler(args.data_dir)
+        if args.profile_endpoint:
+            prof.listen(args.profile_endpoint)
+        if args.profile_on_signal:
+            prof.install_signal_handler(signal.SIGUSR2, args.profile_duration,
+                                        args.profile_interval)
+
     # Initiate obfsproxy.
     if (args.name == 'managed'):
-        do_managed_mode()
+        do_managed_mode(args)
     else:
         # Pass parsed arguments to the appropriate transports so that
         # they can initialize and setup themselves. Exit if the
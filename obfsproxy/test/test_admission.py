@@ -0,0 +1,120 @@
+from twisted.internet import defer, task
+from twisted.trial import unittest
+
+import obfsproxy.network.admission as admission
+
+class testHandshakeAdmission(unittest.TestCase):
+    def setUp(self):
+        self.clock = task.Clock()
+        self.control = admission.HandshakeAdmission(self.clock)
+        self.admitted = []
+        self.rejected = []
+
+    def admit(self, host):
+        d = self.control.admit(host)
+        d.addCallbacks(self.admitted.append,
+                       lambda failure: self.rejected.append(failure.trap(admission.HandshakeRejected)))
+        return d
+
+    def count(self, result):
+        return admission.handshakes.get((result,))
+
+    def test_disabled(self):
+        self.assertFalse(self.control.enabled)
+        for _ in range(100):
+            self.admit('1.1.1.1')
+        self.assertEqual(len(self.admitted), 100)
+
+    def test_max_inflight(self):
+        self.control.configure(max_inflight=1)
+        queued = self.count('queued')
+        self.admit('1.1.1.1')
+        self.admit('2.2.2.2')
+        self.assertEqual(self.admitted, ['1.1.1.1'])
+        self.assertEqual(self.count('queued'), queued + 1)
+
+        self.control.release('1.1.1.1')
+        self.assertEqual(self.admitted, ['1.1.1.1', '2.2.2.2'])
+        self.assertEqual(self.control.inflight_total, 1)
+        self.assertFalse(self.control.queue)
+
+    def test_per_ip_limit_doesnt_block_others(self):
+        self.control.configure(max_inflight_per_ip=1)
+        self.admit('1.1.1.1')
+        self.admit('1.1.1.1')
+        self.admit('2.2.2.2')
+        self.assertEqual(self.admitted, ['1.1.1.1', '2.2.2.2'])
+        self.assertEqual(len(self.control.queue), 1)
+
+    def test_rate(self):
+        self.control.configure(rate=2, burst=1)
+        self.admit('1.1.1.1')
+        self.admit('2.2.2.2')
+        self.assertEqual(self.admitted, ['1.1.1.1'])
+
+        self.clock.advance(0.5 + admission.RETRY_SLACK)
+        self.assertEqual(self.admitted, ['1.1.1.1', '2.2.2.2'])
+
+    def test_rate_per_ip(self):
+        self.control.configure(rate_per_ip=1)
+        self.admit('1.1.1.1')
+        self.admit('1.1.1.1')
+        self.admit('2.2.2.2')
+        self.assertEqual(self.admitted, ['1.1.1.1', '2.2.2.2'])
+
+        self.clock.advance(1 + admission.RETRY_SLACK)
+        self.assertEqual(self.admitted, ['1.1.1.1', '2.2.2.2', '1.1.1.1'])
+
+    def test_queue_timeout(self):
+        self.control.configure(max_inflight=1, queue_timeout=5)
+        dropped = self.count('dropped')
+        self.admit('1.1.1.1')
+        self.admit('2.2.2.2')
+        self.clock.advance(5)
+        self.assertEqual(self.rejected, [admission.HandshakeRejected])
+        self.assertEqual(self.count('dropped'), dropped + 1)
+        self.assertFalse(self.control.queue)
+
+    def test_no_queue(self):
+        self.control.configure(max_inflight=1, queue_timeout=0)
+        self.admit('1.1.1.1')
+        self.admit('2.2.2.2')
+        self.assertEqual(self.rejected, [admission.HandshakeRejected])
+
+    def test_queue_size(self):
+        self.control.configure(max_inflight=1, queue_size=1)
+        for host in ('1.1.1.1', '2.2.2.2', '3.3.3.3'):
+            self.admit(host)
+        self.assertEqual(self.rejected, [admission.HandshakeRejected])
+        self.assertEqual(len(self.control.queue), 1)
+
+    def test_cancel(self):
+        self.control.configure(max_inflight=1)
+        self.admit('1.1.1.1')
+        d = self.control.admit('2.2.2.2')
+        d.cancel()
+        self.assertFailure(d, defer.CancelledError)
+        self.assertFalse(self.control.queue)
+        self.assertFalse(self.clock.getDelayedCalls())
+        return d
+
+    def test_forget_idle_sources(self):
+        self.control.configure(rate_per_ip=10)
+        self.patch(admission, 'MAX_TRACKED_SOURCES', 2)
+        self.admit('1.1.1.1')
+        self.admit('2.2.2.2')
+        self.clock.advance(1)
+        self.admit('3.3.3.3')
+        self.assertEqual(list(self.control._buckets), ['3.3.3.3'])
+
+    def test_invalid(self):
+        self.assertRaises(ValueError, self.control.configure, rate=-1)
+
+    def test_parse_rate(self):
+        self.assertEqual(admission.parse_rate('10'), (10, 0))
+        self.assertEqual(admission.parse_rate('0.5,4'), (0.5, 4))
+        self.assertRaises(ValueError, admission.parse_rate, '1,2,3')
+        self.assertRaises(ValueError, admission.parse_rate, '-1')
+
+if __name__ == '__main__':
+    unittest.main()
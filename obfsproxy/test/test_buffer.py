@@ -37,6 +37,53 @@ class testBuffer(twisted.trial.unittest.TestCase):
         self.assertEqual(self.buf.peek(-1), '.') # peek at last character
         self.assertEqual(len(self.buf), 1) # length must be 1
 
+class testChunkedBuffer(twisted.trial.unittest.TestCase):
+    def setUp(self):
+        self.buf = obfs_buf.Buffer()
+        for chunk in (b"No pop ", b"no style, ", b"I strictly ", b"roots."):
+            self.buf.write(chunk)
+        self.test_string = b"No pop no style, I strictly roots."
+
+    def test_len(self):
+        self.assertEqual(len(self.buf), len(self.test_string))
+        self.buf.drain(3)
+        self.assertEqual(len(self.buf), len(self.test_string) - 3)
+
+    def test_read_across_chunks(self):
+        self.assertEqual(self.buf.read(3), b"No ")
+        self.assertEqual(self.buf.read(10), b"pop no sty")
+        self.assertEqual(self.buf.read(), b"le, I strictly roots.")
+        self.assertFalse(self.buf)
+
+    def test_peek_does_not_consume(self):
+        self.assertEqual(self.buf.peek(12), self.test_string[:12])
+        self.assertEqual(self.buf.peek(), self.test_string)
+        self.assertEqual(self.buf.peek(), self.test_string)
+        self.assertEqual(self.buf.read(), self.test_string)
+
+    def test_drain_across_chunks(self):
+        self.buf.drain(20)
+        self.assertEqual(self.buf.peek(), self.test_string[20:])
+        self.buf.drain(len(self.buf) - 1)
+        self.assertEqual(self.buf.read(), b".")
+
+    def test_read_views(self):
+        self.buf.drain(3)
+        views = self.buf.read_views(20)
+        self.assertTrue(all(isinstance(v, memoryview) for v in views))
+        self.assertEqual(b"".join(views), self.test_string[3:23])
+        self.assertEqual(self.buf.read(), self.test_string[23:])
+        self.assertEqual(self.buf.read_views(), [])
+
+    def test_write_types(self):
+        buf = obfs_buf.Buffer(b"a")
+        buf.write("b")
+        data = bytearray(b"c")
+        buf.write(data)
+        data[0] = ord("x") # the buffer must not alias the bytearray
+        buf.write(memoryview(b"d"))
+        self.assertEqual(buf.read(), b"abcd")
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,34 @@
+import unittest
+
+import obfsproxy.common.memory as memory
+
+class testMemoryBudget(unittest.TestCase):
+    def setUp(self):
+        self.budget = memory.MemoryBudget(circuit_budget=1000, process_budget=10000)
+
+    def test_circuit_budget_levels(self):
+        self.assertEqual(self.budget.charge(0, 1000), memory.OK)
+        self.assertEqual(self.budget.charge(1000, 1001), memory.PAUSE_READS)
+        self.assertEqual(self.budget.charge(1001, 1501), memory.DROP_PADDING)
+        self.assertEqual(self.budget.charge(1501, 2001), memory.CLOSE)
+        self.assertEqual(self.budget.charge(2001, 10), memory.OK)
+        self.assertEqual(self.budget.used, 10)
+
+    def test_process_budget(self):
+        # Many small circuits push the process over its budget; the one
+        # that keeps growing gets throttled.
+        self.budget.charge(0, 10000)
+        self.assertEqual(self.budget.charge(0, 100), memory.PAUSE_READS)
+        self.assertEqual(self.budget.level(0), memory.OK)
+
+        self.budget.release(10000)
+        self.assertEqual(self.budget.level(100), memory.OK)
+
+    def test_disabled(self):
+        self.budget.configure(0, 0)
+        self.assertEqual(self.budget.charge(0, 10**9), memory.OK)
+        self.assertRaises(ValueError, self.budget.configure, -1, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
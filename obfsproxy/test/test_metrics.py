@@ -0,0 +1,68 @@
+import unittest
+
+import obfsproxy.common.metrics as metrics
+
+class testMetricsRegistry(unittest.TestCase):
+    def setUp(self):
+        self.registry = metrics.MetricsRegistry()
+
+    def test_counter(self):
+        c = self.registry.counter('test_total', 'A counter.', ('side',))
+        c.inc(('client',))
+        c.inc(('client',), 4)
+        c.inc(('server',))
+        self.assertEqual(c.get(('client',)), 5)
+        self.assertEqual(c.get(('server',)), 1)
+        self.assertRaises(ValueError, c.inc, ('client',), -1)
+        self.assertRaises(ValueError, c.inc, ('client', 'extra'))
+
+    def test_registry_is_idempotent(self):
+        c1 = self.registry.counter('test_total', 'A counter.')
+        c2 = self.registry.counter('test_total', 'A counter.')
+        self.assertIs(c1, c2)
+        self.assertRaises(ValueError, self.registry.gauge, 'test_total', 'A gauge.')
+
+    def test_gauge(self):
+        g = self.registry.gauge('test_gauge', 'A gauge.')
+        g.inc()
+        g.inc()
+        g.dec()
+        self.assertEqual(g.get(), 1)
+        g.set((), 42)
+        self.assertEqual(g.get(), 42)
+
+    def test_gauge_function(self):
+        g = self.registry.gauge('test_gauge', 'A gauge.', function=lambda: 7)
+        self.assertEqual(g.get(), 7)
+        self.assertIn('test_gauge 7', self.registry.render())
+
+    def test_histogram(self):
+        h = self.registry.histogram('test_hist', 'A histogram.', buckets=(1, 10))
+        for value in (0, 1, 5, 100):
+            h.observe((), value)
+        self.assertEqual(h.get(), 4)
+        text = self.registry.render()
+        self.assertIn('test_hist_bucket{le="1"} 2', text)
+        self.assertIn('test_hist_bucket{le="10"} 3', text)
+        self.assertIn('test_hist_bucket{le="+Inf"} 4', text)
+        self.assertIn('test_hist_sum 106', text)
+        self.assertIn('test_hist_count 4', text)
+
+    def test_render(self):
+        c = self.registry.counter('test_total', 'A counter.', ('side',))
+        c.inc(('cli"ent',), 3)
+        text = self.registry.render()
+        self.assertIn('# HELP test_total A counter.', text)
+        self.assertIn('# TYPE test_total counter', text)
+        self.assertIn('test_total{side="cli\\"ent"} 3', text)
+
+    def test_parse_endpoint(self):
+        self.assertEqual(metrics.parse_endpoint('9100'), ('tcp', ('127.0.0.1', 9100)))
+        self.assertEqual(metrics.parse_endpoint('127.0.0.2:9100'), ('tcp', ('127.0.0.2', 9100)))
+        self.assertEqual(metrics.parse_endpoint('unix:/tmp/metrics.sock'), ('unix', '/tmp/metrics.sock'))
+        self.assertRaises(ValueError, metrics.parse_endpoint, 'localhost:http')
+        self.assertRaises(ValueError, metrics.parse_endpoint, 'unix:')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,205 @@
+import argparse
+
+from twisted.internet import task
+from twisted.trial import unittest
+from twisted.test import proto_helpers
+
+import obfsproxy.common.memory as memory
+import obfsproxy.network.admission as admission
+import obfsproxy.network.network as network
+import obfsproxy.transports.base as base
+from obfsproxy.transports.dummy import DummyTransport
+
+class _QueueingTransport(DummyTransport):
+    """A dummy transport that pretends to queue upstream data."""
+
+    queued = 0
+
+    def getQueuedBytes(self):
+        return self.queued
+
+class _CircuitTestCase(unittest.TestCase):
+    """Sets up a circuit of two string transports."""
+
+    def setUp(self):
+        self.pt = _QueueingTransport()
+        self.circuit = network.Circuit(self.pt)
+        self.pt.circuit = self.circuit
+
+        self.up = network.StaticDestinationProtocol(self.circuit, 'client', None)
+        self.down = network.StaticDestinationProtocol(self.circuit, 'client', None)
+        # Wire the circuit by hand: connectionMade() would complete the
+        # circuit, which schedules a call in the reactor.
+        self.up.transport = proto_helpers.StringTransport()
+        self.down.transport = proto_helpers.StringTransport()
+        self.circuit.upstream = self.up
+        self.circuit.downstream = self.down
+        self.up.registerAsProducer()
+        self.down.registerAsProducer()
+
+    def tearDown(self):
+        self.circuit.close()
+
+class testBackpressure(_CircuitTestCase):
+    def test_full_write_buffer_pauses_other_side(self):
+        self.assertIs(self.down.transport.producer, self.down)
+
+        self.down.pauseProducing()
+        self.assertEqual(self.up.transport.producerState, 'paused')
+        self.assertEqual(self.down.transport.producerState, 'producing')
+
+        self.down.resumeProducing()
+        self.assertEqual(self.up.transport.producerState, 'producing')
+
+    def test_transport_queue_pauses_upstream(self):
+        self.pt.queued = self.circuit.high_water_mark + 1
+        self.circuit.updateBackpressure()
+        self.assertEqual(self.up.transport.producerState, 'paused')
+
+        # Between the marks, nothing changes.
+        self.pt.queued = self.circuit.low_water_mark + 1
+        self.circuit.updateBackpressure()
+        self.assertEqual(self.up.transport.producerState, 'paused')
+
+        self.pt.queued = self.circuit.low_water_mark
+        self.circuit.updateBackpressure()
+        self.assertEqual(self.up.transport.producerState, 'producing')
+
+    def test_resume_needs_all_reasons_gone(self):
+        self.pt.queued = self.circuit.high_water_mark + 1
+        self.circuit.updateBackpressure()
+        self.down.pauseProducing()
+        self.assertEqual(self.up.pause_reasons,
+                         set([network.PAUSE_TRANSPORT, network.PAUSE_PEER]))
+
+        self.down.resumeProducing()
+        self.assertEqual(self.up.transport.producerState, 'paused')
+
+        self.pt.queued = 0
+        self.circuit.updateBackpressure()
+        self.assertEqual(self.up.transport.producerState, 'producing')
+        self.assertFalse(self.up.pause_reasons)
+
+class testMemoryShedding(_CircuitTestCase):
+    def setUp(self):
+        _CircuitTestCase.setUp(self)
+        self.budget = memory.budget
+        memory.budget = memory.MemoryBudget(circuit_budget=1000, process_budget=0)
+
+    def test_shedding_levels(self):
+        self.pt.queued = 1200
+        self.circuit.updateMemoryUsage()
+        self.assertEqual(self.up.transport.producerState, 'paused')
+        self.assertEqual(self.down.transport.producerState, 'paused')
+        self.assertFalse(self.circuit.shouldDropPadding())
+
+        self.pt.queued = 1600
+        self.circuit.updateMemoryUsage()
+        self.assertTrue(self.circuit.shouldDropPadding())
+
+        self.pt.queued = 0
+        self.circuit.updateMemoryUsage()
+        self.assertEqual(self.up.transport.producerState, 'producing')
+        self.assertEqual(self.down.transport.producerState, 'producing')
+        self.assertFalse(self.circuit.shouldDropPadding())
+
+    def test_close(self):
+        self.pt.queued = 2500
+        self.circuit.updateMemoryUsage()
+        self.assertTrue(self.circuit.closed)
+        self.assertEqual(memory.budget.used, 0)
+
+    def tearDown(self):
+        _CircuitTestCase.tearDown(self)
+        memory.budget = self.budget
+
+class _ExpensiveTransport(DummyTransport):
+    expensiveHandshake = True
+    connected = False
+
+    def circuitConnected(self):
+        self.connected = True
+
+class testHandshakeAdmission(unittest.TestCase):
+    def setUp(self):
+        self.control = admission.control
+        self.clock = task.Clock()
+        admission.control = admission.HandshakeAdmission(self.clock)
+        admission.control.configure(max_inflight=1)
+
+    def tearDown(self):
+        admission.control = self.control
+
+    def connect(self, transport_class=_ExpensiveTransport):
+        circuit = network.Circuit(transport_class())
+        down = network.StaticDestinationProtocol(circuit, 'server', None)
+        down.transport = proto_helpers.StringTransport()
+        circuit.requestAdmission(down, '1.1.1.1')
+        circuit.downstream = down
+        circuit.upstream = network.StaticDestinationProtocol(circuit, 'server', None)
+        circuit.upstream.transport = proto_helpers.StringTransport()
+        return circuit
+
+    def test_queued_circuit_waits(self):
+        first, second = self.connect(), self.connect()
+        self.assertTrue(first.circuitIsReady())
+        self.assertFalse(second.circuitIsReady())
+        self.assertEqual(second.downstream.transport.producerState, 'paused')
+
+        # The first handshake completes: the second circuit goes on.
+        first.handshakeCompleted()
+        self.assertTrue(second.circuitIsReady())
+        self.assertEqual(second.handshake_source, '1.1.1.1')
+        second.close()
+        self.assertEqual(admission.control.inflight_total, 0)
+
+    def test_cheap_handshakes_are_not_limited(self):
+        self.connect()
+        self.assertTrue(self.connect(DummyTransport).circuitIsReady())
+
+    def test_rejected_circuit_closes_later(self):
+        admission.control.configure(max_inflight=1, queue_timeout=0)
+        self.patch(network, 'reactor', self.clock)
+        self.connect()
+        rejected = self.connect()
+        self.assertFalse(rejected.closed)
+        self.clock.advance(admission.REJECT_MAX_DELAY)
+        self.assertTrue(rejected.closed)
+
+    def test_rejected_circuit_never_completes(self):
+        admission.control.configure(max_inflight=1, queue_timeout=0)
+        self.patch(network, 'reactor', self.clock)
+        self.connect()
+
+        circuit = network.Circuit(_ExpensiveTransport())
+        down = network.StaticDestinationProtocol(circuit, 'server', None)
+        down.transport = proto_helpers.StringTransport()
+        circuit.requestAdmission(down, '1.1.1.1')
+        circuit.setDownstreamConnection(down)
+        # The connection to the ORPort comes after the rejection.
+        up = network.StaticDestinationProtocol(circuit, 'server', None)
+        up.transport = proto_helpers.StringTransport()
+        circuit.setUpstreamConnection(up)
+
+        self.assertTrue(circuit.rejected)
+        self.assertFalse(circuit.circuitIsReady())
+        self.assertFalse(circuit.transport.connected)
+
+class testUnixSockets(unittest.TestCase):
+    def test_unix_socket_path(self):
+        self.assertEqual(network.unix_socket_path('unix:/run/tor/or.sock'), '/run/tor/or.sock')
+        self.assertEqual(network.unix_socket_path(('127.0.0.1', 9001)), None)
+        self.assertEqual(network.unix_socket_path(None), None)
+
+    def test_addrport(self):
+        self.assertEqual(base.addrport('unix:/run/tor/or.sock'), 'unix:/run/tor/or.sock')
+        self.assertRaises(argparse.ArgumentTypeError, base.addrport, 'unix:')
+
+    def test_server_factory_connects_to_unix_socket(self):
+        factory = network.StaticDestinationServerFactory('unix:/run/tor/or.sock', 'server',
+                                                         DummyTransport, None)
+        self.assertEqual(factory.remote_unix_path, '/run/tor/or.sock')
+        self.assertEqual(factory.getConnectionPool(), None)
+
+if __name__ == '__main__':
+    unittest.main()
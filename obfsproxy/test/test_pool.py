@@ -0,0 +1,86 @@
+from twisted.internet import protocol, task
+from twisted.trial import unittest
+from twisted.test import proto_helpers
+
+import obfsproxy.network.pool as pool
+
+class _TestPool(pool.ConnectionPool):
+    """A pool that records connection attempts instead of connecting."""
+
+    def _connect(self, key):
+        self.pending[key] = self.pending.get(key, 0) + 1
+        self.attempts.append(key)
+
+    def fake_connected(self, key):
+        conn = pool._PooledConnection(self, key)
+        conn.makeConnection(proto_helpers.StringTransport())
+        self._connected(conn, key)
+        return conn
+
+class _Recorder(protocol.Protocol):
+    def __init__(self):
+        self.received = []
+
+    def dataReceived(self, data):
+        self.received.append(data)
+
+class testConnectionPool(unittest.TestCase):
+    key = ('127.0.0.1', 9999)
+
+    def setUp(self):
+        self.clock = task.Clock()
+        self.pool = _TestPool(2, idle_ttl=60, reactor=self.clock)
+        self.pool.attempts = []
+        self.factory = protocol.Factory.forProtocol(_Recorder)
+
+    def test_warm_and_claim(self):
+        self.pool.warm(*self.key)
+        self.assertEqual(self.pool.attempts, [self.key, self.key])
+        conn = self.pool.fake_connected(self.key)
+        self.assertEqual(len(self.pool), 1)
+
+        owners = []
+        d = self.pool.claim(self.key[0], self.key[1], self.factory)
+        d.addCallback(owners.append)
+        self.assertEqual(len(self.pool), 0)
+        self.assertFalse(owners)
+
+        self.clock.advance(0)
+        self.assertEqual(len(owners), 1)
+        self.assertIs(owners[0].transport, conn.transport)
+        conn.dataReceived(b"hello")
+        self.assertEqual(owners[0].received, [b"hello"])
+
+        # One connection was still pending; the claimed one gets replaced.
+        self.assertEqual(self.pool.attempts, [self.key] * 3)
+
+    def test_miss(self):
+        self.assertEqual(self.pool.claim(self.key[0], self.key[1], self.factory), None)
+        self.clock.advance(0)
+        self.assertEqual(self.pool.attempts, [self.key, self.key])
+
+    def test_lost_connections_are_skipped(self):
+        self.pool.warm(*self.key)
+        conn = self.pool.fake_connected(self.key)
+        conn.connectionLost(None)
+        self.assertEqual(len(self.pool), 0)
+        self.assertEqual(self.pool.claim(self.key[0], self.key[1], self.factory), None)
+
+    def test_idle_expiry(self):
+        self.pool.warm(*self.key)
+        conn = self.pool.fake_connected(self.key)
+
+        self.clock.advance(61)
+        self.assertEqual(len(self.pool), 0)
+        self.assertTrue(conn.transport.disconnecting)
+        # The bridge was not used during the TTL: don't reconnect.
+        self.assertEqual(self.pool.attempts, [self.key, self.key])
+        self.assertNotIn(self.key, self.pool.last_used)
+
+    def test_configure(self):
+        self.assertRaises(ValueError, pool.configure, -1)
+        self.assertRaises(ValueError, pool.configure, 1, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,43 @@
+import threading
+import time
+import unittest
+
+import obfsproxy.common.profiler as profiler
+from obfsproxy.transports.dummy import DummyTransport
+
+class _BusyTransport(DummyTransport):
+    def spin(self, stop):
+        while not stop.is_set():
+            time.sleep(0.001)
+
+class testStackSampler(unittest.TestCase):
+    def test_samples_are_labelled_with_transport(self):
+        stop = threading.Event()
+        busy = threading.Thread(target=_BusyTransport().spin, args=(stop,))
+        busy.start()
+        try:
+            sampler = profiler.StackSampler(busy.ident, interval=0.001)
+            for _ in range(20):
+                sampler.sample()
+        finally:
+            stop.set()
+            busy.join()
+
+        self.assertEqual(sampler.n_samples, 20)
+        lines = sampler.collapsed().splitlines()
+        self.assertTrue(lines)
+        for line in lines:
+            stack, count = line.rsplit(' ', 1)
+            self.assertTrue(int(count) > 0)
+            self.assertTrue(stack.startswith('transport=_BusyTransport;circuits=0;'))
+            self.assertIn('test_profiler.py:spin', stack)
+
+    def test_unknown_thread(self):
+        sampler = profiler.StackSampler(-1)
+        sampler.sample()
+        self.assertEqual(sampler.n_samples, 0)
+        self.assertEqual(sampler.collapsed(), '')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,56 @@
+import socket
+import unittest
+
+import obfsproxy.network.sockopts as sockopts
+
+class _FakeTransport(object):
+    def __init__(self, sock):
+        self.sock = sock
+
+    def getHandle(self):
+        return self.sock
+
+class testSocketOptions(unittest.TestCase):
+    def test_parse(self):
+        opts = sockopts.SocketOptions.parse("nodelay, sndbuf=65536,quickack=0")
+        self.assertEqual(opts.options, {'nodelay': 1, 'sndbuf': 65536, 'quickack': 0})
+        self.assertEqual(sockopts.SocketOptions.parse("").options, {})
+        self.assertRaises(ValueError, sockopts.SocketOptions.parse, "nagle")
+        self.assertRaises(ValueError, sockopts.SocketOptions.parse, "sndbuf=lots")
+        self.assertRaises(ValueError, sockopts.SocketOptions.parse, "sndbuf=-1")
+
+    def test_apply(self):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        try:
+            sockopts.SocketOptions.parse("nodelay,keepalive").apply(_FakeTransport(sock))
+            self.assertTrue(sock.getsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY))
+            self.assertTrue(sock.getsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE))
+        finally:
+            sock.close()
+
+    def test_apply_skips_tcp_options_on_unix_sockets(self):
+        if not hasattr(socket, 'AF_UNIX'):
+            self.skipTest("No unix sockets.")
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sockopts.SocketOptions.parse("nodelay,sndbuf=65536").apply(_FakeTransport(sock))
+            self.assertTrue(sock.getsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF) >= 65536)
+        finally:
+            sock.close()
+
+    def test_apply_without_socket(self):
+        sockopts.SocketOptions.parse("nodelay").apply(object())
+
+    def test_for_config(self):
+        class Config(object):
+            upstreamSocketOptions = None
+            downstreamSocketOptions = sockopts.SocketOptions.parse("quickack")
+
+        up, down = sockopts.for_config(Config())
+        self.assertIs(up, sockopts.upstream)
+        self.assertEqual(down.options, {'quickack': 1})
+        self.assertEqual(sockopts.for_config(None), (sockopts.upstream, sockopts.downstream))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -413,15 +413,27 @@ class SOCKSv5Protocol_testRequest(unittest.TestCase):
         self.assertEqual(self.proto.state, self.proto.ST_ESTABLISHED)
         self.assertTrue(self.tr.connected)
 
-    def test_TrailingGarbage(self):
+    def test_EarlyData(self):
         """
-        Test request with a impatient client.
+        Test request with a impatient client, that pipelines data.
         """
 
-        # VER = 05, CMD = 01, RSV = 00, ATYPE = 01, DST.ADDR = 127.0.0.1, DST.PORT = 9050, Garbage = deadbabe
+        self.proto.connectClass = self._connectClassIPv4
+        self.proto.otherConn = proto_helpers.StringTransport()
+
+        # VER = 05, CMD = 01, RSV = 00, ATYPE = 01, DST.ADDR = 127.0.0.1, DST.PORT = 9050, Data = deadbabe
         self._sendMsg("050100017f000001235adeadbabe")
+        self._sendMsg("cafe")
+        self.assertEqual(self.proto.state, self.proto.ST_CONNECTING)
+        self.assertTrue(self.tr.connected)
+        self.assertEqual(self.proto.otherConn.value(), b"")
 
-        self.assertFalse(self.tr.connected)
+        self.connectDeferred.callback(self)
+
+        # VER = 05, REP = 00, RSV = 00, ATYPE = 01, BND.ADDR = 127.0.0.1, BND.PORT = 9050
+        self._recvMsg("050000017f000001235a")
+        self.assertEqual(self.proto.state, self.proto.ST_ESTABLISHED)
+        self.assertEqual(self.proto.otherConn.value(), binascii.unhexlify("deadbabecafe"))
 
     def test_CmdConnectErrback(self):
         """
@@ -0,0 +1,58 @@
+from twisted.trial import unittest
+
+import obfsproxy.common.workers as workers
+import obfsproxy.transports.obfs3_dh as obfs3_dh
+
+def _fail(message):
+    raise ValueError(message)
+
+class testWorkers(unittest.TestCase):
+    def setUp(self):
+        self.mode, self.processes = workers.mode, workers.processes
+
+    def tearDown(self):
+        workers.configure(self.mode, self.processes)
+
+    def test_configure(self):
+        self.assertRaises(ValueError, workers.configure, 'fibers')
+        self.assertRaises(ValueError, workers.configure, workers.AUTO, -1)
+        workers.configure(workers.PROCESSES)
+        self.assertEqual(workers.current_mode(), workers.PROCESSES)
+
+    def check_run(self, mode):
+        workers.configure(mode, 1)
+        d = workers.run(pow, 3, 4, 5)
+        d.addCallback(self.assertEqual, 1)
+        return d
+
+    def check_failure(self, mode):
+        workers.configure(mode, 1)
+        d = workers.run(_fail, "corrupted")
+        return self.assertFailure(d, ValueError)
+
+    def test_threads(self):
+        return self.check_run(workers.THREADS)
+
+    def test_threads_failure(self):
+        return self.check_failure(workers.THREADS)
+
+    def test_processes(self):
+        return self.check_run(workers.PROCESSES)
+
+    def test_processes_failure(self):
+        return self.check_failure(workers.PROCESSES)
+
+    def test_mode(self):
+        workers.configure(workers.THREADS, 1)
+        d = workers.run(pow, 3, 4, 5, mode=workers.PROCESSES)
+        self.assertIsNotNone(workers._executor)
+        d.addCallback(self.assertEqual, 1)
+        return d
+
+    def test_shared_secret(self):
+        workers.configure(workers.PROCESSES, 1)
+        alice, bob = obfs3_dh.UniformDH(), obfs3_dh.UniformDH()
+        d = alice.defer_secret(bob.get_public())
+        d.addCallback(self.assertEqual, bob.get_secret(alice.get_public()))
+        d.addCallback(lambda _: self.assertEqual(alice.shared_secret, bob.shared_secret))
+        return d
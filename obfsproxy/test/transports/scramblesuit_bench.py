@@ -0,0 +1,91 @@
+"""Throughput benchmark of the ScrambleSuit record layer.
+
+Run with:
+
+    python -m obfsproxy.test.transports.scramblesuit_bench [repeat]
+
+It turns transfers of 1 KB to 1 MB into protocol messages and back, and
+reports the throughput of each direction for two variants:
+
+    message  one AES call per message and header field, and HMACs keyed
+             for every message (the record layer before batching)
+    bulk     message.encryptMessages and message.MessageExtractor
+"""
+import os
+import sys
+import time
+
+import obfsproxy.transports.scramblesuit.const as const
+import obfsproxy.transports.scramblesuit.message as message
+import obfsproxy.transports.scramblesuit.mycrypto as mycrypto
+
+
+SIZES = (1024, 16 * 1024, 64 * 1024, 256 * 1024, 1024 * 1024)
+REPEAT = 10
+HMAC_KEY = b"B" * 32
+
+
+def _crypter():
+    crypter = mycrypto.PayloadCrypter()
+    crypter.setSessionKey(b"A" * 32, b"A" * 8)
+    return crypter
+
+
+def _encryptPerMessage(msgs, crypter):
+    blurbs = []
+    for msg in msgs:
+        encrypted = crypter.encrypt(msg.plaintext())
+        blurbs.append(mycrypto.HMAC_SHA256_128(HMAC_KEY, encrypted) + encrypted)
+    return b"".join(blurbs)
+
+
+def _extractPerMessage(data, crypter):
+    payloads = []
+    pos = 0
+    while len(data) - pos >= const.HDR_LENGTH:
+        start = pos + const.HMAC_SHA256_128_LENGTH
+        totalLen, payloadLen, flags = message.HEADER.unpack(
+            crypter.decrypt(data[start:start + 2]) +
+            crypter.decrypt(data[start + 2:start + 4]) +
+            crypter.decrypt(data[start + 4:start + 5]))
+        end = pos + const.HDR_LENGTH + totalLen
+        if mycrypto.HMAC_SHA256_128(HMAC_KEY, data[start:end]) != data[pos:start]:
+            raise ValueError("Invalid message HMAC.")
+        payloads.append(crypter.decrypt(data[pos + const.HDR_LENGTH:end])[:payloadLen])
+        pos = end
+    return payloads
+
+
+def _bulk():
+    hmac = mycrypto.PrecomputedHMAC(HMAC_KEY)
+    return (lambda msgs, crypter: message.encryptMessages(msgs, crypter, hmac),
+            lambda data, crypter: message.MessageExtractor().extract(data, crypter, hmac))
+
+
+def _variants():
+    return [("message", _encryptPerMessage, _extractPerMessage),
+            ("bulk",) + _bulk()]
+
+
+def _throughput(f, arg, size, repeat):
+    """Return the MB/s of `f` called `repeat` times on `size` bytes."""
+    start = time.perf_counter()
+    for _ in range(repeat):
+        f(arg, _crypter())
+    return size * repeat / (time.perf_counter() - start) / 1e6
+
+
+def main(repeat=REPEAT):
+    print("%-8s %8s %12s %12s" % ("variant", "bytes", "send MB/s", "recv MB/s"))
+    for size in SIZES:
+        msgs = message.createProtocolMessages(os.urandom(size))
+        wire = _encryptPerMessage(msgs, _crypter())
+        for name, encrypt, extract in _variants():
+            assert encrypt(msgs, _crypter()) == wire
+            print("%-8s %8d %12.1f %12.1f" % (name, size,
+                                               _throughput(encrypt, msgs, size, repeat),
+                                               _throughput(extract, wire, size, repeat)))
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else REPEAT)
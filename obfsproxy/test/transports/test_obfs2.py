@@ -0,0 +1,64 @@
+import hashlib
+
+from twisted.trial import unittest
+
+import obfsproxy.common.workers as workers
+import obfsproxy.transports.obfs2 as obfs2
+
+# Enough iterations to take a while, without slowing down the tests.
+ITERATIONS = 1000
+
+class test_key_stretching(unittest.TestCase):
+    def setUp(self):
+        self.mode, self.processes = workers.mode, workers.processes
+        self.patch(obfs2, '_macs', obfs2.OrderedDict())
+
+    def tearDown(self):
+        workers.configure(self.mode, self.processes)
+
+    def test_hn(self):
+        data = b'seed'
+        for _ in range(ITERATIONS):
+            data = hashlib.sha256(data).digest()
+        self.assertEqual(obfs2.hn(b'seed', ITERATIONS), data)
+        self.assertEqual(obfs2.hn(b'seed', 0), b'seed')
+
+    def check_defer_mac(self, mode):
+        workers.configure(mode, 1)
+        expected = obfs2.stretched_mac(b'pad', b'seed', b'secret', ITERATIONS)
+        d = obfs2.defer_mac(b'pad', b'seed', b'secret', ITERATIONS)
+        d.addCallback(self.assertEqual, expected)
+        return d
+
+    def test_threads(self):
+        # Stretched in a process all the same.
+        d = self.check_defer_mac(workers.THREADS)
+        self.assertIsNotNone(workers._executor)
+        return d
+
+    def test_processes(self):
+        return self.check_defer_mac(workers.PROCESSES)
+
+    def test_cache(self):
+        workers.configure(workers.PROCESSES, 1)
+        hits = obfs2.mac_cache_lookups.get(('hit',))
+
+        def again(mac):
+            # Cached: fires right away.
+            results = []
+            obfs2.defer_mac(b'pad', b'seed', b'secret', ITERATIONS).addCallback(results.append)
+            self.assertEqual(results, [mac])
+            self.assertEqual(obfs2.mac_cache_lookups.get(('hit',)), hits + 1)
+
+        d = obfs2.defer_mac(b'pad', b'seed', b'secret', ITERATIONS)
+        d.addCallback(again)
+        return d
+
+    def test_cache_size(self):
+        self.patch(obfs2, 'MAC_CACHE_SIZE', 2)
+        for seed in (b'1', b'2', b'3'):
+            obfs2._cache_mac(seed, (b'pad', seed, b'secret', ITERATIONS))
+        self.assertEqual([key[1] for key in obfs2._macs], [b'2', b'3'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,5 +1,6 @@
 import unittest
 import twisted.trial.unittest
+from twisted.internet import reactor, task
 
 import obfsproxy.transports.obfs3_dh as obfs3_dh
 
@@ -16,6 +17,63 @@ class test_uniform_dh(twisted.trial.unittest.TestCase):
 
         self.assertEqual(alice_secret, bob_secret)
 
+class test_keypair_pool(twisted.trial.unittest.TestCase):
+    def setUp(self):
+        self.pool = obfs3_dh.keypairs
+        obfs3_dh.keypairs = obfs3_dh.KeypairPool()
+
+    def tearDown(self):
+        obfs3_dh.keypairs = self.pool
+
+    def wait_full(self, pool):
+        if len(pool) < pool.size or pool.refilling:
+            return task.deferLater(reactor, 0.01, self.wait_full, pool)
+
+    def test_disabled(self):
+        obfs3_dh.UniformDH()
+        self.assertEqual(len(obfs3_dh.keypairs), 0)
+        self.assertFalse(obfs3_dh.keypairs.refilling)
+
+    def test_refill(self):
+        pool = obfs3_dh.keypairs
+        pool.configure(2)
+        drawn = []
+
+        def draw(_):
+            self.assertEqual(len(pool), 2)
+            drawn.extend(pool.keypairs)
+            alice, bob = obfs3_dh.UniformDH(), obfs3_dh.UniformDH()
+            # Each keypair is used once, and leaves the pool.
+            self.assertEqual([(alice.priv_str, alice.priv, alice.pub),
+                              (bob.priv_str, bob.priv, bob.pub)], drawn)
+            self.assertEqual(obfs3_dh.generate_keypair(alice.priv_str), drawn[0])
+            self.assertEqual(alice.get_secret(bob.get_public()),
+                             bob.get_secret(alice.get_public()))
+            return self.wait_full(pool)
+
+        def refilled(_):
+            self.assertEqual(len(pool), 2)
+            self.assertFalse(set(pool.keypairs) & set(drawn))
+
+        d = self.wait_full(pool)
+        d.addCallback(draw)
+        d.addCallback(refilled)
+        return d
+
+    def test_miss(self):
+        pool = obfs3_dh.KeypairPool(1)
+        pool.refilling = True # Don't refill in the background
+        keypair = pool.get()
+        self.assertEqual(obfs3_dh.generate_keypair(keypair[0]), keypair)
+        self.assertEqual(len(pool), 0)
+
+    def test_shrink(self):
+        pool = obfs3_dh.KeypairPool()
+        pool.keypairs.extend([obfs3_dh.generate_keypair() for _ in range(2)])
+        pool.configure(0)
+        self.assertEqual(len(pool), 0)
+        self.assertRaises(ValueError, pool.configure, -1)
+
 if __name__ == '__main__':
     unittest.main()
 
@@ -2,12 +2,17 @@ import unittest
 
 import os
 import base64
+import pickle
 import shutil
 import tempfile
+import time
 
 import Crypto.Hash.SHA256
 import Crypto.Hash.HMAC
 
+import twisted.trial.unittest
+from twisted.internet import reactor
+
 import obfsproxy.common.log as logging
 import obfsproxy.network.buffer as obfs_buf
 import obfsproxy.common.transport_config as transport_config
@@ -21,9 +26,11 @@ import obfsproxy.transports.scramblesuit.uniformdh as uniformdh
 import obfsproxy.transports.scramblesuit.scramblesuit as scramblesuit
 import obfsproxy.transports.scramblesuit.message as message
 import obfsproxy.transports.scramblesuit.state as state
+import obfsproxy.transports.scramblesuit.replay as replay
 import obfsproxy.transports.scramblesuit.ticket as ticket
 import obfsproxy.transports.scramblesuit.packetmorpher as packetmorpher
 import obfsproxy.transports.scramblesuit.probdist as probdist
+import obfsproxy.transports.scramblesuit.fifobuf as fifobuf
 
 
 # Disable all logging as it would yield plenty of warning and error
@@ -195,6 +202,24 @@ class UniformDHTest( unittest.TestCase ):
                 self.assertTrue(udh.extractPublicKey(buf))
 
 
+class UniformDHWorkerTest( twisted.trial.unittest.TestCase ):
+
+    def setUp( self ):
+        weAreServer = True
+        self.udh = uniformdh.new(b"A" * const.SHARED_SECRET_LENGTH, weAreServer)
+
+    def test1_deferPublicKey( self ):
+        buf = obfs_buf.Buffer(self.udh.createHandshake())
+
+        d = self.udh.deferPublicKey(buf)
+        self.assertTrue(d)
+        d.addCallback(lambda masterKey: self.assertTrue(
+                      len(masterKey) == const.MASTER_KEY_LENGTH))
+
+        self.assertFalse(self.udh.deferPublicKey(obfs_buf.Buffer()))
+        return d
+
+
 class UtilTest( unittest.TestCase ):
 
     def test1_isValidHMAC( self ):
@@ -252,6 +277,7 @@ class StateTest( unittest.TestCase ):
         const.STATE_LOCATION = tempfile.mkdtemp()
         self.stateFile = os.path.join(const.STATE_LOCATION, const.SERVER_STATE_FILE)
         self.state = state.State()
+        state._state = None
 
     def tearDown( self ):
         try:
@@ -292,6 +318,212 @@ class StateTest( unittest.TestCase ):
 
         builtins.open = real_open
 
+    def test5_cache( self ):
+        srvState = state.load()
+        self.assertIs(state.load(), srvState)
+
+        # Another process replaces the state file.
+        other = state.State()
+        other.genState()
+        reloaded = state.load()
+        self.assertIsNot(reloaded, srvState)
+        self.assertEqual(reloaded.hmacKey, other.hmacKey)
+        self.assertIs(state.load(), reloaded)
+
+        # Changes which are not written yet are kept.
+        reloaded.dirty = True
+        state.State().genState()
+        self.assertIs(state.load(), reloaded)
+
+    def test6_writeFile( self ):
+        signature = state.writeFile(self.stateFile, b"state")
+        self.assertEqual(signature, state.fileSignature(self.stateFile))
+        self.assertEqual(os.listdir(const.STATE_LOCATION),
+                         [const.SERVER_STATE_FILE])
+        with open(self.stateFile, 'rb') as fd:
+            self.assertEqual(fd.read(), b"state")
+
+    def test7_transient( self ):
+        self.state.genState()
+        self.state.dirty = True
+        copy = pickle.loads(pickle.dumps(self.state))
+        self.assertFalse(copy.dirty)
+        self.assertEqual(copy.signature, None)
+        self.assertEqual(copy.hmacKey, self.state.hmacKey)
+
+    def test8_sharedReplayTable( self ):
+        # Two server processes sharing the state location.
+        first = state.load()
+        state._state = None
+        second = state.load()
+        self.assertIsNot(first, second)
+
+        key = b"A" * const.HMAC_SHA256_128_LENGTH
+        first.registerKey(key)
+        self.assertTrue(second.isReplayed(key))
+
+class StateFlushTest( twisted.trial.unittest.TestCase ):
+
+    def setUp( self ):
+        const.STATE_LOCATION = tempfile.mkdtemp()
+        self.state = state.State()
+        self.state.genState()
+        self.states = [self.state]
+        state._state = None
+
+    def tearDown( self ):
+        for srvState in self.states:
+            if srvState.shutdownTrigger is not None:
+                reactor.removeSystemEventTrigger(srvState.shutdownTrigger)
+        shutil.rmtree(const.STATE_LOCATION)
+
+    def test1_flush( self ):
+        signature = self.state.signature
+        self.state.aesKey = mycrypto.strongRandom(const.TICKET_AES_KEY_LENGTH)
+        self.state.markChanged()
+        self.assertTrue(self.state.writeCall.active())
+
+        def written( _ ):
+            self.assertFalse(self.state.dirty)
+            self.assertNotEqual(self.state.signature, signature)
+            self.assertEqual(self.state.signature,
+                             state.fileSignature(self.state.stateFile))
+            with open(self.state.stateFile, 'rb') as fd:
+                self.assertEqual(pickle.load(fd).aesKey, self.state.aesKey)
+
+            # Nothing changed, nothing to write.
+            self.assertTrue(self.state.flush().called)
+            self.assertEqual(self.state.signature,
+                             state.fileSignature(self.state.stateFile))
+
+        d = self.state.flush()
+        self.assertEqual(self.state.writeCall, None)
+        d.addCallback(written)
+        return d
+
+    def test2_conflict( self ):
+        # Another server process rotates the keys at the same time.
+        other = state.load()
+        self.states.append(other)
+        for srvState in self.states:
+            srvState.aesKey = mycrypto.strongRandom(const.TICKET_AES_KEY_LENGTH)
+            srvState.markChanged()
+
+        def written( _ ):
+            # The first write wins.
+            self.assertFalse(self.state.dirty)
+            self.assertFalse(self.state.isCurrent())
+            self.assertEqual(state.load().aesKey, other.aesKey)
+
+        d = other.flush()
+        d.addCallback(lambda _: self.state.flush())
+        d.addCallback(written)
+        return d
+
+class ReplayTest( unittest.TestCase ):
+
+    def setUp( self ):
+        self.tmpDir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpDir, const.REPLAY_FILE)
+        self.keys = [os.urandom(const.HMAC_SHA256_128_LENGTH) for _ in range(10)]
+        # Journaled trackers are restored at the current time.
+        self.start = replay.Tracker.bucketOf(time.time()) * const.REPLAY_BUCKET_WIDTH
+
+    def tearDown( self ):
+        shutil.rmtree(self.tmpDir)
+
+    def checkTracker( self, tracker ):
+        for i, key in enumerate(self.keys):
+            tracker.addElement(key, now=self.start + i * const.REPLAY_BUCKET_WIDTH)
+        now = self.start + len(self.keys) * const.REPLAY_BUCKET_WIDTH
+        self.assertTrue(all([tracker.isPresent(key, now) for key in self.keys]))
+        self.assertFalse(tracker.isPresent(b"B" * 16, now))
+        self.assertRaises(LookupError, tracker.addElement, self.keys[0], now)
+
+        # Keys expire bucket by bucket.
+        now = self.start + const.EPOCH_GRANULARITY + 2 * const.REPLAY_BUCKET_WIDTH
+        self.assertFalse(tracker.isPresent(self.keys[0], now))
+        self.assertFalse(tracker.isPresent(self.keys[1], now))
+        self.assertTrue(tracker.isPresent(self.keys[2], now))
+        self.assertEqual(len(tracker), len(self.keys) - 2)
+
+    def test1_buckets( self ):
+        self.checkTracker(replay.Tracker(bloomBits=0))
+
+    def test2_bloomFilter( self ):
+        self.checkTracker(replay.Tracker(bloomBits=2 ** 16))
+
+        bloom = replay.BloomFilter(1024, 4)
+        bloom.add(self.keys[0])
+        self.assertTrue(self.keys[0] in bloom)
+        self.assertEqual(sum([bin(byte).count("1") for byte in bloom.array]),
+                         len(set(bloom.positions(self.keys[0]))))
+
+    def test3_journal( self ):
+        tracker = replay.Tracker(self.path)
+        self.checkTracker(tracker)
+
+        # Expired keys are gone from the compacted journal, too.
+        now = self.start + const.EPOCH_GRANULARITY + 2 * const.REPLAY_BUCKET_WIDTH
+        restored = replay.Tracker(self.path)
+        self.assertEqual(len(restored), len(self.keys) - 2)
+        self.assertTrue(restored.isPresent(self.keys[-1], now))
+        self.assertEqual(os.path.getsize(self.path), len(restored) *
+                         (replay.RECORD.size + const.HMAC_SHA256_128_LENGTH))
+
+        # A record cut short by a crash is ignored.
+        tracker.addElement(self.keys[0], now)
+        with open(self.path, "ab") as fd:
+            fd.write(replay.RECORD.pack(tracker.bucketOf(now), 16) + b"X")
+        restored = replay.Tracker(self.path)
+        restored.restore(now)
+        self.assertTrue(restored.isPresent(self.keys[0], now))
+
+    def test4_pickle( self ):
+        tracker = replay.Tracker(self.path)
+        tracker.addElement(self.keys[0])
+        data = pickle.dumps(tracker)
+        self.assertFalse(self.keys[0] in data)
+        self.assertTrue(pickle.loads(data).isPresent(self.keys[0]))
+
+        tracker = replay.Tracker()
+        tracker.addElement(self.keys[0])
+        self.assertTrue(pickle.loads(pickle.dumps(tracker)).isPresent(self.keys[0]))
+
+    def test5_sharedJournal( self ):
+        # Two server processes sharing the journal.
+        first, second = replay.Tracker(self.path), replay.Tracker(self.path)
+        first.addElement(self.keys[0], self.start)
+        self.assertTrue(second.isPresent(self.keys[0], self.start))
+        self.assertRaises(LookupError, second.addElement, self.keys[0],
+                          self.start)
+
+        # Records appended after the other process compacted are not lost.
+        second.addElement(self.keys[1], self.start)
+        second.compactJournal(second.bucketOf(self.start))
+        first.addElement(self.keys[2], self.start)
+        self.assertTrue(second.isPresent(self.keys[2], self.start))
+        self.assertTrue(first.isPresent(self.keys[1], self.start))
+        self.assertEqual(len(replay.Tracker(self.path)), 3)
+
+    def test6_restoreReadsOnly( self ):
+        tracker = replay.Tracker(self.path)
+        tracker.addElement(self.keys[0], self.start)
+        inode = os.stat(self.path).st_ino
+
+        # Nothing expired: the journal is read, not rewritten.
+        self.assertTrue(pickle.loads(pickle.dumps(tracker)).isPresent(
+                        self.keys[0], self.start))
+        self.assertEqual(os.stat(self.path).st_ino, inode)
+
+        # A truncated record is compacted away.
+        with open(self.path, "ab") as fd:
+            fd.write(replay.RECORD.pack(tracker.bucketOf(self.start), 16))
+        self.assertEqual(len(replay.Tracker(self.path)), 1)
+        self.assertNotEqual(os.stat(self.path).st_ino, inode)
+        self.assertEqual(os.path.getsize(self.path),
+                         replay.RECORD.size + const.HMAC_SHA256_128_LENGTH)
+
 class MockArgs( object ):
     uniformDHSecret = sharedSecret = ext_cookie_file = dest = None
     mode = 'socks'
@@ -389,6 +621,60 @@ class MessageTest( unittest.TestCase ):
         self.assertRaises(base.PluggableTransportError,
                           message.ProtocolMessage, "1", paddingLen=const.MPU)
 
+    def newCrypter( self ):
+        crypter = mycrypto.PayloadCrypter()
+        crypter.setSessionKey(b"A" * 32, b"A" * 8)
+        return crypter
+
+    def newMessages( self ):
+        msgs = message.createProtocolMessages(os.urandom(3 * const.MPU + 100))
+        msgs.append(message.new(b"", paddingLen=500, flags=const.FLAG_PRNG_SEED))
+        msgs.append(message.new(b"ticket", paddingLen=10,
+                                flags=const.FLAG_NEW_TICKET))
+        return msgs
+
+    def test5_encryptMessages( self ):
+        msgs = self.newMessages()
+        hmacKey = b"B" * 32
+
+        # Same wire format as messages encrypted one by one.
+        crypter = self.newCrypter()
+        expected = b""
+        for msg in msgs:
+            encrypted = crypter.encrypt(msg.plaintext())
+            expected += mycrypto.HMAC_SHA256_128(hmacKey, encrypted) + encrypted
+
+        blurb = message.encryptMessages(msgs, self.newCrypter(),
+                                        mycrypto.PrecomputedHMAC(hmacKey))
+        self.assertEqual(blurb, expected)
+
+    def test6_MessageExtractor( self ):
+        msgs = self.newMessages()
+        hmac = mycrypto.PrecomputedHMAC(b"B" * 32)
+        blurb = message.encryptMessages(msgs, self.newCrypter(), hmac)
+
+        # Messages split across reads come out once complete.
+        extractor = message.MessageExtractor()
+        recvCrypter = self.newCrypter()
+        extracted = []
+        for i in range(0, len(blurb), 1000):
+            extracted += extractor.extract(blurb[i:i + 1000], recvCrypter, hmac)
+            self.assertTrue(len(extractor.keystream) <=
+                            len(extractor.recvBuf) + len(msgs) *
+                            const.HMAC_SHA256_128_LENGTH)
+
+        self.assertEqual([(msg.payload, msg.flags) for msg in extracted],
+                         [(msg.payload, msg.flags) for msg in msgs])
+        self.assertEqual(extractor.recvBuf, b"")
+
+    def test7_invalidMessageHMAC( self ):
+        blurb = message.encryptMessages(self.newMessages(), self.newCrypter(),
+                                        mycrypto.PrecomputedHMAC(b"B" * 32))
+
+        self.assertRaises(base.PluggableTransportError,
+                          message.MessageExtractor().extract, blurb,
+                          self.newCrypter(), mycrypto.PrecomputedHMAC(b"C" * 32))
+
 class TicketTest( unittest.TestCase ):
     def setUp( self ):
         const.STATE_LOCATION = tempfile.mkdtemp()
@@ -430,6 +716,15 @@ class TicketTest( unittest.TestCase ):
             else:
                 self.assertTrue(ss.receiveTicket(buf))
 
+    def test2_rotatedByOtherProcess( self ):
+        self.state.keyCreation = 0
+        aesKey = self.state.aesKey
+        state.State().genState()
+
+        ticket.checkKeys(self.state)
+        self.assertEqual(self.state.aesKey, aesKey)
+        self.assertFalse(self.state.dirty)
+
 class PacketMorpher( unittest.TestCase ):
 
     def test1_calcPadding( self ):
@@ -455,14 +750,51 @@ class PacketMorpher( unittest.TestCase ):
     def test2_getPadding( self ):
         pm = packetmorpher.new()
         sendCrypter = mycrypto.PayloadCrypter()
-        sendCrypter.setSessionKey("A" * 32,  "A" * 8)
-        sendHMAC = "A" * 32
+        sendCrypter.setSessionKey(b"A" * 32,  b"A" * 8)
+        sendHMAC = mycrypto.PrecomputedHMAC(b"A" * 32)
 
         for i in range(0, const.MTU + 2):
             padLen = len(pm.getPadding(sendCrypter, sendHMAC, i))
             self.assertTrue(const.HDR_LENGTH <= padLen < const.MTU + \
                             const.HDR_LENGTH)
 
+class FifoBufferTest( unittest.TestCase ):
+
+    def setUp( self ):
+        self.buf = fifobuf.Buffer()
+        for chunk in (b"abc", b"defg", b"hi"):
+            self.buf.write(chunk)
+
+    def test1_len( self ):
+        self.assertEqual(len(self.buf), 9)
+        self.buf.read(4)
+        self.assertEqual(len(self.buf), 5)
+        self.buf.read()
+        self.assertEqual(len(self.buf), 0)
+
+    def test2_read( self ):
+        self.assertEqual(self.buf.read(2), b"ab")
+        self.assertEqual(self.buf.read(4), b"cdef")
+        self.assertEqual(self.buf.read(100), b"ghi")
+        self.assertEqual(self.buf.read(), b"")
+
+    def test3_read_view( self ):
+        self.buf.read(1)
+        view = self.buf.read_view(2)
+        self.assertTrue(isinstance(view, memoryview))
+        self.assertEqual(view.tobytes(), b"bc")
+        self.assertEqual(self.buf.read_view(5).tobytes(), b"defgh")
+        self.assertEqual(self.buf.read_view().tobytes(), b"i")
+
+    def test4_read_into( self ):
+        target = bytearray(5)
+        self.assertEqual(self.buf.read_into(target), 5)
+        self.assertEqual(target, bytearray(b"abcde"))
+        target = bytearray(10)
+        self.assertEqual(self.buf.read_into(memoryview(target)[2:]), 4)
+        self.assertEqual(bytes(target[2:6]), b"fghi")
+        self.assertEqual(len(self.buf), 0)
+
 
 if __name__ == '__main__':
     unittest.main()
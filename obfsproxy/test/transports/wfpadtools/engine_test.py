@@ -0,0 +1,149 @@
+import time
+import unittest
+
+from twisted.internet.task import Clock
+
+from obfsproxy.transports.wfpadtools import const, message, tickengine, wfpad
+from obfsproxy.test.transports.wfpadtools.schedule_test import _Circuit
+
+class _Transport(object):
+    """Records the messages the engine asks for."""
+
+    def __init__(self):
+        self.emitted = []
+
+    def emitSlots(self, due):
+        self.emitted.append(due)
+
+
+@unittest.skipIf(not tickengine.available(), "NumPy is not installed")
+class TickEngineTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+        self.engine = tickengine.TickEngine(window=4, rows=2, clock=self.clock)
+
+    def tearDown(self):
+        for row, transport in enumerate(self.engine.transports):
+            if transport is not None:
+                self.engine.unregister(row)
+
+    def register(self, period=10, buffered=0, quota=-1, length=100):
+        transport = _Transport()
+        row = self.engine.register(transport, period, length)
+        self.engine.update(row, buffered, quota, now=0)
+        return transport, row
+
+    def test_register(self):
+        transports = [self.register()[0] for _ in range(5)]
+        self.assertEqual(len(self.engine), 5)
+        # The table grew to fit the rows
+        self.assertEqual(len(self.engine.active), 8)
+        self.assertEqual(self.engine.transports, transports)
+        self.engine.unregister(2)
+        self.assertEqual(len(self.engine), 4)
+        self.assertEqual(self.register()[1], 2)
+
+    def test_loop(self):
+        transport, row = self.register()
+        self.assertTrue(self.engine._loop.running)
+        self.clock.advance(const.ENGINE_TICK / const.SCALE)
+        self.assertEqual(len(transport.emitted), 1)
+        self.engine.unregister(row)
+        self.assertFalse(self.engine._loop.running)
+
+    def test_due(self):
+        padding = self.register()[0]
+        data, row = self.register(buffered=250, quota=0)
+        idle = self.register(quota=0)[0]
+        self.assertEqual(self.engine.run(0.035), 2)
+        self.assertEqual(padding.emitted, [4])
+        # Three messages carry the data
+        self.assertEqual(data.emitted, [3])
+        self.assertEqual(idle.emitted, [])
+        self.engine.update(row, 0, 0)
+        # The next messages are not due yet
+        self.assertEqual(self.engine.run(0.035), 0)
+        self.assertEqual(self.engine.run(0.04), 1)
+        self.assertEqual(padding.emitted, [4, 1])
+
+    def test_stall(self):
+        transport, row = self.register()
+        self.engine.run(100)
+        self.assertEqual(transport.emitted, [1])
+        self.assertAlmostEqual(self.engine.nextSend[row], 100.01)
+
+    def test_wake_up(self):
+        transport, row = self.register(quota=0)
+        self.engine.run(10)
+        self.engine.update(row, 100, 0, now=10)
+        self.engine.run(10)
+        self.assertEqual(transport.emitted, [1])
+
+    def test_failing_transport(self):
+        failing, _ = self.register()
+        failing.emitSlots = None
+        transport, _ = self.register()
+        self.engine.run(0)
+        self.assertEqual(transport.emitted, [1])
+
+
+@unittest.skipIf(not tickengine.available(), "NumPy is not installed")
+class EngineTransportTest(unittest.TestCase):
+    period = 100
+    length = 100
+
+    def setUp(self):
+        self.instance = tickengine._instance
+        self.engine = tickengine._instance = tickengine.TickEngine(clock=Clock())
+        self.weAreClient = getattr(wfpad.WFPadTransport, 'weAreClient', None)
+        wfpad.WFPadTransport.weAreClient = False
+        wfpad.WFPadTransport.tickEngine = True
+        self.transport = wfpad.WFPadServer()
+        self.transport.circuit = _Circuit()
+        self.transport.constantRatePacing(self.period, self.length)
+
+    def tearDown(self):
+        self.transport.circuitDestroyed(None, None)
+        tickengine._instance = self.instance
+        wfpad.WFPadTransport.tickEngine = False
+        if self.weAreClient is None:
+            del wfpad.WFPadTransport.weAreClient
+        else:
+            wfpad.WFPadTransport.weAreClient = self.weAreClient
+
+    def sentMessages(self):
+        data = b"".join(self.transport.circuit.downstream.written)
+        return message.WFPadMessageExtractor().extract(data)
+
+    def test_registered(self):
+        row = self.transport._engineRow
+        self.assertIs(self.engine.transports[row], self.transport)
+        self.transport.noPaddingDistrib()
+        self.assertEqual(self.transport._engineRow, None)
+        self.assertEqual(len(self.engine), 0)
+
+    def test_push_data(self):
+        self.transport.pushData(b'x' * 150)
+        # No timer of its own
+        self.assertEqual(self.transport._deferData, None)
+        self.assertEqual(self.engine.buffered[self.transport._engineRow], 150)
+        self.engine.run(time.time() + 1)
+
+        msgs = self.sentMessages()
+        self.assertEqual([msg.flags for msg in msgs], [const.FLAG_DATA] * 2)
+        self.assertEqual(b"".join(msg.payload for msg in msgs), b'x' * 150)
+        # Nothing left to send
+        self.assertEqual(self.engine.buffered[self.transport._engineRow], 0)
+        self.assertEqual(self.engine.run(time.time() + 2), 0)
+
+    def test_padding_while_visiting(self):
+        self.transport._visiting = True
+        self.transport.syncEngine()
+        self.engine.run(time.time() + 0.45)
+        msgs = self.sentMessages()
+        self.assertEqual([msg.flags for msg in msgs], [const.FLAG_PADDING] * 5)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,61 @@
+import gc
+import tracemalloc
+import unittest
+
+from obfsproxy.transports.wfpadtools import histo, wfpad
+from obfsproxy.transports.wfpadtools.specific import buflo, csbuflo, dynaflow, tamaraw, walkietalkie
+
+# Number of transports built per measurement
+N_CIRCUITS = 1000
+
+# Bytes that a circuit that hasn't started a session may hold, so that
+# 10k concurrent circuits fit in well under 100 MB.
+MAX_BYTES_PER_CIRCUIT = 8 * 1024
+
+
+class FootprintTestCase(unittest.TestCase):
+    """Memory held by the transports of idle circuits (server side)."""
+    transports = [wfpad.WFPadServer, buflo.BuFLOServer, tamaraw.TamarawServer,
+                  csbuflo.CSBuFLOServer, walkietalkie.WalkieTalkieServer,
+                  dynaflow.DynaflowServer]
+
+    def setUp(self):
+        # Normally set by `setup` when obfsproxy starts
+        self.weAreClient = getattr(wfpad.WFPadTransport, 'weAreClient', None)
+        wfpad.WFPadTransport.weAreClient = False
+
+    def tearDown(self):
+        if self.weAreClient is None:
+            del wfpad.WFPadTransport.weAreClient
+        else:
+            wfpad.WFPadTransport.weAreClient = self.weAreClient
+
+    def bytesPerCircuit(self, cls):
+        # Build one first so that shared tables are not accounted
+        cls()
+        gc.collect()
+        tracemalloc.start()
+        try:
+            before = tracemalloc.take_snapshot()
+            circuits = [cls() for _ in range(N_CIRCUITS)]
+            after = tracemalloc.take_snapshot()
+        finally:
+            tracemalloc.stop()
+        size = sum(stat.size_diff for stat in after.compare_to(before, 'filename'))
+        del circuits
+        return size / float(N_CIRCUITS)
+
+    def test_footprint(self):
+        for cls in self.transports:
+            size = self.bytesPerCircuit(cls)
+            self.assertLess(size, MAX_BYTES_PER_CIRCUIT,
+                            "%s holds %d bytes per circuit" % (cls.__name__, size))
+
+    def test_uniform_histograms_are_shared(self):
+        self.assertIs(histo.uniform(0), histo.uniform(0))
+        circuits = wfpad.WFPadServer(), wfpad.WFPadServer()
+        self.assertIs(circuits[0]._delayDataProbdist, circuits[1]._delayDataProbdist)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,94 @@
+"""Micro-benchmark of the allocation of WFPad messages.
+
+Run with:
+
+    python -m obfsproxy.test.transports.wfpadtools.message_bench [frames]
+
+It creates and discards padding messages the way padding-heavy defenses
+do, and reports for each variant the time, the memory held by a live
+message and the gen-0 garbage collections per 1000 frames:
+
+    dict    messages with a per-instance __dict__ (before __slots__)
+    slots   slotted messages
+    pooled  slotted messages recycled through a WFPadMessagePool
+"""
+import gc
+import sys
+import time
+import tracemalloc
+
+import obfsproxy.transports.base as base
+import obfsproxy.transports.wfpadtools.message as message
+from obfsproxy.transports.wfpadtools import const
+
+
+N_FRAMES = 200000
+N_LIVE = 1000
+
+
+class _DictMessage(object):
+    """A message with a `__dict__`, as WFPadMessage was before `__slots__`.
+
+    It is not a subclass of WFPadMessage: a subclass without `__slots__`
+    would hold both the slots and a `__dict__`.
+    """
+
+    def __init__(self, payload='', paddingLen=0, flags=const.FLAG_DATA, opcode=None, args="", queueTime=0):
+        self.payload = bytes(payload, encoding='utf-8') if isinstance(payload, str) else payload
+        self.payloadLen = len(self.payload)
+        self.totalLen = self.payloadLen + paddingLen
+        if (self.totalLen) > const.MPU:
+            raise base.PluggableTransportError("The transport created a message longer than TCP's MTU.")
+        self.sndTime = 0
+        self.rcvTime = 0
+        self.queueTime = int(queueTime)
+        self.flags = flags
+        self.opcode = opcode
+        self.argsLen = len(args)
+        self.args = bytes(args, encoding='utf-8') if isinstance(args, str) else args
+
+
+def _variants():
+    pool = message.WFPadMessagePool(maxSize=64)
+    return [("dict", _DictMessage, lambda msg: None),
+            ("slots", message.WFPadMessage, lambda msg: None),
+            ("pooled", pool.acquire, pool.release)]
+
+
+def _bytesPerMessage(new):
+    """Return the bytes held by one live message."""
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    live = [new("", const.MPU, const.FLAG_PADDING) for _ in range(N_LIVE)]
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    size = sum(stat.size_diff for stat in after.compare_to(before, 'filename'))
+    del live
+    return size / float(N_LIVE)
+
+
+def _churn(new, release, frames):
+    """Create and discard `frames` messages.
+
+    Return the elapsed time and the number of gen-0 collections.
+    """
+    collections = gc.get_stats()[0]['collections']
+    start = time.perf_counter()
+    for _ in range(frames):
+        msg = new("", const.MPU, const.FLAG_PADDING)
+        release(msg)
+    elapsed = time.perf_counter() - start
+    return elapsed, gc.get_stats()[0]['collections'] - collections
+
+
+def main(frames=N_FRAMES):
+    print("%-8s %12s %14s %18s" % ("variant", "ns/frame", "bytes/message", "gen0 GCs/1k frames"))
+    for name, new, release in _variants():
+        size = _bytesPerMessage(new)
+        elapsed, collections = _churn(new, release, frames)
+        print("%-8s %12.0f %14.0f %18.3f" % (name, elapsed * 1e9 / frames, size,
+                                              collections * 1000.0 / frames))
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else N_FRAMES)
@@ -156,5 +156,31 @@ class WFPadMessageExtractorTest(unittest.TestCase):
                             "Messages do not match for message number %d!" % i)
 
 
+
+class WFPadMessagePoolTest(unittest.TestCase):
+
+    def setUp(self):
+        self.pool = msg.WFPadMessagePool(maxSize=1)
+        self.msgFactory = msg.WFPadMessageFactory(self.pool)
+
+    def test_messages_have_no_dict(self):
+        self.assertFalse(hasattr(msg.WFPadMessage(), '__dict__'))
+
+    def test_released_message_is_reused(self):
+        first = self.msgFactory.newIgnore(100)
+        self.pool.release(first)
+        self.assertEqual(len(self.pool), 1)
+        self.assertEqual(first.payload, b'')
+
+        second = self.msgFactory.new("payload")
+        self.assertIs(second, first)
+        self.assertEqual(second.payload, b'payload')
+        self.assertEqual(second.flags, const.FLAG_DATA)
+        self.assertEqual(len(self.pool), 0)
+
+    def test_pool_is_bounded(self):
+        self.pool.releaseAll([self.msgFactory.newIgnore(1) for _ in range(3)])
+        self.assertEqual(len(self.pool), 1)
+
 if __name__ == "__main__":
     unittest.main()
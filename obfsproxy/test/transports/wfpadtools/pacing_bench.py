@@ -0,0 +1,122 @@
+"""Benchmark of timer-paced vs kernel-paced constant-rate sending.
+
+Run with:
+
+    python -m obfsproxy.test.transports.wfpadtools.pacing_bench [period_ms] [seconds]
+
+A sender writes frames of a constant-rate defense to a receiver over
+loopback, and the receiver timestamps their arrival:
+
+    timer   one timer per frame, as the timer path of BuFLO and Tamaraw
+    kernel  one timer per `const.PACING_TICK` ms that writes the frames of
+            the tick at once, on a socket paced with SO_MAX_PACING_RATE
+
+For each variant, it reports the jitter of the inter-arrival times
+(mean absolute deviation from the period) and the CPU time used by the
+sender per 1000 frames. The MSS of the connection is set to the frame
+size, so that the kernel paces frames rather than 64 KB loopback
+segments. Pass a busy period in ms with BUSY_MS=... in the environment
+to load the sender between timers, as a loaded reactor would be.
+"""
+import os
+import socket
+import sys
+import threading
+import time
+
+from obfsproxy.transports.wfpadtools import const, pacing
+
+
+PERIOD = 1.0
+SECONDS = 3
+FRAME = const.MPU + const.MIN_HDR_LEN
+BUSY_MS = float(os.environ.get("BUSY_MS", 0))
+
+
+def _receive(conn, arrivals):
+    pending = 0
+    while True:
+        data = conn.recv(65536)
+        if not data:
+            return
+        pending += len(data)
+        now = time.time()
+        while pending >= FRAME:
+            pending -= FRAME
+            arrivals.append(now)
+
+
+def _busy(ms):
+    end = time.perf_counter() + ms / const.SCALE
+    while time.perf_counter() < end:
+        pass
+
+
+def _sleepUntil(t):
+    delay = t - time.time()
+    if delay > 0:
+        time.sleep(delay)
+
+
+def _send(sock, period, seconds, framesPerTick):
+    """Send a frame every `period` ms, `framesPerTick` frames per timer."""
+    frame = b'\0' * FRAME
+    tick = period * framesPerTick / const.SCALE
+    start = time.time()
+    n = int(seconds * const.SCALE / period / framesPerTick)
+    for i in range(n):
+        _sleepUntil(start + i * tick)
+        sock.sendall(frame * framesPerTick)
+        if BUSY_MS:
+            _busy(BUSY_MS)
+    return n * framesPerTick
+
+
+def _run(period, seconds, kernel):
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.bind(("127.0.0.1", 0))
+    listener.listen(1)
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_MAXSEG, FRAME)
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    sock.connect(listener.getsockname())
+    conn, _ = listener.accept()
+    listener.close()
+
+    framesPerTick = 1
+    if kernel:
+        if not pacing.setPacingRate(sock, pacing.pacingRate(period, FRAME)):
+            sock.close()
+            conn.close()
+            return None
+        framesPerTick = pacing.framesPerTick(period)
+
+    arrivals = []
+    receiver = threading.Thread(target=_receive, args=(conn, arrivals))
+    receiver.start()
+    cpu = time.thread_time()
+    frames = _send(sock, period, seconds, framesPerTick)
+    cpu = time.thread_time() - cpu
+    sock.close()
+    receiver.join()
+    conn.close()
+
+    gaps = [(b - a) * const.SCALE for a, b in zip(arrivals, arrivals[1:])]
+    jitter = sum(abs(gap - period) for gap in gaps) / len(gaps)
+    return jitter, cpu * const.SCALE * 1000 / frames
+
+
+def main(period=PERIOD, seconds=SECONDS):
+    print("period=%sms frame=%dB tick=%sms busy=%sms" % (period, FRAME, const.PACING_TICK, BUSY_MS))
+    print("%-8s %12s %22s" % ("variant", "jitter (ms)", "sender CPU ms/1k frames"))
+    for name, kernel in (("timer", False), ("kernel", True)):
+        result = _run(period, seconds, kernel)
+        if result is None:
+            print("%-8s %12s" % (name, "unsupported"))
+            continue
+        print("%-8s %12.3f %22.2f" % ((name,) + result))
+
+
+if __name__ == "__main__":
+    main(float(sys.argv[1]) if len(sys.argv) > 1 else PERIOD,
+         float(sys.argv[2]) if len(sys.argv) > 2 else SECONDS)
@@ -0,0 +1,55 @@
+import socket
+import unittest
+
+from obfsproxy.transports.wfpadtools import const, pacing, wfpad
+
+
+class PacingTest(unittest.TestCase):
+
+    def test_frames_per_tick(self):
+        self.assertEqual(pacing.framesPerTick(1), const.PACING_TICK)
+        self.assertEqual(pacing.framesPerTick(const.PACING_TICK * 2), 1)
+        self.assertEqual(pacing.framesPerTick(0), 1)
+
+    def test_pacing_rate(self):
+        rate = pacing.pacingRate(10, const.MTU)
+        self.assertEqual(rate, (const.MTU + pacing.FRAME_OVERHEAD) * 100)
+
+    def test_no_socket(self):
+        self.assertFalse(pacing.setPacingRate(None, 1000))
+
+    @unittest.skipIf(pacing.SO_MAX_PACING_RATE is None, "no SO_MAX_PACING_RATE")
+    def test_set_pacing_rate(self):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        try:
+            self.assertTrue(pacing.setPacingRate(sock, 125000))
+            self.assertEqual(sock.getsockopt(socket.SOL_SOCKET, pacing.SO_MAX_PACING_RATE), 125000)
+            self.assertTrue(pacing.clearPacingRate(sock))
+        finally:
+            sock.close()
+
+
+class ConstantRatePacingTest(unittest.TestCase):
+
+    def setUp(self):
+        self.weAreClient = getattr(wfpad.WFPadTransport, 'weAreClient', None)
+        wfpad.WFPadTransport.weAreClient = False
+        wfpad.WFPadTransport.kernelPacing = True
+        self.transport = wfpad.WFPadServer()
+
+    def tearDown(self):
+        wfpad.WFPadTransport.kernelPacing = False
+        if self.weAreClient is None:
+            del wfpad.WFPadTransport.weAreClient
+        else:
+            wfpad.WFPadTransport.weAreClient = self.weAreClient
+
+    def test_fallback_to_timers(self):
+        # Without a downstream socket, the kernel can't pace.
+        self.transport.constantRatePacing(1)
+        self.assertEqual(self.transport._framesPerTick, 1)
+        self.assertEqual(self.transport._delayDataProbdist.randomSample(), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
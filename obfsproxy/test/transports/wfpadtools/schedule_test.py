@@ -0,0 +1,127 @@
+import time
+import unittest
+
+from twisted.internet import reactor
+from twisted.internet.task import Clock
+
+from obfsproxy.transports.wfpadtools import const, message, wfpad
+from obfsproxy.transports.wfpadtools.schedule import ConstantRateSchedule
+
+
+class ConstantRateScheduleTest(unittest.TestCase):
+
+    def test_frames(self):
+        sched = ConstantRateSchedule(10, 100, start=0)
+        self.assertEqual(sched.padding, message.WFPadMessage('', 100, const.FLAG_PADDING).bytes())
+        data = b'x' * 100
+        self.assertEqual(sched.dataHeader + data, message.WFPadMessage(data).bytes())
+        self.assertEqual(sched.frameLen, len(sched.padding))
+
+    def test_due(self):
+        sched = ConstantRateSchedule(10, window=4, start=0)
+        self.assertEqual(sched.due(0.015), 2)
+        self.assertEqual(sched.due(0.015), 0)
+        self.assertEqual(sched.nextTime(), 0.02)
+        # Across the end of the window
+        self.assertEqual(sched.due(0.045), 3)
+        self.assertAlmostEqual(sched.nextTime(), 0.05)
+
+    def test_restart(self):
+        sched = ConstantRateSchedule(10, window=4, start=0)
+        self.assertEqual(sched.due(100), 1)
+        self.assertEqual(sched.nextTime(), 100.01)
+        sched.paused = True
+        self.assertEqual(sched.due(200), 1)
+
+
+class _Downstream(object):
+    def __init__(self):
+        self.written = []
+
+    def write(self, buf):
+        self.written.append(buf)
+
+    def writeSequence(self, bufs):
+        self.written.append(b"".join(bufs))
+
+
+class _Circuit(object):
+    def __init__(self):
+        self.downstream = _Downstream()
+
+    def shouldDropPadding(self):
+        return False
+
+    def updateBackpressure(self):
+        pass
+
+    def updateMemoryUsage(self):
+        pass
+
+
+class EmitScheduledTest(unittest.TestCase):
+    period = 100
+    length = 100
+
+    def makeDue(self, n):
+        """Make the first `n` messages of the schedule due."""
+        sched = self.transport._schedule
+        sched.restart(time.time() - (n - 0.5) * self.period / const.SCALE)
+
+    def setUp(self):
+        self.clock = Clock()
+        self.callLater = reactor.callLater
+        reactor.callLater = self.clock.callLater
+        self.weAreClient = getattr(wfpad.WFPadTransport, 'weAreClient', None)
+        wfpad.WFPadTransport.weAreClient = False
+        self.transport = wfpad.WFPadServer()
+        self.transport.circuit = _Circuit()
+        self.transport._visiting = True
+        self.transport.constantRatePacing(self.period, self.length)
+
+    def tearDown(self):
+        reactor.callLater = self.callLater
+        if self.weAreClient is None:
+            del wfpad.WFPadTransport.weAreClient
+        else:
+            wfpad.WFPadTransport.weAreClient = self.weAreClient
+
+    def sentMessages(self):
+        data = b"".join(self.transport.circuit.downstream.written)
+        return message.WFPadMessageExtractor().extract(data)
+
+    def test_fill_with_data_then_padding(self):
+        self.makeDue(5)
+        self.transport._buffer.write(b'x' * int(self.length * 2.5))
+        self.transport.flushBuffer()
+
+        msgs = self.sentMessages()
+        self.assertEqual([msg.flags for msg in msgs], [const.FLAG_DATA] * 3 + [const.FLAG_PADDING] * 2)
+        self.assertEqual(b"".join(msg.payload for msg in msgs), b'x' * int(self.length * 2.5))
+        self.assertEqual(set(msg.totalLen for msg in msgs), set([self.length]))
+        self.assertEqual(self.transport.session.numMessages['snd'], 5)
+        self.assertEqual(self.transport.session.dataMessages['snd'], 3)
+        self.assertTrue(self.transport._deferData)
+
+    def test_pause_when_idle(self):
+        self.transport._visiting = False
+        self.transport.flushBuffer()
+        self.assertEqual(self.sentMessages(), [])
+        self.assertTrue(self.transport._schedule.paused)
+        self.assertEqual(self.transport._deferData, None)
+
+    def test_stop_condition(self):
+        self.transport._visiting = False
+        self.transport.session.is_padding = True
+        self.transport.stopCondition = lambda s: s.session.numMessages['snd'] >= 2
+        self.makeDue(5)
+        self.transport.flushBuffer()
+        msgs = self.sentMessages()
+        self.assertEqual([msg.flags for msg in msgs[:2]], [const.FLAG_PADDING] * 2)
+        # Followed by the notification of the end of padding
+        self.assertTrue(message.isControl(msgs[2]))
+        self.assertFalse(self.transport.session.is_padding)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -3,7 +3,7 @@ from twisted.internet.base import DelayedCall
 from twisted.trial import unittest
 
 from obfsproxy.test.transports.wfpadtools.twisted import primitives_tester as pt
-from obfsproxy.transports.wfpadtools import const
+from obfsproxy.transports.wfpadtools import const, histo
 from obfsproxy.transports.wfpadtools.message import isData, isPadding
 from obfsproxy.transports.wfpadtools.util import genutil as gu
 from obfsproxy.transports.wfpadtools.util import mathutil   
@@ -258,3 +258,62 @@ class BatchPadTestCase(pt.SessionPrimitiveTestCase, unittest.TestCase):
         ts_len = 10
         stop_bytes = const.MPU * n_padd_msgs + n_data_msgs * ts_len + const.MPU
         self.assertLessEqual(abs(num_bytes - stop_bytes), 1)
+
+
+class SessionEndTestCase(pt.SessionPrimitiveTestCase, unittest.TestCase):
+
+    def test_session_ends_when_buffer_is_drained(self):
+        self.pt_client._delayDataProbdist = histo.uniform(100)
+        self.send_timestamp(self.pt_client)
+        self.pt_client.onSessionEnds(self.sess_id)
+        self.assertTrue(self.pt_client.isVisiting())
+        self.advance_next_delayed_call()  # flush buffer
+        self.assertFalse(self.pt_client.isVisiting())
+
+    def test_end_padding_fires_peer_stop_padding(self):
+        stopped = []
+        self.pt_client.session.is_peer_padding = True
+        self.pt_client.session.peer_stop_padding.addCallback(stopped.append)
+        self.pt_client.relayEndPadding()
+        self.assertEqual(stopped, [True])
+
+    def test_session_ends_after_peer_stopped_padding(self):
+        ended = []
+        self.patch(self.pt_client._shim, 'notifyEndPadding', lambda: ended.append(True))
+        self.pt_client.relayEndPadding()
+        self.pt_client.onSessionEnds(self.sess_id)
+        self.assertEqual(ended, [])
+        self.pt_client.relayEndPadding()
+        self.assertEqual(ended, [True])
+
+    def test_end_two_sessions_in_a_row(self):
+        ended = []
+        self.patch(self.pt_client._shim, 'notifyEndPadding', lambda: ended.append(True))
+        for sessions in range(1, 3):
+            if sessions > 1:
+                self.pt_client.onSessionStarts(self.sess_id)
+            self.pt_client.onSessionEnds(self.sess_id)
+            self.assertTrue(self.pt_client.session.is_peer_padding)
+            self.pt_client.onEndPadding()
+            self.pt_client.relayEndPadding()
+            # Notified once per session
+            self.assertEqual(len(ended), sessions)
+
+
+class HibernationTestCase(pt.SessionPrimitiveTestCase, unittest.TestCase):
+
+    def test_hibernate_cancels_timers_and_wakes_up_on_data(self):
+        self.pt_client.onSessionEnds(self.sess_id)
+        self.pt_client.session.is_padding = False
+        self.pt_client.hibernate()
+        self.assertEqual(len(self.pt_client._timers), 0)
+        self.assertEqual(len(self.pt_client.session.history), 0)
+
+        self.send_timestamp(self.pt_client)
+        self.assertFalse(self.pt_client._hibernating)
+        self.advance_next_delayed_call()  # flush buffer
+        self.assertGreater(self.pt_client.session.dataMessages['snd'], 0)
+
+    def test_busy_circuit_does_not_hibernate(self):
+        self.pt_client.checkIdle()
+        self.assertFalse(self.pt_client._hibernating)
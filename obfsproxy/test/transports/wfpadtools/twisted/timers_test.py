@@ -0,0 +1,39 @@
+from twisted.internet import reactor
+from twisted.internet.task import Clock
+from twisted.trial import unittest
+
+from obfsproxy.transports.wfpadtools import common
+
+
+class TimerRegistryTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+        self.callLater = reactor.callLater
+        reactor.callLater = self.clock.callLater
+        self.timers = common.TimerRegistry('test')
+        self.calls = []
+
+    def tearDown(self):
+        reactor.callLater = self.callLater
+
+    def test_fired_calls_are_forgotten(self):
+        self.timers.deferLater(10, self.calls.append, 1)
+        self.assertEqual(len(self.timers), 1)
+        self.clock.advance(1)
+        self.assertEqual(self.calls, [1])
+        self.assertEqual(len(self.timers), 0)
+
+    def test_cancel_all(self):
+        self.timers.deferLater(10, self.calls.append, 1)
+        self.timers.deferLater(20, self.calls.append, 2)
+        self.assertEqual(self.timers.cancelAll(), 2)
+        self.assertFalse(self.clock.getDelayedCalls())
+        self.clock.advance(1)
+        self.assertEqual(self.calls, [])
+
+    def test_no_calls_after_cancel_all(self):
+        self.timers.cancelAll()
+        d = self.timers.deferLater(10, self.calls.append, 1)
+        self.assertTrue(d.called)
+        self.assertFalse(self.clock.getDelayedCalls())
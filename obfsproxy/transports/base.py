@@ -15,9 +15,14 @@ This module contains BaseTransport, a pluggable transport skeleton class.
 
 def addrport(string):
     """
-    Receive '<addr>:<port>' and return (<addr>,<port>).
+    Receive '<addr>:<port>' and return (<addr>,<port>), or receive
+    'unix:<path>' and return it as it is.
     Used during argparse CLI parsing.
     """
+    if string.startswith('unix:'):
+        if len(string) == len('unix:'):
+            raise argparse.ArgumentTypeError("Missing path of unix socket.")
+        return string
     try:
         return pyptlib.util.parse_addr_spec(string, resolve=True)
     except ValueError as err:
@@ -31,8 +36,16 @@ class BaseTransport(object):
 
     Attributes:
     circuit: Circuit object. This is set just before circuitConnected is called.
+    expensiveHandshake: True if the server side of the handshake is
+                        expensive enough (public-key crypto, key
+                        stretching) to go through handshake admission
+                        control (see network/admission.py). Such
+                        transports must call
+                        circuit.handshakeCompleted() when it's over.
     """
 
+    expensiveHandshake = False
+
     def __init__(self):
         """
         Initialize transport. This is called right after TCP connect.
@@ -105,6 +118,31 @@ class BaseTransport(object):
         'data' is an obfsproxy.network.buffer.Buffer.
         """
 
+    def getQueuedBytes(self):
+        """
+        Return the number of bytes received from upstream that we have
+        not sent downstream yet.
+
+        Transports that queue upstream data should override this, and
+        call self.circuit.updateBackpressure() whenever their queue
+        shrinks, so that the circuit can pause and resume reading from
+        upstream.
+        """
+        return 0
+
+    def getMemoryUsage(self):
+        """
+        Return the number of bytes we hold on behalf of our circuit
+        (queued data, partially received messages, ...).
+
+        Transports that buffer data should override this if they hold
+        more than getQueuedBytes(), and call
+        self.circuit.updateMemoryUsage() whenever they append to or
+        drain their buffers, so that the circuit can enforce the memory
+        budgets.
+        """
+        return self.getQueuedBytes()
+
     def handle_socks_args(self, args):
         """
         'args' is a list of k=v strings that serve as configuration
@@ -149,6 +187,12 @@ class BaseTransport(object):
         elif (args.mode == 'ext_server') and (not args.ext_cookie_file):
             err = "You need to specify --ext-cookie-file as an ext_server."
 
+        elif (args.mode != 'socks') and isinstance(args.listen_addr, str):
+            err = "Only 'socks' mode can listen on a unix socket."
+
+        elif (args.mode == 'client') and isinstance(args.dest, str):
+            err = "'client' mode can't connect to the bridge through a unix socket."
+
         if not err: # We didn't encounter any errors during validation
             return True
         else: # Ugh, something failed.
@@ -26,14 +26,14 @@ class DummyTransport(BaseTransport):
         Got data from downstream; relay them upstream.
         """
         log.info('recieved {} bytes of data from downstream'.format(len(data)))
-        self.circuit.upstream.write(data.read())
+        self.circuit.upstream.writeSequence(data.read_views())
 
     def receivedUpstream(self, data):
         """
         Got data from upstream; relay them downstream.
         """
         log.info('recieved {} bytes of data from upstream'.format(len(data)))
-        self.circuit.downstream.write(data.read())
+        self.circuit.downstream.writeSequence(data.read_views())
 
 class DummyClient(DummyTransport):
 
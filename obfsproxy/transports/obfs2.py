@@ -9,10 +9,15 @@ import random
 import hashlib
 import argparse
 import sys
+from collections import OrderedDict
+
+from twisted.internet import defer
 
 import obfsproxy.common.aes as aes
+import obfsproxy.common.metrics as metrics
 import obfsproxy.common.serialize as srlz
 import obfsproxy.common.rand as rand
+import obfsproxy.common.workers as workers
 
 import obfsproxy.transports.base as base
 
@@ -25,12 +30,21 @@ SEED_LENGTH = 16
 MAX_PADDING = 8192
 HASH_ITERATIONS = 100000
 
+# Number of stretched MACs remembered by 'defer_mac'.
+MAC_CACHE_SIZE = 1024
+
 KEYLEN = 16  # is the length of the key used by E(K,s) -- that is, 16.
 IVLEN = 16  # is the length of the IV used by E(K,s) -- that is, 16.
 
 ST_WAIT_FOR_KEY = 0
 ST_WAIT_FOR_PADDING = 1
 ST_OPEN = 2
+ST_WAIT_FOR_SECRET = 3 # Deriving the keys from the seeds.
+ST_WAIT_FOR_MAGIC = 4 # Keys ready: reading the magic value and the padding length.
+
+mac_cache_lookups = metrics.registry.counter(
+    'obfsproxy_obfs2_mac_cache_lookups_total',
+    'Number of stretched obfs2 MACs found (hit) or not (miss) in the cache.', ('result',))
 
 def h(x):
     """ H(x) is SHA256 of x. """
@@ -42,10 +56,47 @@ def h(x):
 def hn(x, n):
     """ H^n(x) is H(x) called iteratively n times. """
 
-    data = x
+    sha256 = hashlib.sha256
     for _ in range(n):
-        data = h(data)
-    return data
+        x = sha256(x).digest()
+    return x
+
+def stretched_mac(s, x, secret, iterations):
+    """
+    Return the obfs2 MAC of a shared secret: H^n(s | x | H(SECRET) | s)
+    where n = 'iterations'.
+    """
+    return hn(s + x + h(secret) + s, iterations)
+
+_macs = OrderedDict()
+
+def defer_mac(s, x, secret, iterations):
+    """
+    Like 'stretched_mac', but stretch in a worker process (see
+    workers.py): the hundred thousand hashes would stall the reactor for
+    tens of milliseconds. hashlib keeps the GIL on such short inputs, so
+    a thread would stall it all the same. Return a Deferred that fires
+    with the MAC.
+
+    The last MAC_CACHE_SIZE MACs are cached, so that a seed that comes
+    back (e.g. a replayed handshake) is not stretched again.
+    """
+    key = (s, x, secret, iterations)
+    if key in _macs:
+        mac_cache_lookups.inc(('hit',))
+        _macs.move_to_end(key)
+        return defer.succeed(_macs[key])
+
+    mac_cache_lookups.inc(('miss',))
+    d = workers.run(stretched_mac, s, x, secret, iterations, mode=workers.PROCESSES)
+    d.addCallback(_cache_mac, key)
+    return d
+
+def _cache_mac(mac, key):
+    _macs[key] = mac
+    while len(_macs) > MAC_CACHE_SIZE:
+        _macs.popitem(last=False)
+    return mac
 
 class Obfs2Transport(base.BaseTransport):
     """
@@ -99,6 +150,11 @@ class Obfs2Transport(base.BaseTransport):
         # must remember to push the cached upstream data downstream.
         self.pending_data_to_send = False
 
+    @property
+    def expensiveHandshake(self):
+        """Key stretching makes the handshake expensive."""
+        return bool(self.shared_secret)
+
     @classmethod
     def setup(cls, transport_config):
         """Setup the obfs2 pluggable transport."""
@@ -161,13 +217,22 @@ class Obfs2Transport(base.BaseTransport):
         Do the obfs2 handshake:
         SEED | E_PAD_KEY( UINT32(MAGIC_VALUE) | UINT32(PADLEN) | WR(PADLEN) )
         """
+        seed = self.initiator_seed if self.we_are_initiator else self.responder_seed
+
         # Generate keys for outgoing padding.
-        self.send_padding_crypto = \
-            self._derive_padding_crypto(self.initiator_seed if self.we_are_initiator else self.responder_seed,
-                                        self.send_pad_keytype)
+        d = self._defer_macs([(self.send_pad_keytype, seed)])
+        d.addCallback(self._send_handshake, seed)
+        d.addErrback(self._stretching_failed)
+
+    def _send_handshake(self, macs, seed):
+        """
+        Send our handshake, encrypted with the padding key in 'macs'.
+        """
+        if self.circuit.closed:
+            return
 
+        self.send_padding_crypto = self._crypto(macs[0])
         padding_length = random.randint(0, MAX_PADDING)
-        seed = self.initiator_seed if self.we_are_initiator else self.responder_seed
 
         handshake_message = seed + self.send_padding_crypto.crypt(srlz.htonl(MAGIC_VALUE) +
                                                                   srlz.htonl(padding_length) +
@@ -179,6 +244,9 @@ class Obfs2Transport(base.BaseTransport):
 
         self.circuit.downstream.write(handshake_message)
 
+        # The other side's handshake waits for ours (see receivedDownstream).
+        self._resume_downstream()
+
     def receivedUpstream(self, data):
         """
         Got data from upstream. We need to obfuscated and proxy them downstream.
@@ -201,6 +269,9 @@ class Obfs2Transport(base.BaseTransport):
 
         if self.state == ST_WAIT_FOR_KEY:
             log.debug("%s: Waiting for key." % log_prefix)
+            if not self.send_padding_crypto:
+                log.debug("%s: Our handshake is not sent yet." % log_prefix)
+                return data # resumed by _send_handshake()
             if len(data) < SEED_LENGTH + 8:
                 log.debug("%s: Not enough bytes for key (%d)." % (log_prefix, len(data)))
                 return data # incomplete
@@ -211,12 +282,22 @@ class Obfs2Transport(base.BaseTransport):
                 self.initiator_seed = data.read(SEED_LENGTH)
 
             # Now that we got the other seed, let's set up our crypto.
-            self.send_crypto = self._derive_crypto(self.send_keytype)
-            self.recv_crypto = self._derive_crypto(self.recv_keytype)
-            self.recv_padding_crypto = \
-                self._derive_padding_crypto(self.responder_seed if self.we_are_initiator else self.initiator_seed,
-                                            self.recv_pad_keytype)
-
+            self.state = ST_WAIT_FOR_SECRET
+            seeds = self.initiator_seed + self.responder_seed
+            d = self._defer_macs([(self.send_keytype, seeds),
+                                  (self.recv_keytype, seeds),
+                                  (self.recv_pad_keytype, self.responder_seed if self.we_are_initiator
+                                                          else self.initiator_seed)])
+            d.addCallback(self._set_crypto)
+            if self.state == ST_WAIT_FOR_SECRET:
+                log.debug("%s: Stretching the keys outside the reactor." % log_prefix)
+                d.addCallbacks(lambda _: self._resume_downstream(), self._stretching_failed)
+
+        # The data stays buffered until the keys are derived.
+        if self.state == ST_WAIT_FOR_SECRET:
+            return data
+
+        if self.state == ST_WAIT_FOR_MAGIC:
             # XXX maybe faster with a single d() instead of two.
             magic = srlz.ntohl(self.recv_padding_crypto.crypt(data.read(4)))
             padding_length = srlz.ntohl(self.recv_padding_crypto.crypt(data.read(4)))
@@ -245,6 +326,7 @@ class Obfs2Transport(base.BaseTransport):
                       log_prefix, n_to_drain, self.padding_left_to_read, len(data))
 
         self.state = ST_OPEN
+        self.circuit.handshakeCompleted()
         log.debug("%s: Processing %d bytes of application data.",
                   log_prefix, len(data))
 
@@ -255,23 +337,46 @@ class Obfs2Transport(base.BaseTransport):
 
         self.circuit.upstream.write(self.recv_crypto.crypt(data.read()))
 
-    def _derive_crypto(self, pad_string): # XXX consider secret_seed
+    def _defer_macs(self, inputs):
         """
-        Derive and return an obfs2 key using the pad string in 'pad_string'.
+        Return a Deferred that fires with the list of the MACs of the
+        (pad string, x) pairs in 'inputs'. With a shared secret, the MACs
+        are stretched outside the reactor (see defer_mac); otherwise, the
+        Deferred has already fired.
         """
-        secret = self.mac(pad_string,
-                          self.initiator_seed + self.responder_seed,
-                          self.shared_secret)
-        return aes.AES_CTR_128(secret[:KEYLEN], secret[KEYLEN:],
-                               counter_wraparound=True)
+        if not self.shared_secret:
+            return defer.succeed([self.mac(s, x, None) for s, x in inputs])
+
+        return defer.gatherResults([defer_mac(s, x, self.shared_secret, self.ss_hash_iterations)
+                                    for s, x in inputs], consumeErrors=True)
+
+    def _set_crypto(self, macs):
+        """
+        Set up the crypto of the data and of the incoming padding from
+        the MACs derived from both seeds.
+        """
+        send_mac, recv_mac, recv_padding_mac = macs
+        self.send_crypto = self._crypto(send_mac)
+        self.recv_crypto = self._crypto(recv_mac)
+        self.recv_padding_crypto = self._crypto(recv_padding_mac)
+        self.state = ST_WAIT_FOR_MAGIC
+
+    def _resume_downstream(self):
+        """
+        Process the downstream data that was buffered while we waited.
+        """
+        if not self.circuit.closed and self.circuit.downstream.buffer:
+            self.circuit.downstream.dataReceived(b'')
+
+    def _stretching_failed(self, failure):
+        log.warning("obfs2: Could not derive the keys (%s): Closing circuit." %
+                    failure.getErrorMessage())
+        self.circuit.close()
 
-    def _derive_padding_crypto(self, seed, pad_string): # XXX consider secret_seed
+    def _crypto(self, secret):
         """
-        Derive and return an obfs2 padding key using the pad string in 'pad_string'.
+        Return the AES-CTR cipher keyed by the obfs2 MAC 'secret'.
         """
-        secret = self.mac(pad_string,
-                          seed,
-                          self.shared_secret)
         return aes.AES_CTR_128(secret[:KEYLEN], secret[KEYLEN:],
                                counter_wraparound=True)
 
@@ -286,8 +391,7 @@ class Obfs2Transport(base.BaseTransport):
         where n = HASH_ITERATIONS.
         """
         if secret:
-            secret_hash = h(secret)
-            return hn(s + x + secret_hash + s, self.ss_hash_iterations)
+            return stretched_mac(s, x, secret, self.ss_hash_iterations)
         else:
             return h(s + x + s)
 
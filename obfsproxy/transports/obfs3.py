@@ -14,8 +14,6 @@ import obfsproxy.common.log as logging
 import obfsproxy.common.hmac_sha256 as hmac_sha256
 import obfsproxy.common.rand as rand
 
-from twisted.internet import threads
-
 log = logging.get_obfslogger()
 
 MAX_PADDING = 8194
@@ -34,6 +32,8 @@ class Obfs3Transport(base.BaseTransport):
     Obfs3Transport implements the obfs3 protocol.
     """
 
+    expensiveHandshake = True
+
     def __init__(self):
         """Initialize the obfs3 pluggable transport."""
         super(Obfs3Transport, self).__init__()
@@ -41,8 +41,9 @@ class Obfs3Transport(base.BaseTransport):
         # Our state.
         self.state = ST_WAIT_FOR_KEY
 
-        # Uniform-DH object
-        self.dh = obfs3_dh.UniformDH()
+        # Uniform-DH object, created with the handshake, so that circuits
+        # that are not admitted (see admission.py) don't use up a keypair.
+        self.dh = None
 
         # DH shared secret
         self.shared_secret = None
@@ -76,6 +77,7 @@ class Obfs3Transport(base.BaseTransport):
         Do the obfs3 handshake:
         PUBKEY | WR(PADLEN)
         """
+        self.dh = obfs3_dh.UniformDH()
         padding_length = random.randint(0, MAX_PADDING/2)
 
         handshake_message = self.dh.get_public() + rand.random_bytes(padding_length)
@@ -139,7 +141,7 @@ class Obfs3Transport(base.BaseTransport):
         other_pubkey = data.read(PUBKEY_LEN)
 
         # Do the UniformDH handshake asynchronously
-        self.d = threads.deferToThread(self.dh.get_secret, other_pubkey)
+        self.d = self.dh.defer_secret(other_pubkey)
         self.d.addCallback(self._read_handshake_post_dh, other_pubkey, data)
         self.d.addErrback(self._uniform_dh_errback, other_pubkey)
 
@@ -212,6 +214,7 @@ class Obfs3Transport(base.BaseTransport):
         data.drain(index)
 
         self.state = ST_OPEN
+        self.circuit.handshakeCompleted()
         if len(data) > 0:
             log.debug("%s: Processing %d bytes of application data remaining after magic." % (log_prefix, len(data)))
             self.circuit.upstream.write(self.recv_crypto.crypt(data.read()))
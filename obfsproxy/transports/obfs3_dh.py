@@ -1,7 +1,19 @@
 import binascii
+from collections import deque
 
+from twisted.internet import threads
+
+import obfsproxy.common.log as logging
+import obfsproxy.common.metrics as metrics
 import obfsproxy.common.rand as rand
 import obfsproxy.common.modexp as modexp
+import obfsproxy.common.workers as workers
+
+log = logging.get_obfslogger()
+
+keypair_draws = metrics.registry.counter(
+    'obfsproxy_dh_pool_draws_total',
+    'Number of UniformDH keypairs requested from the keypair pool.', ('result',))
 
 def int_to_bytes(lvalue, width):
     fmt = '%%.%dx' % (2*width)
@@ -43,29 +55,14 @@ class UniformDH:
     group_len = 192 # bytes (1536-bits)
 
     def __init__(self, private_key = None):
-        # Generate private key
+        # Generate the keypair, or take a pregenerated one from the pool.
         if private_key != None:
             if len(private_key) != self.group_len:
                 raise ValueError("private_key is a invalid length (Expected %d, got %d)" % (group_len, len(private_key)))
-            self.priv_str = private_key
+            keypair = generate_keypair(private_key)
         else:
-            self.priv_str = rand.random_bytes(self.group_len)
-        self.priv = int(binascii.hexlify(self.priv_str), 16)
-
-        # Make the private key even
-        flip = self.priv % 2
-        self.priv -= flip
-
-        # Generate public key
-        #
-        # Note: Always generate both valid public keys, and then pick to avoid
-        # leaking timing information about which key was chosen.
-        pub = modexp.powMod(self.g, self.priv, self.mod)
-        pub_p_sub_X = self.mod - pub
-        if flip == 1:
-            self.pub = pub_p_sub_X
-        else:
-            self.pub = pub
+            keypair = keypairs.get()
+        self.priv_str, self.priv, self.pub = keypair
         self.pub_str = int_to_bytes(self.pub, self.group_len)
 
         self.shared_secret = None
@@ -81,8 +78,121 @@ class UniformDH:
         This might raise a ValueError since 'their_pub_str' is
         attacker controlled.
         """
-        their_pub = int(binascii.hexlify(their_pub_str), 16)
+        return self._got_secret(compute_secret(their_pub_str, self.priv))
+
+    def defer_secret(self, their_pub_str):
+        """
+        Like 'get_secret', but compute the shared secret in a worker (see
+        workers.py) instead of the calling thread.
 
-        self.shared_secret = modexp.powMod(their_pub, self.priv, self.mod)
+        Return a Deferred that fires with the shared secret, or fails with
+        a ValueError.
+        """
+        d = workers.run(compute_secret, their_pub_str, self.priv)
+        d.addCallback(self._got_secret)
+        return d
+
+    def _got_secret(self, shared_secret):
+        self.shared_secret = shared_secret
         return int_to_bytes(self.shared_secret, self.group_len)
 
+
+def generate_keypair(private_key = None):
+    """
+    Return a UniformDH keypair (priv_str, priv, pub) for the private key
+    'private_key', or for a random one.
+    """
+    priv_str = private_key if private_key != None else rand.random_bytes(UniformDH.group_len)
+    priv = int(binascii.hexlify(priv_str), 16)
+
+    # Make the private key even
+    flip = priv % 2
+    priv -= flip
+
+    # Generate public key
+    #
+    # Note: Always generate both valid public keys, and then pick to avoid
+    # leaking timing information about which key was chosen.
+    pub = modexp.powMod(UniformDH.g, priv, UniformDH.mod)
+    pub_p_sub_X = UniformDH.mod - pub
+    if flip == 1:
+        pub = pub_p_sub_X
+    return priv_str, priv, pub
+
+def compute_secret(their_pub_str, priv):
+    """
+    Return the shared secret of the private key 'priv' and of the public
+    key 'their_pub_str', as an integer.
+    """
+    their_pub = int(binascii.hexlify(their_pub_str), 16)
+    return modexp.powMod(their_pub, priv, UniformDH.mod)
+
+class KeypairPool(object):
+    """
+    Random UniformDH keypairs generated in advance.
+
+    Generating a keypair costs a 1536-bit modular exponentiation, which
+    would otherwise run on the reactor for every new connection. The
+    pool keeps up to 'size' keypairs, and generates the missing ones in
+    a thread of the reactor's thread pool, one at a time. A keypair
+    leaves the pool when it is drawn, so that it is never used twice.
+    When the pool is empty, the keypair is generated right away.
+    """
+
+    def __init__(self, size=0):
+        self.size = size
+        self.keypairs = deque()
+        self.refilling = False
+
+    def __len__(self):
+        return len(self.keypairs)
+
+    def configure(self, size):
+        """
+        Keep 'size' keypairs in advance; 0 disables the pool. Throws
+        ValueError if the size is invalid.
+        """
+        if size < 0:
+            raise ValueError("Invalid UniformDH keypair pool size: %s." % size)
+        self.size = size
+        while len(self.keypairs) > size:
+            self.keypairs.pop()
+        self.refill()
+
+    def get(self):
+        """Return a keypair that was never handed out before."""
+        if not self.size:
+            return generate_keypair()
+
+        if self.keypairs:
+            keypair = self.keypairs.popleft()
+            keypair_draws.inc(('hit',))
+        else:
+            keypair = generate_keypair()
+            keypair_draws.inc(('miss',))
+        self.refill()
+        return keypair
+
+    def refill(self):
+        """Generate a missing keypair in the background, if needed."""
+        if self.refilling or len(self.keypairs) >= self.size:
+            return
+        self.refilling = True
+        d = threads.deferToThread(generate_keypair)
+        d.addCallbacks(self._refilled, self._refill_failed)
+
+    def _refilled(self, keypair):
+        self.refilling = False
+        if len(self.keypairs) < self.size:
+            self.keypairs.append(keypair)
+        self.refill()
+
+    def _refill_failed(self, failure):
+        self.refilling = False
+        log.warning("Failed to generate a UniformDH keypair: %s", failure.getErrorMessage())
+
+keypairs = KeypairPool()
+
+metrics.registry.gauge(
+    'obfsproxy_dh_pool_keypairs', 'Number of UniformDH keypairs generated in advance.',
+    function=lambda: len(keypairs))
@@ -84,9 +84,29 @@ PUBLIC_KEY_LENGTH = 192
 # Length of the PRNG seed used to generate probability distributions in bytes.
 PRNG_SEED_LENGTH = 32
 
+# Width (in seconds) of the time buckets of the replay table.  Elements expire
+# bucket by bucket, at most this long after `EPOCH_GRANULARITY'.
+REPLAY_BUCKET_WIDTH = 300
+
+# Size in bits and number of hash functions of the Bloom filter in front of the
+# replay table.  A size of 0 disables the filter.  It pays off with many
+# buckets; with the default width, looking up the dozen sets is as fast.
+REPLAY_BLOOM_BITS = 0
+REPLAY_BLOOM_HASHES = 4
+
+# File which holds the journal of the replay table.
+REPLAY_FILE = "replay_table.journal"
+
 # File which holds the server's state information.
 SERVER_STATE_FILE = "server_state.cpickle"
 
+# Lock file which serialises the server processes writing the state file.
+SERVER_STATE_LOCK_FILE = "server_state.lock"
+
+# Seconds to wait after a change to the server's state before writing it to
+# disk, so that changes made in a row are written at once.
+STATE_WRITE_DELAY = 1
+
 # Life time of session tickets in seconds.
 SESSION_TICKET_LIFETIME = KEY_ROTATION_TIME
 
@@ -102,6 +122,7 @@ SHARED_SECRET_LENGTH = 20
 ST_WAIT_FOR_AUTH = 0
 ST_AUTH_FAILED = 1
 ST_CONNECTED = 2
+ST_WAIT_FOR_SECRET = 3 # A worker computes the UniformDH secret.
 
 # File which holds the client's session tickets.
 CLIENT_TICKET_FILE = "session_ticket.yaml"
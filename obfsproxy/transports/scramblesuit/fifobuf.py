@@ -1,15 +1,12 @@
 """
 Provides an interface for a fast FIFO buffer.
 
-The interface implements only 'read()', 'write()' and 'len()'.  The
-implementation below is a modified version of the code originally written by
-Ben Timby: http://ben.timby.com/?p=139
+The interface implements 'read()', 'write()' and 'len()' as well as the
+zero-copy variants 'read_view()' and 'read_into()'.  The implementation was
+originally based on code written by Ben Timby: http://ben.timby.com/?p=139
 """
 
-try:
-    from io import BytesIO
-except ImportError:
-    from io import BytesIO
+from collections import deque
 
 MAX_BUFFER = 1024**2*4
 
@@ -18,43 +15,67 @@ class Buffer( object ):
     """
     Implements a fast FIFO buffer.
 
-    Internally, the buffer consists of a list of StringIO objects.  New
-    StringIO objects are added and delete as data is written to and read from
-    the FIFO buffer.
+    Internally, the buffer consists of a deque of the bytes objects that were
+    written to it and an offset into the first of them.  The total number of
+    buffered bytes is kept up to date on every write and read, so that `len()'
+    is O(1).
     """
 
     def __init__( self, max_size=MAX_BUFFER ):
         """
         Initialise a Buffer object.
+
+        `max_size' is accepted for compatibility with older callers and is
+        ignored, since chunks are no longer copied into fixed-size buffers.
         """
 
-        self.buffers = []
+        self.chunks = deque()
         self.max_size = max_size
         self.read_pos = 0
-        self.write_pos = 0
+        self.length = 0
 
     def write( self, data ):
         """
         Write `data' to the FIFO buffer.
 
-        If necessary, a new internal buffer is created.
+        The data is not copied unless it is mutable.
         """
 
-        # Add a StringIO buffer if none exists yet.
-        if not self.buffers:
-            self.buffers.append(BytesIO())
-            self.write_pos = 0
+        if isinstance(data, str):
+            data = bytes(data, encoding='utf-8')
+        elif not isinstance(data, bytes):
+            data = bytes(data)
+
+        if data:
+            self.chunks.append(data)
+            self.length += len(data)
+
+    def _consume( self, length ):
+        """
+        Yield memoryviews over the first `length' bytes of the FIFO buffer and
+        drop them from the buffer.
+        """
 
-        lastBuf = self.buffers[-1]
-        lastBuf.seek(self.write_pos)
-        lastBuf.write(data)
+        if length < 0 or length > self.length:
+            length = self.length
 
-        # If we are over the limit, a new internal buffer is created.
-        if lastBuf.tell() >= self.max_size:
-            lastBuf = BytesIO()
-            self.buffers.append(lastBuf)
+        while length > 0:
+            chunk = self.chunks[0]
+            available = len(chunk) - self.read_pos
 
-        self.write_pos = lastBuf.tell()
+            if available > length:
+                view = memoryview(chunk)[self.read_pos:self.read_pos + length]
+                self.read_pos += length
+                self.length -= length
+                yield view
+                return
+
+            view = memoryview(chunk)[self.read_pos:]
+            self.chunks.popleft()
+            self.read_pos = 0
+            self.length -= available
+            length -= available
+            yield view
 
     def read( self, length=-1 ):
         """
@@ -63,59 +84,42 @@ class Buffer( object ):
         Drained data is automatically deleted.
         """
 
-        read_buf = BytesIO()
-        remaining = length
-
-        while True:
+        return b"".join(self._consume(length))
 
-            if not self.buffers:
-                break
-
-            firstBuf = self.buffers[0]
-            firstBuf.seek(self.read_pos)
-            read_buf.write(firstBuf.read(remaining))
-            self.read_pos = firstBuf.tell()
+    def read_view( self, length=-1 ):
+        """
+        Read `length' elements of the FIFO buffer as a memoryview.
 
-            if length == -1:
+        If the data lies within a single internal chunk, no copy is made.
+        Otherwise, the chunks are joined once.  Drained data is automatically
+        deleted.
+        """
 
-                # We did not limit the read, we exhausted the buffer, so delete
-                # it.  Keep reading from the remaining buffers.
-                del self.buffers[0]
-                self.read_pos = 0
+        views = list(self._consume(length))
+        if len(views) == 1:
+            return views[0]
+        return memoryview(b"".join(views))
 
-            else:
+    def read_into( self, buf ):
+        """
+        Read up to `len(buf)' elements of the FIFO buffer into the writable
+        buffer `buf' (e.g., a bytearray or a memoryview) and return the number
+        of bytes written.
 
-                # We limited the read so either we exhausted the buffer or not.
-                remaining = length - read_buf.tell()
+        Drained data is automatically deleted.
+        """
 
-                if remaining > 0:
-                    # Exhausted, remove buffer, read more.  Keep reading from
-                    # remaining buffers.
-                    del self.buffers[0]
-                    self.read_pos = 0
-                else:
-                    # Did not exhaust buffer, but read all that was requested.
-                    # Break to stop reading and return data of requested
-                    # length.
-                    break
+        target = memoryview(buf).cast("B")
+        written = 0
+        for view in self._consume(len(target)):
+            target[written:written + len(view)] = view
+            written += len(view)
 
-        return read_buf.getvalue()
+        return written
 
     def __len__(self):
         """
         Return the length of the Buffer object.
         """
 
-        length = 0
-
-        for buf in self.buffers:
-
-            # Jump to the end of the internal buffer.
-            buf.seek(0, 2)
-
-            if buf == self.buffers[0]:
-                length += buf.tell() - self.read_pos
-            else:
-                length += buf.tell()
-
-        return length
+        return self.length
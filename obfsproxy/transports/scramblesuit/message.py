@@ -4,8 +4,18 @@ This module provides code to handle ScrambleSuit protocol messages.
 The exported classes and functions provide interfaces to handle protocol
 messages, check message headers for validity and create protocol messages out
 of application data.
+
+Bulk data is handled in batches: `encryptMessages()' encrypts all the messages
+of a burst with a single AES-CTR call and `MessageExtractor' decrypts all the
+messages it received with a single XOR against the keystream.  Only the
+HMAC-SHA256-128s are computed message by message, from precomputed HMAC states
+(see `mycrypto.PrecomputedHMAC').
 """
 
+import struct
+
+from Crypto.Util.strxor import strxor
+
 import obfsproxy.common.log as logging
 import obfsproxy.common.serialize as pack
 import obfsproxy.transports.base as base
@@ -15,6 +25,9 @@ from . import const
 
 log = logging.get_obfslogger()
 
+# The encrypted part of the header: total length, payload length and flags.
+HEADER = struct.Struct("!HHB")
+
 
 def createProtocolMessages( data, flags=const.FLAG_PAYLOAD ):
     """
@@ -38,6 +51,30 @@ def createProtocolMessages( data, flags=const.FLAG_PAYLOAD ):
     return messages
 
 
+def encryptMessages( messages, crypter, hmac ):
+    """
+    Encrypt and authenticate the given protocol `messages' in one go.
+
+    All `messages' are encrypted with a single call to `crypter'.  Then, each
+    encrypted message is prepended by its HMAC-SHA256-128 computed with the
+    `mycrypto.PrecomputedHMAC' `hmac'.  The wire format is the same as the one
+    of `ProtocolMessage.encryptAndHMAC()' called on every message.
+    """
+
+    encrypted = memoryview(crypter.encrypt(b"".join([msg.plaintext()
+                                                     for msg in messages])))
+    blurbs = []
+    offset = 0
+
+    for msg in messages:
+        end = offset + len(msg) - const.HMAC_SHA256_128_LENGTH
+        blurbs.append(hmac.digest(encrypted[offset:end]))
+        blurbs.append(encrypted[offset:end])
+        offset = end
+
+    return b"".join(blurbs)
+
+
 def getFlagNames( flags ):
     """
     Return the flag name encoded in the integer `flags' as string.
@@ -100,7 +137,7 @@ class ProtocolMessage( object ):
     protocol messages.
     """
 
-    def __init__( self, payload="", paddingLen=0, flags=const.FLAG_PAYLOAD ):
+    def __init__( self, payload=b"", paddingLen=0, flags=const.FLAG_PAYLOAD ):
         """
         Initialises a ProtocolMessage object.
         """
@@ -132,6 +169,15 @@ class ProtocolMessage( object ):
 
         return hmac + encrypted
 
+    def plaintext( self ):
+        """
+        Return the unencrypted message: the header without the HMAC, the
+        payload and the padding.
+        """
+
+        return HEADER.pack(self.totalLen, self.payloadLen, self.flags) + \
+               self.payload + (self.totalLen - self.payloadLen) * b"\0"
+
     def addPadding( self, paddingLen ):
         """
         Add padding to this protocol message.
@@ -165,6 +211,12 @@ class MessageExtractor( object ):
 
     """
     Extracts ScrambleSuit protocol messages out of an encrypted stream.
+
+    Incoming data is decrypted in a single pass: the extractor fetches as much
+    AES-CTR keystream as it has buffered data with a single AES call.  The
+    keystream lets it read the headers, which delimit the messages, and then
+    it decrypts all complete messages with a single XOR.  The keystream of
+    incomplete messages is kept for the next call.
     """
 
     def __init__( self ):
@@ -172,55 +224,73 @@ class MessageExtractor( object ):
         Initialise a new MessageExtractor object.
         """
 
-        self.recvBuf = ""
-        self.totalLen = None
-        self.payloadLen = None
-        self.flags = None
+        self.recvBuf = b""
+        self.keystream = b""
 
-    def extract( self, data, aes, hmacKey ):
+    def extract( self, data, aes, hmac ):
         """
         Extracts (i.e., decrypts and authenticates) protocol messages.
 
         The raw `data' coming directly from the wire is decrypted using `aes'
-        and authenticated using `hmacKey'.  The payload is then returned as
-        unencrypted protocol messages.  In case of invalid headers or HMACs, an
-        exception is raised.
+        and authenticated using the `mycrypto.PrecomputedHMAC' `hmac'.  The
+        payload is then returned as unencrypted protocol messages.  In case of
+        invalid headers or HMACs, an exception is raised.
         """
 
         self.recvBuf += data
-        msgs = []
+        if len(self.keystream) < len(self.recvBuf):
+            self.keystream += aes.keystream(len(self.recvBuf) -
+                                            len(self.keystream))
+
+        buf = memoryview(self.recvBuf)
+        keystream = memoryview(self.keystream)
+        headers = []
+        pos = keyPos = 0
 
         # Keep trying to unpack as long as there is at least a header.
-        while len(self.recvBuf) >= const.HDR_LENGTH:
+        while (len(buf) - pos) >= const.HDR_LENGTH:
 
-            # If necessary, extract the header fields.
-            if self.totalLen == self.payloadLen == self.flags == None:
-                self.totalLen = pack.ntohs(aes.decrypt(self.recvBuf[16:18]))
-                self.payloadLen = pack.ntohs(aes.decrypt(self.recvBuf[18:20]))
-                self.flags = ord(aes.decrypt(self.recvBuf[20]))
+            # The header is too short to pay for a call to strxor().
+            start = pos + const.HMAC_SHA256_128_LENGTH
+            header = int.from_bytes(buf[start:pos + const.HDR_LENGTH], "big") ^ \
+                     int.from_bytes(keystream[keyPos:keyPos + HEADER.size], "big")
+            totalLen, payloadLen, flags = header >> 24, \
+                                          (header >> 8) & 0xffff, header & 0xff
 
-                if not isSane(self.totalLen, self.payloadLen, self.flags):
-                    raise base.PluggableTransportError("Invalid header.")
+            if not isSane(totalLen, payloadLen, flags):
+                raise base.PluggableTransportError("Invalid header.")
 
             # Parts of the message are still on the wire; waiting.
-            if (len(self.recvBuf) - const.HDR_LENGTH) < self.totalLen:
+            end = pos + const.HDR_LENGTH + totalLen
+            if end > len(buf):
                 break
 
-            rcvdHMAC = self.recvBuf[0:const.HMAC_SHA256_128_LENGTH]
-            vrfyHMAC = mycrypto.HMAC_SHA256_128(hmacKey,
-                              self.recvBuf[const.HMAC_SHA256_128_LENGTH:
-                              (self.totalLen + const.HDR_LENGTH)])
-
-            if rcvdHMAC != vrfyHMAC:
+            if not hmac.verify(buf[start:end], buf[pos:start]):
                 raise base.PluggableTransportError("Invalid message HMAC.")
 
-            # Decrypt the message and remove it from the input buffer.
-            extracted = aes.decrypt(self.recvBuf[const.HDR_LENGTH:
-                         (self.totalLen + const.HDR_LENGTH)])[:self.payloadLen]
-            msgs.append(ProtocolMessage(payload=extracted, flags=self.flags))
-            self.recvBuf = self.recvBuf[const.HDR_LENGTH + self.totalLen:]
+            headers.append((pos + const.HDR_LENGTH, keyPos + HEADER.size,
+                            totalLen, payloadLen, flags))
+            pos = end
+            keyPos += HEADER.size + totalLen
 
-            # Protocol message processed; now reset length fields.
-            self.totalLen = self.payloadLen = self.flags = None
+        if not headers:
+            return []
+
+        # Decrypt all messages at once.
+        plaintext = strxor(b"".join([buf[bodyPos:bodyPos + totalLen]
+                                     for bodyPos, _, totalLen, _, _ in headers]),
+                           b"".join([keystream[bodyKeyPos:bodyKeyPos + totalLen]
+                                     for _, bodyKeyPos, totalLen, _, _ in headers]))
+        msgs = []
+        offset = 0
+        for _, _, totalLen, payloadLen, flags in headers:
+            msgs.append(ProtocolMessage(payload=plaintext[offset:offset +
+                                                          payloadLen],
+                                        flags=flags))
+            offset += totalLen
+
+        # Remove the extracted messages from the input buffer.
+        self.recvBuf = self.recvBuf[pos:]
+        self.keystream = self.keystream[keyPos:]
 
         return msgs
@@ -13,6 +13,8 @@ import Crypto.Cipher.AES
 import obfsproxy.transports.base as base
 import obfsproxy.common.log as logging
 
+import hashlib
+import hmac
 import math
 import os
 
@@ -90,6 +92,45 @@ def HMAC_SHA256_128( key, msg ):
     return h.digest()[:16]
 
 
+class PrecomputedHMAC( object ):
+
+    """
+    Computes HMAC-SHA256-128s under a fixed key.
+
+    The key is padded and hashed into the inner and outer SHA256 states once.
+    Every HMAC then starts from a copy of these states, so that bulk data
+    split into many protocol messages doesn't pay for keying every time.
+    """
+
+    def __init__( self, key ):
+        """
+        Initialise a PrecomputedHMAC object for the given `key'.
+        """
+
+        assert(len(key) >= const.SHARED_SECRET_LENGTH)
+
+        self.state = hmac.new(key, digestmod=hashlib.sha256)
+
+    def digest( self, msg ):
+        """
+        Return the HMAC-SHA256-128 of the given `msg', like HMAC_SHA256_128().
+        """
+
+        h = self.state.copy()
+        h.update(msg)
+
+        return h.digest()[:16]
+
+    def verify( self, msg, mac ):
+        """
+        Return `True' if `mac' is the HMAC-SHA256-128 of `msg'.
+
+        The comparison takes constant time.
+        """
+
+        return hmac.compare_digest(self.digest(msg), mac)
+
+
 def strongRandom( size ):
     """
     Return `size' bytes of strong randomness suitable for cryptographic use.
@@ -153,3 +194,13 @@ class PayloadCrypter:
 
     # Encryption equals decryption in AES-CTR.
     decrypt = encrypt
+
+    def keystream( self, length ):
+        """
+        Return the next `length' bytes of the AES-CTR keystream.
+
+        XORing them with data encrypts or decrypts it, exactly as `encrypt()'
+        would have.
+        """
+
+        return self.crypter.encrypt(b"\0" * length)
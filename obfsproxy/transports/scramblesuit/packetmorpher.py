@@ -43,6 +43,20 @@ class PacketMorpher( object ):
     def getPadding( self, sendCrypter, sendHMAC, dataLen ):
         """
         Based on the burst's size, return a ready-to-send padding blurb.
+
+        The padding messages are encrypted with `sendCrypter' and authenticated
+        with the `mycrypto.PrecomputedHMAC' `sendHMAC'.
+        """
+
+        return message.encryptMessages(self.getPaddingMessages(dataLen),
+                                       sendCrypter, sendHMAC)
+
+    def getPaddingMessages( self, dataLen ):
+        """
+        Based on the burst's size, return the padding messages to append.
+
+        The messages are not encrypted yet, so that they can be encrypted
+        together with the burst's data (see `message.encryptMessages()').
         """
 
         padLen = self.calcPadding(dataLen)
@@ -52,15 +66,11 @@ class PacketMorpher( object ):
 
         # We have to use two padding messages if the padding is > MTU.
         if padLen > const.MTU:
-            padMsgs = [message.new("", paddingLen=700 - const.HDR_LENGTH),
-                       message.new("", paddingLen=padLen - 700 - \
-                                       const.HDR_LENGTH)]
+            return [message.new(b"", paddingLen=700 - const.HDR_LENGTH),
+                    message.new(b"", paddingLen=padLen - 700 - \
+                                     const.HDR_LENGTH)]
         else:
-            padMsgs = [message.new("", paddingLen=padLen - const.HDR_LENGTH)]
-
-        blurbs = [msg.encryptAndHMAC(sendCrypter, sendHMAC) for msg in padMsgs]
-
-        return "".join(blurbs)
+            return [message.new(b"", paddingLen=padLen - const.HDR_LENGTH)]
 
     def calcPadding( self, dataLen ):
         """
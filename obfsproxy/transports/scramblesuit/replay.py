@@ -1,20 +1,103 @@
 """
 This module implements a mechanism to protect against replay attacks.
 
-The replay protection mechanism is based on a dictionary which caches
-previously observed keys.  New keys can be added to the dictionary and existing
-ones can be queried.  A pruning mechanism deletes expired keys from the
-dictionary.
+The replay protection mechanism is based on a table which caches previously
+observed keys.  New keys can be added to the table and existing ones can be
+queried.
+
+The table is split into time buckets of `const.REPLAY_BUCKET_WIDTH' seconds,
+one set of keys per bucket, so that expired keys are deleted a whole bucket at
+a time instead of being looked at one by one.  Optionally, a Bloom filter in
+front of the buckets answers most lookups of new keys without touching the
+buckets.
+
+If the table is given a file, it appends every new key to this journal.  The
+journal is compacted whenever buckets expire and read back when the table is
+restored, e.g., after a restart.
+
+Several server processes can share a journal.  The journal is only written
+while holding the lock file next to it (see `util.lockFile'), and before
+looking up a key, a table reads the records the other processes appended
+since it last looked.  That costs a `stat' call when there are none.  When
+the journal was replaced by another process's compaction, the table is read
+again from the new journal.
 """
 
+import hashlib
+import os
+import struct
 import time
 
 from . import const
+from . import util
 
 import obfsproxy.common.log as logging
 
 log = logging.get_obfslogger()
 
+# A journal record: the bucket of the key, the key's length and the key.
+RECORD = struct.Struct("!QB")
+
+
+class BloomFilter( object ):
+
+    """
+    Implement a Bloom filter of byte strings.
+
+    A Bloom filter can tell that an element was never added, but only that an
+    element was probably added.  Elements can't be removed; clear the filter
+    and add the remaining elements instead.
+    """
+
+    def __init__( self, bits, hashes=const.REPLAY_BLOOM_HASHES ):
+        """
+        Initialise a `BloomFilter' object of `bits' bits, in which every
+        element sets `hashes' bits.
+        """
+
+        self.bits = bits
+        self.hashes = hashes
+        self.clear()
+
+    def clear( self ):
+        """
+        Remove all elements from the filter.
+        """
+
+        self.array = bytearray((self.bits + 7) // 8)
+
+    def positions( self, element ):
+        """
+        Return the positions of the bits set by `element'.
+        """
+
+        # Two hashes are enough to derive all of them (Kirsch-Mitzenmacher).
+        digest = hashlib.blake2b(element, digest_size=16).digest()
+        hash1 = int.from_bytes(digest[:8], "big")
+        hash2 = int.from_bytes(digest[8:], "big")
+
+        return [(hash1 + i * hash2) % self.bits for i in range(self.hashes)]
+
+    def add( self, element ):
+        """
+        Add the given `element' to the filter.
+        """
+
+        for pos in self.positions(element):
+            self.array[pos >> 3] |= 1 << (pos & 7)
+
+    def __contains__( self, element ):
+        """
+        Return `False' if `element' was never added and `True' if it probably
+        was.
+        """
+
+        for pos in self.positions(element):
+            if not self.array[pos >> 3] & (1 << (pos & 7)):
+                return False
+
+        return True
+
 
 class Tracker( object ):
 
@@ -22,28 +105,134 @@ class Tracker( object ):
     Implement methods to keep track of replayed keys.
 
     This class provides methods to add new keys (elements), check whether keys
-    are already present in the dictionary and to prune the lookup table.
+    are already present in the lookup table and to prune the lookup table.
+    Elements are forgotten between `const.EPOCH_GRANULARITY' and
+    `const.EPOCH_GRANULARITY' + `const.REPLAY_BUCKET_WIDTH' seconds after they
+    were added.
     """
 
-    def __init__( self ):
+    def __init__( self, path=None, bloomBits=const.REPLAY_BLOOM_BITS ):
         """
         Initialise a `Tracker' object.
+
+        If `path' is given, the elements are journaled to this file and the
+        elements already journaled there are restored.  A Bloom filter of
+        `bloomBits' bits is used to look up elements; 0 disables it.
+        """
+
+        self.path = path
+        self.bloomBits = bloomBits
+        self.buckets = dict()
+        self.bloom = BloomFilter(bloomBits) if bloomBits else None
+        self.pruned = None
+
+        # The inode of the journal and the number of its bytes we have read.
+        self.journalId = None
+        self.journalOffset = 0
+
+        if self.path is not None:
+            self.restore()
+
+    def __len__( self ):
+        """
+        Return the number of elements in the lookup table.
+        """
+
+        return sum([len(bucket) for bucket in self.buckets.values()])
+
+    def __getstate__( self ):
+        """
+        Return the state to pickle.
+
+        A journaled table is restored from its journal, so its elements are
+        not pickled along with it.  The Bloom filter is rebuilt anyway.
         """
 
-        self.table = dict()
+        state = self.__dict__.copy()
+        state["bloom"] = None
+        if self.path is not None:
+            state["buckets"] = dict()
 
-    def addElement( self, element ):
+        return state
+
+    def __setstate__( self, state ):
+        """
+        Restore a pickled table, including the dictionary of older versions.
+        """
+
+        self.__init__(state.get("path"),
+                      state.get("bloomBits", const.REPLAY_BLOOM_BITS))
+
+        buckets = state.get("buckets", dict())
+
+        # Older tables mapped every element to its own timestamp.
+        if "table" in state:
+            for element, timestamp in state["table"].items():
+                buckets.setdefault(self.bucketOf(timestamp), set()).add(element)
+
+        for bucket, elements in buckets.items():
+            for element in elements:
+                self.insert(element, bucket)
+
+    @staticmethod
+    def bucketOf( timestamp ):
+        """
+        Return the bucket of the given Unix `timestamp'.
+        """
+
+        return int(timestamp) // const.REPLAY_BUCKET_WIDTH
+
+    @staticmethod
+    def isExpired( bucket, current ):
+        """
+        Return `True' if all elements of `bucket' are expired in the bucket
+        `current'.
+        """
+
+        return (current - bucket - 1) * const.REPLAY_BUCKET_WIDTH >= \
+               const.EPOCH_GRANULARITY
+
+    def addElement( self, element, now=None ):
         """
         Add the given `element' to the lookup table.
+
+        Raise `LookupError' if `element' is already present, including when
+        another process journaled it in the meantime.
         """
 
-        if self.isPresent(element):
+        now = time.time() if now is None else now
+
+        if self.isPresent(element, now):
             raise LookupError("Element already present in table.")
 
-        # The key is a HMAC and the value is the current Unix timestamp.
-        self.table[element] = int(time.time())
+        bucket = self.bucketOf(now)
+
+        if self.path is None:
+            self.insert(element, bucket)
+            return
 
-    def isPresent( self, element ):
+        try:
+            with util.lockFile(self.lockPath()):
+                self.readJournal(self.bucketOf(now))
+                if self.contains(element):
+                    raise LookupError("Element already present in table.")
+                self.insert(element, bucket)
+                self.appendToJournal(element, bucket)
+        except (IOError, OSError) as err:
+            log.error("Error writing replay journal `%s': %s" %
+                      (self.path, err))
+            self.insert(element, bucket)
+
+    def insert( self, element, bucket ):
+        """
+        Add `element' to the given `bucket' and to the Bloom filter.
+        """
+
+        self.buckets.setdefault(bucket, set()).add(element)
+        if self.bloom is not None:
+            self.bloom.add(element)
+
+    def isPresent( self, element, now=None ):
         """
         Check if the given `element' is already present in the lookup table.
 
@@ -51,35 +240,232 @@ class Tracker( object ):
         otherwise.
         """
 
-        log.debug("Looking for existing element in size-%d lookup table." %
-                  len(self.table))
+        self.prune(now)
+
+        if self.path is not None:
+            self.sync(now)
+
+        return self.contains(element)
+
+    def contains( self, element ):
+        """
+        Return `True' if `element' is in the buckets, without pruning them or
+        reading the journal first.
+        """
 
-        # Prune the replay table before looking up the given `element'.  This
-        # could be done more efficiently, e.g. by pruning every n minutes and
-        # only checking the timestamp of this particular element.
-        self.prune()
+        if self.bloom is not None and element not in self.bloom:
+            return False
 
-        return (element in self.table)
+        return any([element in bucket for bucket in self.buckets.values()])
 
-    def prune( self ):
+    def prune( self, now=None ):
         """
         Delete expired elements from the lookup table.
 
-        Keys whose Unix timestamps are older than `const.EPOCH_GRANULARITY' are
-        being removed from the lookup table.
+        Buckets whose elements are all older than `const.EPOCH_GRANULARITY'
+        are removed from the lookup table.  This is done at most once per
+        bucket of time.
+        """
+
+        current = self.bucketOf(time.time() if now is None else now)
+        if current == self.pruned:
+            return
+        self.pruned = current
+
+        expired = [bucket for bucket in self.buckets
+                   if self.isExpired(bucket, current)]
+        if not expired:
+            return
+
+        log.debug("Pruning %d buckets from the replay table." % len(expired))
+        for bucket in expired:
+            del self.buckets[bucket]
+        self.rebuildBloom()
+
+        if self.path is not None:
+            self.compactJournal(current)
+
+    def rebuildBloom( self ):
+        """
+        Add the elements left in the buckets to a cleared Bloom filter.
+        """
+
+        if self.bloom is None:
+            return
+
+        self.bloom.clear()
+        for bucket in self.buckets.values():
+            for element in bucket:
+                self.bloom.add(element)
+
+    def lockPath( self ):
+        """
+        Return the path of the lock file which guards the journal.
+        """
+
+        return self.path + ".lock"
+
+    def sync( self, now=None ):
+        """
+        Read the records other processes added to the journal.
+
+        Nothing is read if the journal is the one we know and has no new
+        bytes.
+        """
+
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            stat = None
+
+        if stat is None or ((stat.st_ino == self.journalId) and
+                            (stat.st_size == self.journalOffset)):
+            return
+
+        try:
+            with util.lockFile(self.lockPath(), exclusive=False):
+                self.readJournal(self.bucketOf(time.time() if now is None
+                                              else now))
+        except (IOError, OSError) as err:
+            log.error("Error reading replay journal `%s': %s" %
+                      (self.path, err))
+
+    def readJournal( self, current ):
+        """
+        Add the elements journaled since our last read which are not expired
+        in the bucket `current' to the lookup table.
+
+        The caller holds the lock.  If the journal was replaced, it is read
+        from the start and replaces the lookup table; the compacting process
+        had read all the records of the old journal.  A truncated record at
+        the end of the journal, e.g., after a crash, is left unread.
+
+        Return `True' if the journal holds expired or truncated records, i.e.,
+        if compacting it would shrink it.
+        """
+
+        try:
+            fd = open(self.path, "rb")
+        except IOError:
+            return False
+
+        with fd:
+            journalId = os.fstat(fd.fileno()).st_ino
+            if journalId != self.journalId:
+                self.buckets = dict()
+                self.rebuildBloom()
+                self.journalId = journalId
+                self.journalOffset = 0
+
+            fd.seek(self.journalOffset)
+            data = fd.read()
+
+        # The set of each bucket of the records, or `None' if it expired.
+        # There are few buckets, so that is decided once per bucket.
+        sets = dict()
+        pos = 0
+        stale = False
+        while pos + RECORD.size <= len(data):
+            bucket, length = RECORD.unpack_from(data, pos)
+            start = pos + RECORD.size
+            if start + length > len(data):
+                break
+            pos = start + length
+
+            elements = sets.get(bucket, False)
+            if elements is False:
+                elements = sets[bucket] = None \
+                    if self.isExpired(bucket, current) \
+                    else self.buckets.setdefault(bucket, set())
+            if elements is None:
+                stale = True
+                continue
+
+            element = data[start:pos]
+            elements.add(element)
+            if self.bloom is not None:
+                self.bloom.add(element)
+
+        self.journalOffset += pos
+
+        return stale or pos < len(data)
+
+    def appendToJournal( self, element, bucket ):
+        """
+        Append the `element' added to `bucket' to the journal.
+
+        The caller holds the lock and has read the journal.  What follows the
+        records we read can only be a record cut short by a crash, which is
+        cut off first.
+        """
+
+        with open(self.path, "ab") as fd:
+            stat = os.fstat(fd.fileno())
+            if stat.st_ino != self.journalId:
+                # The journal was just created.
+                self.journalId = stat.st_ino
+                self.journalOffset = 0
+            elif stat.st_size > self.journalOffset:
+                fd.truncate(self.journalOffset)
+
+            record = RECORD.pack(bucket, len(element)) + element
+            fd.write(record)
+
+        self.journalOffset += len(record)
+
+    def compactJournal( self, current ):
+        """
+        Rewrite the journal with the elements of the lookup table which are
+        not expired in the bucket `current'.
+
+        The records other processes added are read first, so that they are
+        kept.  The new journal is written next to the old one and then
+        replaces it, so that a crash leaves either of them intact.
+        """
+
+        tmpPath = self.path + ".tmp"
+
+        try:
+            with util.lockFile(self.lockPath()):
+                self.readJournal(current)
+
+                records = [RECORD.pack(bucket, len(element)) + element
+                           for bucket, elements in self.buckets.items()
+                           for element in elements]
+
+                with open(tmpPath, "wb") as fd:
+                    fd.write(b"".join(records))
+                    stat = os.fstat(fd.fileno())
+                os.replace(tmpPath, self.path)
+
+                self.journalId = stat.st_ino
+                self.journalOffset = stat.st_size
+        except (IOError, OSError) as err:
+            log.error("Error compacting replay journal `%s': %s" %
+                      (self.path, err))
+
+    def restore( self, now=None ):
+        """
+        Add the unexpired elements of the journal to the lookup table.
+
+        The journal is only compacted if it holds expired or truncated
+        records, so that restoring a table (e.g., whenever the server's state
+        is loaded) costs a read of the journal and no write.
         """
 
-        log.debug("Pruning the replay table.")
+        current = self.bucketOf(time.time() if now is None else now)
+        self.pruned = current
 
-        deleteList = []
-        now = int(time.time())
+        try:
+            with util.lockFile(self.lockPath(), exclusive=False):
+                stale = self.readJournal(current)
+        except (IOError, OSError) as err:
+            log.error("Error reading replay journal `%s': %s" %
+                      (self.path, err))
+            return
 
-        for element in self.table.keys():
-            if (now - self.table[element]) > const.EPOCH_GRANULARITY:
-                deleteList.append(element)
+        if stale:
+            self.compactJournal(current)
 
-        # We can't delete from a dictionary while iterating over it; therefore
-        # this construct.
-        for elem in deleteList:
-            log.debug("Deleting expired element.")
-            del self.table[elem]
+        log.info("Restored %d elements from the replay journal `%s'." %
+                 (len(self), self.path))
@@ -46,6 +46,8 @@ class ScrambleSuitTransport( base.BaseTransport ):
     modules.
     """
 
+    expensiveHandshake = True
+
     def __init__( self ):
         """
         Initialise a ScrambleSuitTransport object.
@@ -205,6 +207,10 @@ class ScrambleSuitTransport( base.BaseTransport ):
             self.sendCrypter, self.recvCrypter = self.recvCrypter, \
                                                  self.sendCrypter
 
+        # Protocol messages reuse the HMAC states of these keys.
+        self.sendMessageHMAC = mycrypto.PrecomputedHMAC(self.sendHMAC)
+        self.recvMessageHMAC = mycrypto.PrecomputedHMAC(self.recvHMAC)
+
     def circuitConnected( self ):
         """
         Initiate a ScrambleSuit handshake.
@@ -260,12 +266,13 @@ class ScrambleSuitTransport( base.BaseTransport ):
 
         # Wrap the application's data in ScrambleSuit protocol messages.
         messages = message.createProtocolMessages(data, flags=flags)
-        blurb = "".join([msg.encryptAndHMAC(self.sendCrypter,
-                        self.sendHMAC) for msg in messages])
 
         # Flush data chunk for chunk to obfuscate inter-arrival times.
         if const.USE_IAT_OBFUSCATION:
 
+            blurb = message.encryptMessages(messages, self.sendCrypter,
+                                            self.sendMessageHMAC)
+
             if len(self.choppingBuf) == 0:
                 self.choppingBuf.write(blurb)
                 reactor.callLater(self.iatMorpher.randomSample(),
@@ -274,11 +281,12 @@ class ScrambleSuitTransport( base.BaseTransport ):
                 # flushPieces() is still busy processing the chopping buffer.
                 self.choppingBuf.write(blurb)
 
+        # Encrypt the data and its padding together.
         else:
-            padBlurb = self.pktMorpher.getPadding(self.sendCrypter,
-                                                  self.sendHMAC,
-                                                  len(blurb))
-            self.circuit.downstream.write(blurb + padBlurb)
+            messages += self.pktMorpher.getPaddingMessages(
+                            sum([len(msg) for msg in messages]))
+            self.circuit.downstream.write(message.encryptMessages(
+                messages, self.sendCrypter, self.sendMessageHMAC))
 
     def flushPieces( self ):
         """
@@ -300,7 +308,7 @@ class ScrambleSuitTransport( base.BaseTransport ):
         else:
             blurb = self.choppingBuf.read()
             padBlurb = self.pktMorpher.getPadding(self.sendCrypter,
-                                                  self.sendHMAC,
+                                                  self.sendMessageHMAC,
                                                   len(blurb))
             self.circuit.downstream.write(blurb + padBlurb)
             return
@@ -321,7 +329,8 @@ class ScrambleSuitTransport( base.BaseTransport ):
             return
 
         # Try to extract protocol messages from the encrypted blurb.
-        msgs  = self.protoMsg.extract(data, self.recvCrypter, self.recvHMAC)
+        msgs  = self.protoMsg.extract(data, self.recvCrypter,
+                                      self.recvMessageHMAC)
         if (msgs is None) or (len(msgs) == 0):
             return
 
@@ -419,7 +428,7 @@ class ScrambleSuitTransport( base.BaseTransport ):
         for epoch in util.expandedEpoch():
             myHMAC = mycrypto.HMAC_SHA256_128(self.recvHMAC,
                                               potentialTicket[0:index + \
-                                              const.MARK_LENGTH] + epoch)
+                                              const.MARK_LENGTH] + epoch.encode())
 
             if util.isValidHMAC(myHMAC, existingHMAC, self.recvHMAC):
                 authenticated = True
@@ -509,29 +518,17 @@ class ScrambleSuitTransport( base.BaseTransport ):
             # First, try to interpret the incoming data as session ticket.
             if self.receiveTicket(data):
                 log.debug("Ticket authentication succeeded.")
+                self.circuit.handshakeCompleted()
 
                 self.sendTicketAndSeed()
 
             # Second, interpret the data as a UniformDH handshake.
-            elif self.uniformdh.receivePublicKey(data, self.deriveSecrets,
-                    self.srvState):
-                # Now send the server's UniformDH public key to the client.
-                handshakeMsg = self.uniformdh.createHandshake(srvState=
-                                                              self.srvState)
-
-                log.debug("Sending %d bytes of UniformDH handshake and "
-                          "session ticket." % len(handshakeMsg))
-
-                self.circuit.downstream.write(handshakeMsg)
-                log.debug("UniformDH authentication succeeded.")
-
-                log.debug("Switching to state ST_CONNECTED.")
-                self.protoState = const.ST_CONNECTED
-
-                self.sendTicketAndSeed()
+            elif self.waitForSecret(data):
+                return
 
             elif len(data) > const.MAX_HANDSHAKE_LENGTH:
                 self.protoState = const.ST_AUTH_FAILED
+                self.circuit.handshakeCompleted()
                 self.drainedHandshake = len(data)
                 data.drain(self.drainedHandshake)
                 log.info("No successful authentication after having " \
@@ -546,20 +543,92 @@ class ScrambleSuitTransport( base.BaseTransport ):
 
         elif self.weAreClient and (self.protoState == const.ST_WAIT_FOR_AUTH):
 
-            if not self.uniformdh.receivePublicKey(data, self.deriveSecrets):
+            if not self.waitForSecret(data):
                 log.debug("Unable to finish UniformDH handshake just yet.")
-                return
-
-            log.debug("UniformDH authentication succeeded.")
+            return
 
-            log.debug("Switching to state ST_CONNECTED.")
-            self.protoState = const.ST_CONNECTED
-            self.flushSendBuffer()
+        # The data stays buffered until the UniformDH secret is computed.
+        elif self.protoState == const.ST_WAIT_FOR_SECRET:
+            return
 
         if self.protoState == const.ST_CONNECTED:
 
             self.processMessages(data.read())
 
+    def waitForSecret( self, data ):
+        """
+        Compute the UniformDH master secret outside the reactor.
+
+        If `data' holds a UniformDH handshake, the secret is computed by a
+        worker and the protocol waits in state ST_WAIT_FOR_SECRET.  Data
+        arriving meanwhile is left in `data' and processed by
+        `receivedSecret()'.  Returns `True' if we are waiting.
+        """
+
+        d = self.uniformdh.deferPublicKey(data, self.srvState
+                                          if self.weAreServer else None)
+        if not d:
+            return False
+
+        log.debug("Switching to state ST_WAIT_FOR_SECRET.")
+        self.protoState = const.ST_WAIT_FOR_SECRET
+
+        d.addCallback(self.receivedSecret, data)
+        d.addErrback(self.secretFailed)
+        return True
+
+    def receivedSecret( self, masterKey, data ):
+        """
+        Finish the UniformDH handshake with the computed `masterKey'.
+
+        The server replies with its own UniformDH handshake, followed by a
+        session ticket.  Then, the data buffered meanwhile is processed.
+        """
+
+        if self.circuit.closed:
+            return
+
+        self.deriveSecrets(masterKey)
+
+        if self.weAreServer:
+            # Now send the server's UniformDH public key to the client.
+            handshakeMsg = self.uniformdh.createHandshake(srvState=
+                                                          self.srvState)
+
+            log.debug("Sending %d bytes of UniformDH handshake and "
+                      "session ticket." % len(handshakeMsg))
+
+            self.circuit.downstream.write(handshakeMsg)
+
+        log.debug("UniformDH authentication succeeded.")
+        self.circuit.handshakeCompleted()
+
+        log.debug("Switching to state ST_CONNECTED.")
+        self.protoState = const.ST_CONNECTED
+
+        if self.weAreServer:
+            self.sendTicketAndSeed()
+        else:
+            self.flushSendBuffer()
+
+        if len(data) > 0:
+            self.processMessages(data.read())
+
+    def secretFailed( self, failure ):
+        """
+        Close the circuit if the UniformDH secret could not be computed.
+
+        Besides invalid handshakes, the worker can fail on its own (e.g., a
+        broken process pool), which must not leave the circuit waiting.
+        """
+
+        if failure.check(base.PluggableTransportError):
+            log.info("%s: Closing circuit." % failure.getErrorMessage())
+        else:
+            log.warning("Could not compute the UniformDH secret (%s): "
+                        "Closing circuit." % failure.getErrorMessage())
+        self.circuit.close()
+
     @classmethod
     def register_external_mode_cli( cls, subparser ):
         """
@@ -17,41 +17,134 @@ from . import const
 from . import replay
 from . import mycrypto
 from . import probdist
+from . import util
 import base64
 
+from twisted.internet import defer, reactor, threads
+
 import obfsproxy.common.log as logging
 
 log = logging.get_obfslogger()
 
+# The server's state, shared by all the connections of the process.
+_state = None
+
 def load( ):
     """
     Load the server's state object from file.
 
     The server's state file is loaded and the state object returned.  If no
     state file is found, a new one is created and returned.
+
+    The state object is cached: connections get the same object as long as
+    the state file is unchanged.  If another process replaced the file (e.g.,
+    after rotating the ticket keys), it is loaded again.  Changes of our own
+    which are not written yet take precedence; if another process wrote the
+    file in the meantime, they are dropped when written (see `flush').
     """
 
+    global _state
+
     stateFile = os.path.join(const.STATE_LOCATION, const.SERVER_STATE_FILE)
+    lockFile = os.path.join(const.STATE_LOCATION, const.SERVER_STATE_LOCK_FILE)
+    signature = fileSignature(stateFile)
+
+    if (_state is not None) and (_state.stateFile == stateFile) and \
+       (_state.dirty or (_state.writing is not None) or
+        (_state.signature == signature)):
+        return _state
 
     log.info("Attempting to load the server's state file from `%s'." %
              stateFile)
 
-    if not os.path.exists(stateFile):
-        log.info("The server's state file does not exist (yet).")
-        state = State()
-        state.genState()
-        return state
+    if signature is None:
+        try:
+            with util.lockFile(lockFile):
+                # Another process may have created it in the meantime.
+                if fileSignature(stateFile) is None:
+                    log.info("The server's state file does not exist (yet).")
+                    state = State()
+                    state.genState()
+                    _state = state
+                    return state
+        except IOError as err:
+            log.error("Error locking server state file `%s': %s" %
+                      (lockFile, err))
+            sys.exit(1)
 
     try:
-        with open(stateFile, 'r') as fd:
+        with open(stateFile, 'rb') as fd:
             stateObject = pickle.load(fd)
+            signature = fileSignature(fd.fileno())
     except IOError as err:
         log.error("Error reading server state file from `%s': %s" %
                   (stateFile, err))
         sys.exit(1)
 
+    stateObject.stateFile = stateFile
+    stateObject.signature = signature
+    _state = stateObject
+
     return stateObject
 
+def fileSignature( stateFile ):
+    """
+    Return what identifies the content of `stateFile', or `None' if it does
+    not exist.
+
+    `stateFile' is a path or an open file descriptor.  The state file is
+    replaced rather than written in place, so a new inode means new content.
+    """
+
+    try:
+        stat = os.stat(stateFile)
+    except OSError:
+        return None
+
+    return (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
+def writeFile( stateFile, data ):
+    """
+    Atomically replace `stateFile' with `data' and return its signature.
+
+    The data is written to a temporary file next to `stateFile' which then
+    replaces it, so that readers, other processes included, never see a
+    partially written state file.
+    """
+
+    tmpFile = "%s.%d.tmp" % (stateFile, os.getpid())
+
+    try:
+        with open(tmpFile, 'wb') as fd:
+            fd.write(data)
+            fd.flush()
+            os.fsync(fd.fileno())
+            signature = fileSignature(fd.fileno())
+        os.replace(tmpFile, stateFile)
+    except (IOError, OSError):
+        try:
+            os.remove(tmpFile)
+        except OSError:
+            pass
+        raise
+
+    return signature
+
+def replaceFile( stateFile, data, signature, lockFile ):
+    """
+    Replace `stateFile' with `data' if its signature is still `signature'.
+
+    Return the new signature, or `None' if another process changed the state
+    file since we read or wrote it.  The check and the write happen under the
+    lock `lockFile', so that two processes never both replace the same
+    version of the state file.
+    """
+
+    with util.lockFile(lockFile):
+        if fileSignature(stateFile) != signature:
+            return None
+        return writeFile(stateFile, data)
+
 def writeServerPassword( password ):
     """
     Dump our ScrambleSuit server descriptor to file.
@@ -84,8 +177,18 @@ class State( object ):
 
     This class makes it possible to store state information on disk.  It
     provides methods to generate and write state information.
+
+    Changes are announced with `markChanged' and written to disk shortly
+    after, outside the reactor.  Besides the state information, the object
+    knows its state file, the signature of the state file it was loaded
+    from or last wrote, and whether it has changes to write.  These are not
+    pickled.
     """
 
+    # Attributes which describe the object in this process only.
+    transient = ("stateFile", "lockFile", "signature", "dirty", "writing",
+                 "writeCall", "shutdownTrigger")
+
     def __init__( self ):
         """
         Initialise a `State' object.
@@ -103,6 +206,43 @@ class State( object ):
         self.iatDist = None
         self.fallbackPassword = None
         self.closingThreshold = None
+        self.replayTracker = None
+
+        self.initTransient()
+
+    def initTransient( self ):
+        """
+        Initialise the attributes which are not pickled.
+        """
+
+        self.stateFile = os.path.join(const.STATE_LOCATION,
+                                      const.SERVER_STATE_FILE)
+        self.lockFile = os.path.join(const.STATE_LOCATION,
+                                     const.SERVER_STATE_LOCK_FILE)
+        self.signature = None
+        self.dirty = False
+        self.writing = None
+        self.writeCall = None
+        self.shutdownTrigger = None
+
+    def __getstate__( self ):
+        """
+        Return the state to pickle, without the transient attributes.
+        """
+
+        state = self.__dict__.copy()
+        for name in self.transient:
+            state.pop(name, None)
+
+        return state
+
+    def __setstate__( self, state ):
+        """
+        Restore a pickled state object.
+        """
+
+        self.__dict__.update(state)
+        self.initTransient()
 
     def genState( self ):
         """
@@ -123,8 +263,10 @@ class State( object ):
         self.oldHmacKey = None
         self.oldAesKey = None
 
-        # Replay dictionary for both authentication mechanisms.
-        self.replayTracker = replay.Tracker()
+        # Replay table for both authentication mechanisms.  It is journaled to
+        # its own file, so that it survives restarts.
+        self.replayTracker = replay.Tracker(os.path.join(const.STATE_LOCATION,
+                                                         const.REPLAY_FILE))
 
         # Distributions for packet lengths and inter arrival times.
         prng = random.Random(self.prngSeed)
@@ -170,24 +312,101 @@ class State( object ):
         log.debug("Adding a new HMAC to the replay table.")
         self.replayTracker.addElement(hmac)
 
-        # We must write the data to disk immediately so that other ScrambleSuit
-        # connections can share the same state.
-        self.writeState()
+    def isCurrent( self ):
+        """
+        Return `True' if no other process replaced the state file since we
+        read or wrote it.
+        """
 
-    def writeState( self ):
+        return fileSignature(self.stateFile) == self.signature
+
+    def markChanged( self ):
+        """
+        Schedule writing the state to disk after a change.
+
+        Changes made within `const.STATE_WRITE_DELAY' seconds of each other
+        are written at once.
+        """
+
+        self.dirty = True
+
+        # Don't lose the changes when the reactor stops before the write.
+        if self.shutdownTrigger is None:
+            self.shutdownTrigger = reactor.addSystemEventTrigger(
+                'before', 'shutdown', self.flush)
+
+        if self.writeCall is None and self.writing is None:
+            self.writeCall = reactor.callLater(const.STATE_WRITE_DELAY,
+                                               self.flush)
+
+    def flush( self ):
         """
-        Write the state object to a file using the `cPickle' module.
+        Write the state to disk in a thread if it changed.
+
+        Return a `Deferred' which fires when the state is written.  A failed
+        write is logged and tried again later.
+
+        The state file is only replaced if no other process changed it since
+        we read or wrote it.  Otherwise, the other process wins (e.g., it
+        rotated the ticket keys first): our changes are dropped and `load'
+        loads its state file.
         """
 
-        stateFile = os.path.join(const.STATE_LOCATION, const.SERVER_STATE_FILE)
+        if self.writeCall is not None and self.writeCall.active():
+            self.writeCall.cancel()
+        self.writeCall = None
+
+        if self.writing is not None:
+            return self.writing
+
+        if not self.dirty:
+            return defer.succeed(None)
+
+        log.debug("Writing server's state file to `%s'." % self.stateFile)
+
+        # Changes made from now on are written again.
+        self.dirty = False
+        data = pickle.dumps(self)
+
+        def written( signature ):
+            self.writing = None
+            if signature is None:
+                log.info("The state file `%s' was changed by another "
+                         "process.  Dropping our changes." % self.stateFile)
+                self.dirty = False
+                return
+            self.signature = signature
+            if self.dirty:
+                self.markChanged()
+
+        def failed( failure ):
+            self.writing = None
+            log.error("Error writing state file to `%s': %s" %
+                      (self.stateFile, failure.getErrorMessage()))
+            self.markChanged()
+
+        self.writing = threads.deferToThread(replaceFile, self.stateFile, data,
+                                             self.signature, self.lockFile)
+        self.writing.addCallbacks(written, failed)
+
+        return self.writing
+
+    def writeState( self ):
+        """
+        Write the state object to a file using the `pickle' module.
+
+        Unlike `flush', the state is written right away, on the calling
+        thread.
+        """
 
         log.debug("Writing server's state file to `%s'." %
-                  stateFile)
+                  self.stateFile)
 
         try:
-            with open(stateFile, 'w') as fd:
-                pickle.dump(self, fd)
-        except IOError as err:
+            self.signature = writeFile(self.stateFile, pickle.dumps(self))
+        except (IOError, OSError) as err:
             log.error("Error writing state file to `%s': %s" %
-                      (stateFile, err))
+                      (self.stateFile, err))
             sys.exit(1)
+
+        self.dirty = False
@@ -60,7 +60,7 @@ def createTicketMessage( rawTicket, HMACKey ):
     mark = mycrypto.HMAC_SHA256_128(HMACKey, rawTicket)
 
     hmac = mycrypto.HMAC_SHA256_128(HMACKey, rawTicket + padding +
-                                    mark + util.getEpoch())
+                                    mark + util.getEpoch().encode())
 
     return rawTicket + padding + mark + hmac
 
@@ -159,7 +159,8 @@ def checkKeys( srvState ):
 
     The key material (i.e., AES and HMAC keys for session tickets) contained in
     `srvState' is checked if it needs to be rotated.  If so, the old keys are
-    stored and new ones are created.
+    stored and new ones are created.  If several server processes rotate them
+    at once, the first one to write its state file wins (see `State.flush').
     """
 
     assert (srvState.hmacKey is not None) and \
@@ -167,6 +168,12 @@ def checkKeys( srvState ):
            (srvState.keyCreation is not None)
 
     if (int(time.time()) - srvState.keyCreation) > const.KEY_ROTATION_TIME:
+        # Another server process may have rotated the keys already.  Then,
+        # the next connection loads its state file.
+        if not srvState.isCurrent():
+            log.debug("The server's state file changed.  Not rotating keys.")
+            return
+
         log.info("Rotating server key material for session tickets.")
 
         # Save expired keys to be able to validate old tickets.
@@ -178,8 +185,8 @@ def checkKeys( srvState ):
         srvState.hmacKey = mycrypto.strongRandom(const.TICKET_HMAC_KEY_LENGTH)
         srvState.keyCreation = int(time.time())
 
-        # ...and save it to disk.
-        srvState.writeState()
+        # ...and have it written to disk.
+        srvState.markChanged()
 
 
 def decrypt( ticket, srvState ):
@@ -381,6 +388,10 @@ if __name__ == "__main__":
     masterKey = mycrypto.strongRandom(const.MASTER_KEY_LENGTH)
     ticket = SessionTicket(masterKey, serverState).issue()
 
+    # There is no reactor to write rotated key material behind our back.
+    if serverState.dirty:
+        serverState.writeState()
+
     print("[+] Writing new session ticket to `%s'." % args.ticket_file)
     tickets = dict()
     server = IPv4Address('TCP', args.ip_addr, args.tcp_port)
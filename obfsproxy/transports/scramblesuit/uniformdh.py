@@ -66,6 +66,49 @@ class UniformDH( object ):
         """
 
         # Extract the public key sent by the remote host.
+        remotePublicKey = self.acceptPublicKey(data, srvState)
+        if not remotePublicKey:
+            return False
+
+        try:
+            uniformDHSecret = self.udh.get_secret(remotePublicKey)
+        except ValueError:
+            raise base.PluggableTransportError("Corrupted public key.")
+
+        # Session keys are now derived from the master key.
+        callback(self.masterKey(uniformDHSecret))
+
+        return True
+
+    def deferPublicKey( self, data, srvState=None ):
+        """
+        Extract the public key and compute the master secret in a worker.
+
+        This is the asynchronous version of `receivePublicKey()'.  If `data'
+        doesn't hold a valid public key yet, `False' is returned.  Otherwise,
+        a Deferred is returned which fires with the master secret once a
+        worker computed it, or fails with a `PluggableTransportError'.
+        """
+
+        remotePublicKey = self.acceptPublicKey(data, srvState)
+        if not remotePublicKey:
+            return False
+
+        def corrupted( failure ):
+            failure.trap(ValueError)
+            raise base.PluggableTransportError("Corrupted public key.")
+
+        d = self.udh.defer_secret(remotePublicKey)
+        d.addCallbacks(self.masterKey, corrupted)
+        return d
+
+    def acceptPublicKey( self, data, srvState=None ):
+        """
+        Extract the public key sent by the remote host and prepare the DH.
+
+        The public key is returned, or `False' if there is none yet.
+        """
+
         remotePublicKey = self.extractPublicKey(data, srvState)
         if not remotePublicKey:
             return False
@@ -77,18 +120,14 @@ class UniformDH( object ):
 
         assert self.udh is not None
 
-        try:
-            uniformDHSecret = self.udh.get_secret(remotePublicKey)
-        except ValueError:
-            raise base.PluggableTransportError("Corrupted public key.")
+        return remotePublicKey
 
-        # First, hash the 4096-bit UniformDH secret to obtain the master key.
-        masterKey = Crypto.Hash.SHA256.new(uniformDHSecret).digest()
-
-        # Second, session keys are now derived from the master key.
-        callback(masterKey)
+    def masterKey( self, uniformDHSecret ):
+        """
+        Hash the 4096-bit UniformDH secret to obtain the master key.
+        """
 
-        return True
+        return Crypto.Hash.SHA256.new(uniformDHSecret).digest()
 
     def extractPublicKey( self, data, srvState=None ):
         """
@@ -128,7 +167,8 @@ class UniformDH( object ):
         authenticated = False
         for epoch in util.expandedEpoch():
             myHMAC = mycrypto.HMAC_SHA256_128(self.sharedSecret,
-                                              handshake[0 : hmacStart] + epoch)
+                                              handshake[0 : hmacStart] +
+                                              epoch.encode())
 
             if util.isValidHMAC(myHMAC, existingHMAC, self.sharedSecret):
                 self.echoEpoch = epoch
@@ -193,7 +233,8 @@ class UniformDH( object ):
 
         # Authenticate the handshake including the current approximate epoch.
         mac = mycrypto.HMAC_SHA256_128(self.sharedSecret,
-                                       publicKey + padding + mark + epoch)
+                                       publicKey + padding + mark +
+                                       epoch.encode())
 
         if self.weAreServer and (srvState is not None):
             log.debug("Adding the HMAC authenticating the server's UniformDH "
@@ -7,12 +7,18 @@ from files and to convert a number to raw text.
 
 import obfsproxy.common.log as logging
 
+import contextlib
 import os
 import time
 from . import const
 
 from . import mycrypto
 
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
 log = logging.get_obfslogger()
 
 def setStateLocation( stateLocation ):
@@ -103,7 +109,7 @@ def getEpoch( ):
     `EPOCH_GRANULARITY'.
     """
 
-    return str(int(time.time()) / const.EPOCH_GRANULARITY)
+    return str(int(time.time()) // const.EPOCH_GRANULARITY)
 
 
 def expandedEpoch( ):
@@ -161,6 +167,31 @@ def readFromFile( fileName, length=-1 ):
     return data
 
 
+@contextlib.contextmanager
+def lockFile( fileName, exclusive=True ):
+    """
+    Hold an advisory lock on the file `fileName' for the duration of a `with'
+    block.
+
+    The lock is exclusive or, if `exclusive' is `False', shared with other
+    readers.  It serialises ScrambleSuit server processes sharing the same
+    state location.  The file is created if necessary and never replaced, so
+    that all processes lock the same file.  Without `fcntl' (e.g., on
+    Windows), nothing is locked.
+    """
+
+    if fcntl is None:
+        yield
+        return
+
+    with open(fileName, "ab") as fd:
+        fcntl.flock(fd.fileno(), fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        try:
+            yield
+        finally:
+            fcntl.flock(fd.fileno(), fcntl.LOCK_UN)
+
+
 def sanitiseBase32( data ):
     """
     Try to sanitise a Base32 string if it's slightly wrong.
@@ -1,13 +1,21 @@
 from twisted.internet import reactor, task
-from twisted.internet.defer import CancelledError
+from twisted.internet.defer import CancelledError, Deferred
 
 import obfsproxy.common.log as logging
+import obfsproxy.common.metrics as metrics
 import obfsproxy.transports.wfpadtools.const as const
 from obfsproxy.transports.wfpadtools.util.mathutil import closest_power_of_two, closest_multiple
 
 
 log = logging.get_obfslogger()
 
+_timersCancelled = metrics.registry.counter(
+    'wfpad_timers_cancelled_total',
+    'Pending timers cancelled because their circuit was destroyed.', ('defense',))
+_staleTimers = metrics.registry.counter(
+    'wfpad_stale_timers_total',
+    'Timers scheduled or fired after their circuit was destroyed.', ('defense', 'event'))
+
 
 def deferLater(*args, **kargs):
     """Shortcut to twisted deferLater.
@@ -35,6 +43,82 @@ def deferLater(*args, **kargs):
     return d
 
 
+class TimerRegistry(object):
+    """Keeps track of the calls a transport schedules for its circuit.
+
+    Every timer of a transport goes through its registry, so that all
+    of them are cancelled at once when the circuit is destroyed. Timers
+    that would be scheduled or would fire after that are counted in
+    `wfpad_stale_timers_total` and dropped.
+    """
+
+    def __init__(self, defense=''):
+        self.defense = defense
+        self.pending = set()
+        self.closed = False
+
+    def deferLater(self, *args, **kargs):
+        """Same as `deferLater`, for a call that `cancelAll` cancels."""
+        delayms, fn = args[0], args[1]
+        if self.closed:
+            _staleTimers.inc((self.defense, 'scheduled'))
+            log.debug("[wfpad] - Call to %s scheduled after the circuit was"
+                      " destroyed. Ignoring it.", fn.__name__)
+            return self._cancelled()
+
+        def call(*fnArgs, **fnKargs):
+            if self.closed:
+                _staleTimers.inc((self.defense, 'fired'))
+                log.warning("[wfpad] - Call to %s fired after the circuit was"
+                            " destroyed.", fn.__name__)
+                return None
+            return fn(*fnArgs, **fnKargs)
+        call.__name__ = fn.__name__
+
+        d = deferLater(delayms, call, *args[2:], **kargs)
+        self.pending.add(d)
+        d.addBoth(self._forget, d)
+        return d
+
+    def _forget(self, result, d):
+        self.pending.discard(d)
+        return result
+
+    def _cancelled(self):
+        """Return a Deferred that was already cancelled."""
+        d = Deferred()
+        d.addErrback(lambda f: f.trap(CancelledError))
+        d.cancel()
+        return d
+
+    def cancelPending(self):
+        """Cancel all pending calls.
+
+        Return the number of calls that were cancelled.
+        """
+        pending, self.pending = self.pending, set()
+        for d in pending:
+            if not d.called:
+                d.cancel()
+        return len(pending)
+
+    def cancelAll(self):
+        """Cancel all pending calls and refuse new ones.
+
+        Return the number of calls that were cancelled.
+        """
+        self.closed = True
+        cancelled = self.cancelPending()
+        if cancelled:
+            _timersCancelled.inc((self.defense,), cancelled)
+        log.debug("[wfpad] - Cancelled %d pending timers.", cancelled)
+        return cancelled
+
+    def __len__(self):
+        """Return the number of pending calls."""
+        return len(self.pending)
+
+
 def cast_dictionary_to_type(d, t):
     return {t(k): v for k, v in d.items()}
 
@@ -114,6 +114,22 @@ WT_PORT                 = 4996
 DEFAULT_SESSION         = 0
 MAX_LAST_DATA_TIME      = 100
 
+# Free messages kept by a message pool (0 disables pooling)
+MESSAGE_POOL_SIZE       = 0
+
+# Seconds without session or traffic before a circuit hibernates (0 disables)
+HIBERNATE_AFTER         = 60
+
+# Milliseconds of constant-rate messages sent per timer when the kernel
+# paces the socket (see pacing.py)
+PACING_TICK             = 50
+
+# Send times computed at once by a constant-rate schedule (see schedule.py)
+SCHEDULE_WINDOW         = 64
+
+# Milliseconds between two ticks of the server-wide engine (see tickengine.py)
+ENGINE_TICK             = 10
+
 # Direction
 OUT                     = 1
 IN                      = -1
@@ -300,8 +300,19 @@ class Histogram:
         return h
 
 
+# Uniform histograms never change (they don't remove tokens), so every
+# circuit shares the same instance for a given value.
+_uniformCache = {}
+UNIFORM_CACHE_SIZE = 1024
+
+
 def uniform(x):
-    return new({x: 1}, interpolate=False, removeTokens=False)
+    h = _uniformCache.get(x)
+    if h is None:
+        h = new({x: 1}, interpolate=False, removeTokens=False)
+        if len(_uniformCache) < UNIFORM_CACHE_SIZE:
+            _uniformCache[x] = h
+    return h
 
 
 # Alias class name in order to provide a more intuitive API.
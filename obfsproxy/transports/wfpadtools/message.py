@@ -20,7 +20,13 @@ log = logging.get_obfslogger()
 
 
 class WFPadMessage(object):
-    """Represents a WFPad protocol message."""
+    """Represents a WFPad protocol message.
+
+    Messages are created and discarded for every frame, so they have no
+    per-instance `__dict__`.
+    """
+    __slots__ = ('payload', 'payloadLen', 'totalLen', 'sndTime', 'rcvTime',
+                 'queueTime', 'flags', 'opcode', 'argsLen', 'args')
 
     def __init__(self, payload='', paddingLen=0, flags=const.FLAG_DATA, opcode=None, args="", queueTime=0):
         self.payload = bytes(payload, encoding='utf-8') if isinstance(payload, str) else payload
@@ -51,10 +57,9 @@ class WFPadMessage(object):
             argsLenStr = pack.htons(self.argsLen)
             headerStr += opCodeStr + argsLenStr
         paddingStr = self.generatePadding()
-        payloadStr = self.args + self.payload + paddingStr
-        t = headerStr + payloadStr
-        log.debug(f'{headerStr} {len(headerStr)}')
-        return headerStr + payloadStr
+        # `payload` may be a memoryview on the sender's buffer: join all the
+        # parts at once so that the payload is copied a single time.
+        return b"".join((headerStr, self.args, self.payload, paddingStr))
 
     def __len__(self):
         """Return the length of this protocol message."""
@@ -65,7 +70,8 @@ class WFPadMessage(object):
         return msgLen
 
     def __eq__(self, other):
-        return (isinstance(other, self.__class__) and self.__dict__ == other.__dict__)
+        return (isinstance(other, self.__class__) and
+                all(getattr(self, name) == getattr(other, name) for name in self.__slots__))
 
     def __ne__(self, other):
         return not self.__eq__(other)
@@ -87,10 +93,53 @@ def isLast(msg):
     return msg.flags & const.FLAG_LAST
 
 
+class WFPadMessagePool(object):
+    """Free list of `WFPadMessage` objects.
+
+    Messages handed back with `release` are re-initialized by `acquire`
+    instead of allocating new ones. A released message must not be used
+    anymore by whoever released it.
+    """
+
+    def __init__(self, maxSize=const.MESSAGE_POOL_SIZE):
+        self.maxSize = maxSize
+        self._free = []
+
+    def acquire(self, *args, **kwargs):
+        """Return a message initialized with the arguments of `WFPadMessage`."""
+        if self._free:
+            msg = self._free.pop()
+            WFPadMessage.__init__(msg, *args, **kwargs)
+            return msg
+        return WFPadMessage(*args, **kwargs)
+
+    def release(self, msg):
+        """Give `msg` back to the pool."""
+        if len(self._free) < self.maxSize:
+            # Don't keep the payload alive while the message is unused.
+            msg.payload = msg.args = b''
+            self._free.append(msg)
+
+    def releaseAll(self, msgs):
+        """Give all the messages in `msgs` back to the pool."""
+        for msg in msgs:
+            self.release(msg)
+
+    def __len__(self):
+        """Return the number of free messages."""
+        return len(self._free)
+
+
 class WFPadMessageFactory(object):
 
+    def __init__(self, pool=None):
+        """Create messages from `pool` (a `WFPadMessagePool`), if set."""
+        self._pool = pool
+
     def new(self, payload="", paddingLen=0, flags=const.FLAG_DATA, opcode=None, args="", **kwargs):
         """Create a new WFPad message."""
+        if self._pool is not None:
+            return self._pool.acquire(payload, paddingLen, flags, opcode, args, **kwargs)
         return WFPadMessage(payload, paddingLen, flags, opcode, args, **kwargs)
 
     def newIgnore(self, paddingLen):
@@ -268,8 +317,12 @@ class WFPadMessageExtractor(object):
     depending on the flag we continue parsing the `opcode`, `args`
     and `payload` fields.
     """
-    def __init__(self):
-        """Create a new WFPadMessageExtractor object."""
+    def __init__(self, pool=None):
+        """Create a new WFPadMessageExtractor object.
+
+        Extracted messages are taken from `pool` (a `WFPadMessagePool`), if set.
+        """
+        self._pool = pool
         self.totalLen = self.payloadLen = self.flags = self.opcode = None
         self.argsLen = 0
         self.queueTime = 0
@@ -418,12 +471,18 @@ class WFPadMessageExtractor(object):
         totalPayload = self.getMessageField(start, total, string)
         extracted = totalPayload[:payloadLen]
         queueTime = self.getQueueTime()
-        return WFPadMessage(payload=extracted,
-                            paddingLen=total-payloadLen,
-                            flags=flags,
-                            opcode=opcode,
-                            args=args, 
-                            queueTime=queueTime)
+        return self.newMessage(payload=extracted,
+                               paddingLen=total-payloadLen,
+                               flags=flags,
+                               opcode=opcode,
+                               args=args,
+                               queueTime=queueTime)
+
+    def newMessage(self, **kwargs):
+        """Return a new message, from the pool if we have one."""
+        if self._pool is not None:
+            return self._pool.acquire(**kwargs)
+        return WFPadMessage(**kwargs)
 
     def extract(self, data):
         """Extracts WFPad protocol messages.
@@ -452,11 +511,11 @@ class WFPadMessageExtractor(object):
                 args = json.loads(self.args) if self.args else ""
                 padLen = self.totalLen - self.payloadLen
                 # Create WFPadMessage
-                msgs.append(WFPadMessage(payload=extracted,
-                                         paddingLen=padLen,
-                                         flags=self.flags,
-                                         opcode=self.opcode,
-                                         args=args))
+                msgs.append(self.newMessage(payload=extracted,
+                                            paddingLen=padLen,
+                                            flags=self.flags,
+                                            opcode=self.opcode,
+                                            args=args))
             # Reset extractor attributes
             self.reset()
         return msgs
@@ -0,0 +1,73 @@
+"""
+Hands the pacing of constant-rate defenses to the kernel.
+
+A constant-rate defense that schedules one reactor timer per frame
+loses accuracy as soon as the reactor is loaded, and its CPU usage
+grows with circuits x rate. On Linux, a maximum pacing rate can be set
+on the socket (SO_MAX_PACING_RATE): TCP, or the fq qdisc, then spaces
+the segments it sends so that they don't exceed that rate. The defense
+can thus write the frames of several periods at once, with a single
+timer, and let the kernel spread them on the wire.
+
+Where the option isn't supported, the defense keeps sending one frame
+per timer.
+"""
+import socket
+import struct
+import sys
+
+import obfsproxy.common.log as logging
+from obfsproxy.transports.wfpadtools import const
+
+
+log = logging.get_obfslogger()
+
+# SO_MAX_PACING_RATE is missing from the socket module of older Pythons.
+SO_MAX_PACING_RATE = getattr(socket, 'SO_MAX_PACING_RATE',
+                             47 if sys.platform.startswith('linux') else None)
+
+# Pacing rate that means "no limit" (~0UL in the kernel). Kernels that
+# read the rate as a 32-bit value see ~0U, which means the same.
+NO_PACING = 2 ** 64 - 1
+
+# Bytes of TCP/IP headers accounted for each frame in the pacing rate.
+# Overestimating them makes the kernel drain a batch slightly faster
+# than we generate them, so that batches never queue up.
+FRAME_OVERHEAD = 64
+
+
+def framesPerTick(period):
+    """Return the number of frames of `period` ms to send per timer.
+
+    A batch covers about `const.PACING_TICK` ms, and at least one frame.
+    """
+    if period <= 0:
+        return 1
+    return max(1, int(const.PACING_TICK // period))
+
+
+def pacingRate(period, frameLen):
+    """Return the rate (bytes/s) at which a frame of `frameLen` bytes
+    is sent every `period` ms."""
+    return int((frameLen + FRAME_OVERHEAD) * const.SCALE / period)
+
+
+def setPacingRate(sock, rate):
+    """Limit the rate of `sock` to `rate` bytes per second.
+
+    Return whether the kernel accepted the option.
+    """
+    if sock is None or SO_MAX_PACING_RATE is None:
+        return False
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, SO_MAX_PACING_RATE,
+                        struct.pack('Q', min(rate, NO_PACING)))
+    except (OSError, socket.error) as err:
+        log.debug("[pacing] Could not set the pacing rate to %d (%s).", rate, err)
+        return False
+    return True
+
+
+def clearPacingRate(sock):
+    """Remove the pacing rate limit of `sock`."""
+    return setPacingRate(sock, NO_PACING)
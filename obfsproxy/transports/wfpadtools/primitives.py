@@ -1,5 +1,5 @@
 from twisted.internet import defer
-from obfsproxy.transports.wfpadtools.common import deferLater, cast_dictionary_to_type
+from obfsproxy.transports.wfpadtools.common import cast_dictionary_to_type
 import obfsproxy.transports.wfpadtools.histo as hist
 from obfsproxy.transports.wfpadtools import const
 from obfsproxy.transports.wfpadtools import message as mes
@@ -83,7 +83,7 @@ class PaddingPrimitivesInterface(object):
         millisec = t
         deferreds = []
         for _ in range(N):
-            deferreds.append(deferLater(millisec, self.sendIgnore))
+            deferreds.append(self._timers.deferLater(millisec, self.sendIgnore))
         return defer.DeferredList(deferreds, consumeErrors=True)
 
     def relayAppHint(self, sessId, status):
@@ -106,6 +106,8 @@ class PaddingPrimitivesInterface(object):
     def relayEndPadding(self):
         """Message sent by the server to the client to flag end of padding."""
         self.session.is_peer_padding = False
+        if not self.session.peer_stop_padding.called:
+            self.session.peer_stop_padding.callback(True)
 
     def relayBurstHistogram(self, histo, removeTokens=False, interpolate=True,
                             when="rcv", decay_by=0):
@@ -0,0 +1,76 @@
+"""
+Emission schedules of constant-rate defenses.
+
+The send times of a constant-rate defense (BuFLO, Tamaraw) are known in
+advance: a message of a fixed length every period. A schedule holds
+the send times of the next window of messages, and the frames that
+don't depend on the data: the padding message, and the header of a
+data message that fills the whole payload. At emission time, each due
+slot is filled with data from the buffer or with padding (see
+WFPadTransport.emitScheduled), so sending a message boils down to
+slicing the buffer next to a precomputed header.
+"""
+import time
+from bisect import bisect_right
+
+from obfsproxy.transports.wfpadtools import const
+from obfsproxy.transports.wfpadtools.message import WFPadMessage
+
+
+class ConstantRateSchedule(object):
+    """Send times of messages of `length` bytes of payload every `period` ms.
+
+    Attributes:
+    padding: Bytes of a padding message.
+    dataHeader: Header of a data message with `length` bytes of payload.
+    paused: Whether the emission stopped; it restarts from scratch.
+    """
+
+    def __init__(self, period, length=const.MPU, window=const.SCHEDULE_WINDOW, start=None):
+        self.period = period
+        self.length = length
+        self.window = window
+        self.padding = WFPadMessage('', length, const.FLAG_PADDING).bytes()
+        self.dataHeader = WFPadMessage(b'\0' * length).bytes()[:const.MIN_HDR_LEN]
+        self.restart(start)
+
+    @property
+    def frameLen(self):
+        """Bytes of a message on the wire."""
+        return const.MIN_HDR_LEN + self.length
+
+    def restart(self, start=None):
+        """Schedule the first message at `start` (by default, now)."""
+        self.paused = False
+        self._fill(time.time() if start is None else start)
+
+    def _fill(self, start):
+        step = self.period / const.SCALE
+        self.times = [start + i * step for i in range(self.window)]
+        self.next = 0
+
+    def due(self, now=None):
+        """Return the number of messages to send by `now` and skip them.
+
+        After a pause, or if more than a window of messages is overdue
+        (e.g., the reactor stalled), the schedule restarts at `now`
+        instead of sending the overdue messages in a burst.
+        """
+        if now is None:
+            now = time.time()
+        step = self.period / const.SCALE
+        if self.paused or now - self.times[self.next] >= self.window * step:
+            self.restart(now)
+        n = 0
+        while now >= self.times[self.next]:
+            last = bisect_right(self.times, now, self.next)
+            n += last - self.next
+            if last < len(self.times):
+                self.next = last
+                break
+            self._fill(self.times[-1] + step)
+        return n
+
+    def nextTime(self):
+        """Return the time at which the next message is due."""
+        return self.times[self.next]
@@ -1,4 +1,5 @@
 import time
+from collections import deque
 
 from twisted.internet.defer import Deferred
 
@@ -8,15 +9,17 @@ class Session(object):
 
     A session is defines as a visit to a web page.
     """
+    # Maximum number of entries kept in `history` and `bw_diffs`.
+    maxHistory = 10000
 
     def __init__(self):
         # Flag padding
         self.is_padding = False
         self.stop_padding = Deferred()
 
-        # Statistics to keep track of past messages
+        # Statistics to keep track of past messages (see `history`)
         # Used for debugging
-        self.history = []
+        self._history = None
 
         # Used for congestion sensitivity
         self.lastSndDownstreamTs = 0
@@ -42,8 +45,35 @@ class Session(object):
         # Flag peer is padding or not
         self.is_peer_padding = False
 
+        # Fired when the peer notifies us that it stopped padding
+        self.peer_stop_padding = Deferred()
+
         # Current iat
         self.current_iat = 0
 
-        # bw differentials
-        self.bw_diffs = []
+        # bw differentials (see `bw_diffs`)
+        self._bw_diffs = None
+
+    def startPeerPadding(self):
+        """The peer pads until `peer_stop_padding` fires.
+
+        The Deferred is renewed if the peer already stopped padding once
+        in this session, so that it fires again for the new padding.
+        """
+        self.is_peer_padding = True
+        if self.peer_stop_padding.called:
+            self.peer_stop_padding = Deferred()
+
+    # The deques are only created once they are used, so that circuits
+    # that never carry a session don't pay for them.
+    @property
+    def history(self):
+        if self._history is None:
+            self._history = deque(maxlen=self.maxHistory)
+        return self._history
+
+    @property
+    def bw_diffs(self):
+        if self._bw_diffs is None:
+            self._bw_diffs = deque(maxlen=self.maxHistory)
+        return self._bw_diffs
@@ -84,7 +84,7 @@ class BuFLOTransport(WFPadTransport):
     def onSessionStarts(self, sessId):
         log.debug("[buflo {}] - params: mintime={}, period={}, psize={}"
                   .format(self.end, self._mintime, self._period, self._length))
-        self.constantRatePaddingDistrib(self._period)
+        self.constantRatePacing(self._period, self._length)
         WFPadTransport.onSessionStarts(self, sessId)
 
 
@@ -24,6 +24,9 @@ class BWDiffTransport(WFPadTransport):
     for time, and a constant probability distribution for packet lengths. The
     minimum time for which the link will be padded is also specified.
     """
+    # Maximum number of past periods kept in `iat_length_tuples`.
+    _maxPeriods = 100
+
     @classmethod
     def register_external_mode_cli(cls, subparser):
         """Register CLI arguments for CSBuFLO parameters."""
@@ -117,11 +120,12 @@ class BWDiffTransport(WFPadTransport):
                 self._burstHistoProbdist['snd'] = hs.uniform(const.INF_LABEL)
                 self._gapHistoProbdist['snd'] = hs.uniform(const.INF_LABEL)
         self.iat_length_tuples.append([])
+        del self.iat_length_tuples[:-self._maxPeriods]
         log.debug("[bwdiff %s] A period has passed: %s", self.end, self.iat_length_tuples[-3:-1])
         if self.isVisiting():
             log.debug("[bwdiff %s] Calling next period (visiting = %s, padding = %s)",
                       self.end, self.isVisiting(), self.session.is_padding)
-            cm.deferLater(self._period, self.getBwDifferential)
+            self._timers.deferLater(self._period, self.getBwDifferential)
             
     def onSessionStarts(self, sessId):
         self._lengthDataProbdist = hs.uniform(self._length)
@@ -160,6 +164,10 @@ class BWDiffTransport(WFPadTransport):
             self.sendControlMessage(const.OP_END_PADDING)
             log.info("[bwdiff - client] - Padding stopped! Will notify server.")
 
+    def whenHibernating(self):
+        """Drop the iats of the last session."""
+        self.iat_length_tuples = [[]]
+
     def whenReceivedUpstream(self, data):
         self.iat_length_tuples[-1].append((time.time(), const.MTU))
 
@@ -120,6 +120,10 @@ class CSBuFLOTransport(WFPadTransport):
             self.sendControlMessage(const.OP_END_PADDING)
             log.info("[csbuflo - client] - Padding stopped! Will notify server.")
 
+    def whenHibernating(self):
+        """Drop the rho stats of the last session."""
+        self._rho_stats = [[]]
+
     def whenReceivedUpstream(self, data):
         self._rho_stats.append([])
         self.whenReceived()
@@ -2,6 +2,7 @@
 This module implements the BuFLO countermeasure proposed by Dyer et al.
 """
 import time
+from collections import deque
 
 import obfsproxy.common.log as logging
 from obfsproxy.transports.wfpadtools import histo
@@ -16,6 +17,26 @@ import struct
 
 log = logging.get_obfslogger()
 
+# Tables of end-sizes, shared by all circuits (see `endSizes`)
+_endSizes = {}
+
+
+def endSizes(subseqLength, k=1.2):
+    """Return the possible end-sizes (low to high) for `subseqLength`.
+
+    The end-sizes are the powers of `k` times `subseqLength` up to 10^7.
+    The returned tuple is shared and must not be modified.
+    """
+    key = (subseqLength, k)
+    if key not in _endSizes:
+        sizes = []
+        for i in range(0, 9999):
+            t = (k ** i) * subseqLength
+            if t > 10000000:
+                break
+            sizes.append(round(t))
+        _endSizes[key] = tuple(sizes)
+    return _endSizes[key]
 
 
 class DynaflowTransport(WFPadTransport):
@@ -42,17 +63,12 @@ class DynaflowTransport(WFPadTransport):
         self._time_gap = self._first_time_gap
         self._no_sent = 0
         self._no_recv = 0
-        self._past_times = []
-        self._queue_times = []
+        # Only the last `_memory` times are ever looked at.
+        self._past_times = deque(maxlen=self._memory)
+        self._queue_times = deque(maxlen=self._memory)
 
         # possible end-sizes (low to high)
-        k = 1.2
-        self._end_sizes = []
-        for i in range(0, 9999):
-            t = (k ** i) * self._subseq_length
-            if t > 10000000:
-                break
-            self._end_sizes.append(round(t))
+        self._end_sizes = endSizes(self._subseq_length)
 
         self._end_size = self._end_sizes[-1]
 
@@ -157,8 +173,8 @@ class DynaflowTransport(WFPadTransport):
         self._time_gap = self._first_time_gap
         self._no_sent = 0
         self._no_recv = 0
-        self._past_times = []
-        self._queue_times = []
+        self._past_times = deque(maxlen=self._memory)
+        self._queue_times = deque(maxlen=self._memory)
         self._configure_padding()
         WFPadTransport.onSessionStarts(self, sessId)
 
@@ -171,6 +187,11 @@ class DynaflowTransport(WFPadTransport):
                 break
         WFPadTransport.onSessionEnds(self, sessId)
 
+    def whenHibernating(self):
+        """Drop the packet times of the last session."""
+        self._past_times.clear()
+        self._queue_times.clear()
+
     def whenReceivedUpstream(self, data):
         """count number of packets sent upstream"""
         self._past_times.append(time.time())
@@ -234,6 +255,7 @@ class DynaflowTransport(WFPadTransport):
         for msg in msgs:
             log.debug("[wfpad - %s] A new message has been parsed!", self.end)
             msg.rcvTime = time.time()
+            self.recordMessageMetrics('rcv', msg)
 
             if msg.flags & const.FLAG_CONTROL:
                 # Process control messages
@@ -276,6 +298,12 @@ class DynaflowTransport(WFPadTransport):
                 log.error("[wfpad - %s] Invalid message flags: %d.", self.end, msg.flags)
         return msgs
 
+    def circuitDestroyed(self, reason, side):
+        """Also stop the crawler listener, which holds on to this transport."""
+        WFPadTransport.circuitDestroyed(self, reason, side)
+        if self.weAreClient:
+            self._listener.stopListening()
+
     def onEndPadding(self):
         # on conclusion of tail-padding, signal to the crawler that the
         #   trace is over by severing it's connection to the listener
@@ -344,13 +372,24 @@ class WalkieTalkieListener(object):
         self._port = port
         self._ep = TCP4ServerEndpoint(reactor, self._port, interface="127.0.0.1")
         self._crawler = None
+        self._listening_port = None
 
     def listen(self):
         try:
             d = self._ep.listen(self._ServerFactory(self))
+            d.addCallback(self.setListeningPort)
         except Exception as e:
             log.exception("[wt-listener - %s] Error when listening on port %d:", self._transport.end, self._port, e)
 
+    def setListeningPort(self, listening_port):
+        self._listening_port = listening_port
+
+    def stopListening(self):
+        """Stop accepting crawler connections, e.g. when the circuit is destroyed."""
+        if self._listening_port:
+            self._listening_port.stopListening()
+            self._listening_port = None
+
     def setCrawler(self, connection):
         self._crawler = connection
 
@@ -67,8 +67,8 @@ class TamarawTransport(WFPadTransport):
 
     def onSessionStarts(self, sessId):
         WFPadTransport.onSessionStarts(self, sessId)
-        self.constantRatePaddingDistrib(self._period)
         self.relayBatchPad(sessId, self._batch, self._period)
+        self.constantRatePacing(self._period, self._length)
 
 
 class TamarawClient(TamarawTransport):
@@ -10,7 +10,6 @@ import time
 
 import obfsproxy.common.log as logging
 from obfsproxy.transports.wfpadtools import histo
-from obfsproxy.transports.wfpadtools.common import deferLater
 
 from twisted.internet import reactor
 from twisted.internet.protocol import Protocol, Factory
@@ -20,6 +19,10 @@ import struct
 
 log = logging.get_obfslogger()
 
+# Burst sequences loaded so far, by file name (see `_loadSequence`)
+_sequences = {}
+SEQUENCE_CACHE_SIZE = 1024
+
 
 class WalkieTalkieTransport(WFPadTransport):
     """Implementation of the Walkie-Talkie countermeasure.
@@ -145,12 +148,20 @@ class WalkieTalkieTransport(WFPadTransport):
         self._burst_count = 0
 
     def _loadSequence(self, id, directory):
-        """Load a burst sequence from a pickle file"""
-        seq = []
+        """Load a burst sequence from a pickle file.
+
+        Sequences are only read, so circuits visiting the same page share them.
+        """
         fname = os.path.join(directory, id+".pkl")
+        if fname in _sequences:
+            return _sequences[fname]
+        seq = []
         if os.path.exists(fname):
-            with open(fname) as fi:
+            with open(fname, 'rb') as fi:
                 seq = pickle.load(fi)
+            if len(_sequences) >= SEQUENCE_CACHE_SIZE:
+                _sequences.clear()
+            _sequences[fname] = seq
         else:
             log.debug('[walkie-talkie - %s] unable to load sequence for %s from %s', self.end, id, directory)
         return seq
@@ -245,6 +256,7 @@ class WalkieTalkieTransport(WFPadTransport):
                     pad_target -= 1
             # exit the function without queuing further flushBuffer() calls
             # the next flushBuffer() call will occur when new data enters the buffer from pushData()
+            self.whenBufferDrained()
             return
 
         log.debug("[walkie-talkie - %s] %s bytes of data found in buffer."
@@ -289,9 +301,17 @@ class WalkieTalkieTransport(WFPadTransport):
         log.debug("[walkie-talkie - %s] Sent data message of length %d.", self.end, msgTotalLen)
         self.session.lastSndDataDownstreamTs = self.session.lastSndDownstreamTs = time.time()
 
+        # We drained the buffer: maybe resume reading from upstream.
+        if self.circuit:
+            self.circuit.updateBackpressure()
+            self.circuit.updateMemoryUsage()
+
+        if len(self._buffer) <= 0:
+            self.whenBufferDrained()
+
         # schedule next call to flush the buffer
         dataDelay = self._delayDataProbdist.randomSample()
-        self._deferData = deferLater(dataDelay, self.flushBuffer)
+        self._deferData = self._timers.deferLater(dataDelay, self.flushBuffer)
         log.debug("[walkie-talkie - %s] data waiting in buffer, flushing again "
                   "after delay of %s ms.", self.end, dataDelay)
 
@@ -300,7 +320,7 @@ class WalkieTalkieTransport(WFPadTransport):
         Fake bursts must be sent if there remains bursts in the decoy sequence.
         """
         if len(self._buffer) > 0:  # don't end the session until the buffer is empty
-            reactor.callLater(0.5, self.onSessionEnds, sessId)
+            self._pendingSessionEnd = sessId
             return
 
         self.session.is_padding = True
@@ -308,7 +328,7 @@ class WalkieTalkieTransport(WFPadTransport):
 
         log.info("[walkie-talkie - %s] - Session has ended! (sessid = %s)", self.end, sessId)
         if self.weAreClient and self.circuit:
-            self.session.is_peer_padding = True
+            self.session.startPeerPadding()
             self.sendControlMessage(const.OP_APP_HINT, [self.getSessId(), False])
         self.session.totalPadding = self.calculateTotalPadding(self)
 
@@ -317,6 +337,12 @@ class WalkieTalkieTransport(WFPadTransport):
         # bursts left in the decoy sequence
         self.whenFakeBurstEnds()
 
+    def circuitDestroyed(self, reason, side):
+        """Also stop the crawler listener, which holds on to this transport."""
+        WFPadTransport.circuitDestroyed(self, reason, side)
+        if self.weAreClient:
+            self._listener.stopListening()
+
     def onEndPadding(self):
         # on conclusion of tail-padding, signal to the crawler that the
         #   trace is over by severing it's connection to the WT listener
@@ -408,13 +434,24 @@ class WalkieTalkieListener(object):
         self._port = port
         self._ep = TCP4ServerEndpoint(reactor, self._port, interface="127.0.0.1")
         self._crawler = None
+        self._listening_port = None
 
     def listen(self):
         try:
             d = self._ep.listen(self._ServerFactory(self))
+            d.addCallback(self.setListeningPort)
         except Exception as e:
             log.exception("[wt-listener - %s] Error when listening on port %d:", self._transport.end, self._port, e)
 
+    def setListeningPort(self, listening_port):
+        self._listening_port = listening_port
+
+    def stopListening(self):
+        """Stop accepting crawler connections, e.g. when the circuit is destroyed."""
+        if self._listening_port:
+            self._listening_port.stopListening()
+            self._listening_port = None
+
     def setCrawler(self, connection):
         self._crawler = connection
 
@@ -0,0 +1,197 @@
+"""
+Server-wide tick engine of constant-rate defenses.
+
+By default, every BuFLO/Tamaraw circuit runs its own timer (see
+WFPadTransport.emitScheduled), so with thousands of circuits the CPU
+goes to per-circuit timers and decisions. With `--tick-engine`, the
+constant-rate circuits register as rows of a table kept as one array
+per column (struct of arrays):
+
+    nextSend  time at which the next message of the row is due
+    period    seconds between two messages (the rate of the row)
+    length    bytes of payload of a message
+    buffered  bytes of data waiting in the buffer of the circuit
+    quota     padding messages the circuit may still send; -1 while
+              there is no bound (visiting, or padding until the stop
+              condition of the defense holds)
+
+A single reactor timer fires every `const.ENGINE_TICK` ms. It selects
+with NumPy the rows that are due and have something to send, computes
+how many messages each of them owes, and only then calls the selected
+transports to emit them (WFPadTransport.emitSlots). Idle circuits cost
+nothing but their share of the vectorized comparison.
+
+Messages due within a tick are sent together: a period shorter than
+the tick is followed on average, not message by message. Combine the
+engine with `--kernel-pacing` to have the kernel spread them again.
+
+NumPy is an optional dependency; `available` tells whether the engine
+can be used.
+"""
+import time
+
+from twisted.internet import task
+
+import obfsproxy.common.log as logging
+import obfsproxy.common.metrics as metrics
+from obfsproxy.transports.wfpadtools import const
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+log = logging.get_obfslogger()
+
+_rows = metrics.registry.gauge(
+    'wfpad_engine_circuits', 'Constant-rate circuits registered with the tick engine.')
+_emitting = metrics.registry.histogram(
+    'wfpad_engine_emitting_circuits', 'Circuits that sent messages in a tick of the engine.',
+    buckets=(0, 1, 10, 100, 1000, 10000))
+
+# Rows allocated when the engine is created; the table doubles when full.
+INITIAL_ROWS = 256
+
+
+def available():
+    """Return whether NumPy, which the engine requires, is installed."""
+    return np is not None
+
+
+class TickEngine(object):
+    """Emit the messages of all constant-rate circuits from one timer.
+
+    Transports register with `register` and keep their row up to date
+    with `update`; the engine calls `emitSlots(n)` on a transport when
+    `n` of its messages are due.
+    """
+
+    def __init__(self, tick=const.ENGINE_TICK, window=const.SCHEDULE_WINDOW,
+                 rows=INITIAL_ROWS, clock=None):
+        self.tick = tick
+        self.window = window
+        self.transports = []
+        self._free = []
+        self.nextSend = np.zeros(rows)
+        self.period = np.ones(rows)
+        self.length = np.ones(rows, dtype=np.int64)
+        self.buffered = np.zeros(rows, dtype=np.int64)
+        self.quota = np.zeros(rows, dtype=np.int64)
+        self.active = np.zeros(rows, dtype=bool)
+        self._loop = task.LoopingCall(self.run)
+        if clock is not None:
+            self._loop.clock = clock
+
+    def __len__(self):
+        return len(self.transports) - len(self._free)
+
+    def _grow(self):
+        rows = 2 * len(self.active)
+        for name in ('nextSend', 'period', 'length', 'buffered', 'quota', 'active'):
+            column = getattr(self, name)
+            grown = np.zeros(rows, dtype=column.dtype)
+            grown[:len(column)] = column
+            setattr(self, name, grown)
+
+    def register(self, transport, period, length=const.MPU):
+        """Add a row for `transport`, which sends `length` bytes of
+        payload every `period` ms. Return the index of the row.
+
+        The row is idle (nothing to send) until the first `update`.
+        """
+        if self._free:
+            row = self._free.pop()
+            self.transports[row] = transport
+        else:
+            row = len(self.transports)
+            if row == len(self.active):
+                self._grow()
+            self.transports.append(transport)
+        self.nextSend[row] = time.time()
+        self.period[row] = period / const.SCALE
+        self.length[row] = length
+        self.buffered[row] = 0
+        self.quota[row] = 0
+        self.active[row] = True
+        _rows.inc()
+        if not self._loop.running:
+            self._loop.start(self.tick / const.SCALE, now=False)
+        return row
+
+    def unregister(self, row):
+        """Remove the row of a transport."""
+        if not self.active[row]:
+            return
+        self.active[row] = False
+        self.transports[row] = None
+        self._free.append(row)
+        _rows.dec()
+        if not len(self) and self._loop.running:
+            self._loop.stop()
+
+    def update(self, row, buffered, quota, now=None):
+        """Set the buffered bytes and the padding quota of a row.
+
+        A row that had nothing to send starts its schedule at `now`
+        (by default, now), as a paused schedule restarts.
+        """
+        if (buffered or quota) and not (self.buffered[row] or self.quota[row]):
+            self.nextSend[row] = time.time() if now is None else now
+        self.buffered[row] = buffered
+        self.quota[row] = quota
+
+    def due(self, now):
+        """Return the rows that must send messages by `now`, and how
+        many messages each of them must send.
+
+        The send times of the rows are moved past the messages. A row
+        more than a window of messages late (e.g., the reactor stalled)
+        restarts at `now` with one message instead of sending them in a
+        burst, as `schedule.ConstantRateSchedule.due` does.
+        """
+        size = len(self.transports)
+        selected = self.active[:size] & (self.nextSend[:size] <= now)
+        selected &= (self.buffered[:size] > 0) | (self.quota[:size] != 0)
+        rows = np.flatnonzero(selected)
+        if not rows.size:
+            return rows, rows
+        period, nextSend = self.period[rows], self.nextSend[rows]
+        count = ((now - nextSend) // period).astype(np.int64) + 1
+        stalled = count > self.window
+        # A bounded quota doesn't need more messages than the data and
+        # the padding left.
+        quota = self.quota[rows]
+        length = self.length[rows]
+        needed = (self.buffered[rows] + length - 1) // length + quota
+        count = np.where(quota >= 0, np.minimum(count, needed), count)
+        count = np.where(stalled, 1, np.minimum(count, self.window))
+        self.nextSend[rows] = np.where(stalled, now + period, nextSend + count * period)
+        return rows, count
+
+    def run(self, now=None):
+        """Emit the messages that are due. Return the number of rows
+        that were asked to emit."""
+        rows, counts = self.due(time.time() if now is None else now)
+        for row, count in zip(rows.tolist(), counts.tolist()):
+            transport = self.transports[row]
+            if transport is None:  # unregistered during this tick
+                continue
+            try:
+                transport.emitSlots(count)
+            except Exception as err:
+                # Don't let one circuit stop the loop of all the others.
+                log.error("[engine] %s failed to emit %d messages: %s", transport, count, err)
+        _emitting.observe((), len(rows))
+        return len(rows)
+
+
+_instance = None
+
+
+def get():
+    """Return the engine shared by all the circuits of the process."""
+    global _instance
+    if _instance is None:
+        _instance = TickEngine()
+    return _instance
@@ -7,18 +7,21 @@ primitives that can be used to implement more specific anti-website
 fingerprinting strategies.
 """
 import os
+import re
 import socket
 import time
 
 import psutil
-from twisted.internet import reactor
 
 import obfsproxy.common.log as logging
+import obfsproxy.common.metrics as metrics
+import obfsproxy.network.sockopts as sockopts
 import obfsproxy.transports.wfpadtools.const as const
 from obfsproxy.transports.base import BaseTransport, PluggableTransportError
 from obfsproxy.transports.scramblesuit.fifobuf import Buffer
-from obfsproxy.transports.wfpadtools import histo, message as mes, message, socks_shim, wfpad_shim
-from obfsproxy.transports.wfpadtools.common import deferLater
+from obfsproxy.transports.wfpadtools import histo, message as mes, message, pacing, socks_shim, tickengine, wfpad_shim
+from obfsproxy.transports.wfpadtools.schedule import ConstantRateSchedule
+from obfsproxy.transports.wfpadtools.common import TimerRegistry
 from obfsproxy.transports.wfpadtools.kist import estimate_write_capacity
 from obfsproxy.transports.wfpadtools.primitives import PaddingPrimitivesInterface
 from obfsproxy.transports.wfpadtools.session import Session
@@ -26,6 +29,48 @@ from obfsproxy.transports.wfpadtools.session import Session
 
 log = logging.get_obfslogger()
 
+# Metrics
+_messagesTotal = metrics.registry.counter(
+    'wfpad_messages_total', 'WFPad messages sent and received downstream.',
+    ('defense', 'direction', 'kind'))
+_bytesTotal = metrics.registry.counter(
+    'wfpad_bytes_total', 'Bytes of WFPad messages sent and received downstream.',
+    ('defense', 'direction', 'kind'))
+_paddingSuppressed = metrics.registry.counter(
+    'wfpad_padding_suppressed_total',
+    'Padding messages skipped because the link was congested (kist) or the '
+    'circuit exceeded its memory budget (memory).',
+    ('defense', 'reason'))
+_hibernations = metrics.registry.counter(
+    'wfpad_hibernations_total', 'Number of times an idle circuit hibernated.', ('defense',))
+_hibernating = metrics.registry.gauge(
+    'wfpad_circuits_hibernating', 'Number of circuits currently hibernating.', ('defense',))
+_pacing = metrics.registry.counter(
+    'wfpad_pacing_total', 'Constant-rate sessions paced by the kernel or, where '
+    'kernel pacing was requested but is unsupported, by timers.', ('defense', 'mode'))
+_kistCapacity = metrics.registry.histogram(
+    'wfpad_kist_write_capacity_bytes', 'Write capacity estimated by KIST before sending padding.',
+    buckets=(0, 512, 1500, 4096, 16384, 65536, 262144))
+
+# Shared by all circuits rather than created for each of them.
+_process = None
+
+
+def _getProcess():
+    """Return the psutil handle of this process."""
+    global _process
+    if _process is None:
+        _process = psutil.Process(os.getpid())
+    return _process
+
+
+def _ignore(*args):
+    pass
+
+
+def _alwaysStop(transport):
+    return True
+
 
 class WFPadTransport(BaseTransport, PaddingPrimitivesInterface):
     """Implements the base class for the WFPadTools transport.
@@ -38,6 +83,19 @@ class WFPadTransport(BaseTransport, PaddingPrimitivesInterface):
     circuit = None
     _shim = None
 
+    # Seconds without session or traffic before the circuit hibernates
+    hibernateAfter = const.HIBERNATE_AFTER
+
+    # Free messages kept by the process-wide message pool (0 disables it)
+    messagePoolSize = const.MESSAGE_POOL_SIZE
+    _msgPool = None
+
+    # Whether constant-rate defenses hand the pacing to the kernel
+    kernelPacing = False
+
+    # Whether constant-rate defenses are driven by the server-wide engine
+    tickEngine = False
+
     def __init__(self):
         """Initialize a WFPadTransport object."""
         # Initialize circuit
@@ -49,21 +107,40 @@ class WFPadTransport(BaseTransport, PaddingPrimitivesInterface):
         log.debug("[wfpad - %s] Initializing %s (id=%s).",
                   self.end, const.TRANSPORT_NAME, str(id(self)))
 
+        # Name of the defense used to label metrics (e.g., 'buflo')
+        self._defense = re.sub("(Client|Server|Transport)$", "",
+                               self.__class__.__name__).lower()
+
         # Initialize the protocol's state machine
         self._state = const.ST_WAIT
 
+        # Every timer of the circuit is scheduled through this registry
+        self._timers = TimerRegistry(self._defense)
+
         # Buffer used to 0queue pending data messages
         self._buffer = Buffer()
 
         # Objects to extract and parse protocol messages
-        self._msgFactory = message.WFPadMessageFactory()
-        self._msgExtractor = message.WFPadMessageExtractor()
+        self._msgFactory = message.WFPadMessageFactory(self._msgPool)
+        self._msgExtractor = message.WFPadMessageExtractor(self._msgPool)
 
         # Get the global shim object
         self._initializeShim()
 
         self._initializeState()
 
+        # Hibernation of idle circuits (see `hibernate`)
+        self._hibernating = False
+        self._deferHibernation = None
+
+        # Schedule of constant-rate messages, messages sent per timer and
+        # socket the kernel paces them on (see `constantRatePacing`)
+        self._schedule = None
+        self._framesPerTick = 1
+        self._pacedSocket = None
+        # Row of the circuit in the tick engine (see `tickengine`)
+        self._engineRow = None
+
     def _initializeShim(self):
         # only the client PT can use a socks_shim
         if self.weAreClient:
@@ -104,24 +181,26 @@ class WFPadTransport(BaseTransport, PaddingPrimitivesInterface):
         # sampled from the probability distributions above
         self._deferData = None
         self._deferBurst = {'rcv': None, 'snd': None}
+
+        # Id of a session that ended while data was still buffered. The
+        # session end is handled as soon as the buffer is drained.
+        self._pendingSessionEnd = None
         self._deferGap = {'rcv': None, 'snd': None}
 
+        # `peer_stop_padding` Deferred we wait on to notify the end of
+        # padding, so that we wait on it only once.
+        self._peerStopWaiter = None
+
         # Initialize deferred callbacks.
-        self._deferBurstCallback = {'rcv': lambda d: None,
-                                    'snd': lambda d: None}
-        self._deferGapCallback = {'rcv': lambda d: None,
-                                  'snd': lambda d: None}
+        self._deferBurstCallback = {'rcv': _ignore, 'snd': _ignore}
+        self._deferGapCallback = {'rcv': _ignore, 'snd': _ignore}
 
         # This method is evaluated to decide when to stop padding
-        self.stopCondition = lambda Self: True
+        self.stopCondition = _alwaysStop
 
         # method to calculate total padding
-        self.calculateTotalPadding = lambda Self: None
+        self.calculateTotalPadding = _ignore
 
-        # Get pid and process
-        self.pid = os.getpid()
-        self.process = psutil.Process(self.pid)
-        self.connections = []
         self.downstreamSocket = None
 
     @classmethod
@@ -141,6 +220,31 @@ class WFPadTransport(BaseTransport, PaddingPrimitivesInterface):
                                type=str,
                                help="switch to enable logs for session.",
                                dest="session_logs")
+        subparser.add_argument("--hibernate-after",
+                               required=False,
+                               type=float,
+                               help="seconds without session or traffic before "
+                                    "a circuit drops its state and timers; "
+                                    "0 disables (Default: %s)." % const.HIBERNATE_AFTER,
+                               dest="hibernate_after")
+        subparser.add_argument("--message-pool-size",
+                               required=False,
+                               type=int,
+                               help="number of free WFPad messages kept for "
+                                    "reuse; 0 disables (Default: %s)." % const.MESSAGE_POOL_SIZE,
+                               dest="message_pool_size")
+        subparser.add_argument("--kernel-pacing",
+                               action="store_true",
+                               default=False,
+                               help="let the kernel pace constant-rate defenses "
+                                    "(Linux); falls back to timers where unsupported.",
+                               dest="kernel_pacing")
+        subparser.add_argument("--tick-engine",
+                               action="store_true",
+                               default=False,
+                               help="drive all constant-rate circuits from one "
+                                    "vectorized timer (requires NumPy).",
+                               dest="tick_engine")
         super(WFPadTransport, cls).register_external_mode_cli(subparser)
 
     @classmethod
@@ -158,6 +262,26 @@ class WFPadTransport(BaseTransport, PaddingPrimitivesInterface):
 
         cls.dest = args.dest if args.dest else None
 
+        if args.hibernate_after is not None:
+            if args.hibernate_after < 0:
+                raise PluggableTransportError(
+                    "--hibernate-after can't be negative: %s" % args.hibernate_after)
+            cls.hibernateAfter = args.hibernate_after
+
+        if args.message_pool_size is not None:
+            if args.message_pool_size < 0:
+                raise PluggableTransportError(
+                    "--message-pool-size can't be negative: %s" % args.message_pool_size)
+            cls.messagePoolSize = args.message_pool_size
+
+        if args.kernel_pacing:
+            cls.kernelPacing = True
+
+        if args.tick_engine:
+            if not tickengine.available():
+                raise PluggableTransportError("--tick-engine requires NumPy.")
+            cls.tickEngine = True
+
         # By default, shim doesn't connect to socks
         if args.shim:
             cls.shim_ports = list(map(int, args.shim.split(',')))
@@ -171,12 +295,22 @@ class WFPadTransport(BaseTransport, PaddingPrimitivesInterface):
                      "####################################################\n"
                      " WFPad alone isn't a Website Fingerprinting defense \n"
                      "####################################################\n")
+        # Messages are recycled across all circuits
+        if cls.messagePoolSize and WFPadTransport._msgPool is None:
+            WFPadTransport._msgPool = message.WFPadMessagePool(cls.messagePoolSize)
+
         # Check whether this object is the client or the server
         cls.weAreClient = transportConfig.weAreClient
         cls.weAreServer = not cls.weAreClient
 
     def circuitDestroyed(self, reason, side):
-        """Unregister the shim observer."""
+        """Cancel pending timers and unregister the shim observer."""
+        self._timers.cancelAll()
+        self._pacedSocket = None
+        self.leaveEngine()
+        if self._hibernating:
+            self._hibernating = False
+            _hibernating.dec((self._defense,))
         if self.weAreClient and self._sessionObserver:
             _shim = socks_shim.get()
             if _shim.isRegistered(self._sessionObserver):
@@ -196,13 +330,16 @@ class WFPadTransport(BaseTransport, PaddingPrimitivesInterface):
         if len(self._buffer) > 0:
             self.flushBuffer()
 
+        self.scheduleHibernation()
+
         # Get peer address
         host = self.circuit.downstream.transport.getHost()
         port = host.port
 
         # Load sockets
-        if "test" not in self.process.name():
-            connections = self.process.connections()
+        process = _getProcess()
+        if "test" not in process.name():
+            connections = process.connections()
             for pconn in connections:
                 if pconn.status == psutil.CONN_ESTABLISHED and pconn.raddr[1] == port:
                     self.downstreamSocket = socket.fromfd(pconn.fd, pconn.family, pconn.type)
@@ -214,6 +351,7 @@ class WFPadTransport(BaseTransport, PaddingPrimitivesInterface):
         Whenever data from Tor arrives, push it if we are already
         connected, or buffer it meanwhile otherwise.
         """
+        self.wakeUp()
         d = data.read()
         self.session.lastRcvUpstreamTs = time.time()
         if self._state >= const.ST_CONNECTED:
@@ -230,11 +368,17 @@ class WFPadTransport(BaseTransport, PaddingPrimitivesInterface):
 
     def receivedDownstream(self, data):
         """Got data from downstream; relay them upstream."""
+        self.wakeUp()
         d = data.read()
         if self._state >= const.ST_CONNECTED:
             self.whenReceivedDownstream(d)
             self.cancelDeferrers('rcv')
-            return self.processMessages(d)
+            msgs = self.processMessages(d)
+            if self._msgPool is not None:
+                # The messages go back to the pool: don't hand them out.
+                self.releaseMessages(msgs)
+                return None
+            return msgs
 
     def whenReceivedDownstream(self, data):
         """Template method for child WF defense transport."""
@@ -254,6 +398,7 @@ class WFPadTransport(BaseTransport, PaddingPrimitivesInterface):
             log.debug(type(data))
             self.circuit.downstream.write(data.bytes())
             log.debug("[wfpad - %s] A new message (flag=%s) sent!", self.end, data.flags)
+            self.recordMessageMetrics('snd', data)
 
             if not data.flags & const.FLAG_CONTROL:
                 self.session.numMessages['snd'] += 1
@@ -303,25 +448,38 @@ class WFPadTransport(BaseTransport, PaddingPrimitivesInterface):
 
         if self.downstreamSocket:
             cap = estimate_write_capacity(self.downstreamSocket)
+            _kistCapacity.observe((), cap)
             if cap < paddingLength:
                 log.debug("[wfpad - %s] We skipped sending padding because the"
                           " link was congested. The free space is %s", self.end, cap)
+                _paddingSuppressed.inc((self._defense, 'kist'))
                 return
 
+        if self.circuit and self.circuit.shouldDropPadding():
+            log.debug("[wfpad - %s] We skipped sending padding because the"
+                      " circuit exceeds its memory budget.", self.end)
+            _paddingSuppressed.inc((self._defense, 'memory'))
+            return
+
         log.debug("[wfpad - %s] Sending ignore message.", self.end)
-        self.sendDownstream(self._msgFactory.newIgnore(paddingLength))
+        self.releaseMessages(self.sendDownstream(self._msgFactory.newIgnore(paddingLength)))
 
     def sendDataMessage(self, payload="", paddingLen=0):
         """Send data message."""
         log.debug("[wfpad - %s] Sending data message with %s bytes payload"
                   " and %s bytes padding", self.end, len(payload), paddingLen)
-        self.sendDownstream(self._msgFactory.new(payload, paddingLen))
+        self.releaseMessages(self.sendDownstream(self._msgFactory.new(payload, paddingLen)))
 
     def sendControlMessage(self, opcode, args=""):
         """Send control message."""
         log.debug("[wfpad - %s] Sending control message: opcode=%s, args=%s." % (self.end, opcode, args))
-        self.sendDownstream(self._msgFactory.encapsulate("", opcode, args,
-                                                         lenProbdist=self._lengthDataProbdist))
+        self.releaseMessages(self.sendDownstream(self._msgFactory.encapsulate(
+            "", opcode, args, lenProbdist=self._lengthDataProbdist)))
+
+    def releaseMessages(self, msgs):
+        """Give the sent or processed messages `msgs` back to the pool, if any."""
+        if self._msgPool is not None and msgs:
+            self._msgPool.releaseAll(msgs)
 
     def pushData(self, data):
         """Push `data` to the buffer or send it over the wire.
@@ -359,12 +517,30 @@ class WFPadTransport(BaseTransport, PaddingPrimitivesInterface):
         self._buffer.write(data)
         log.debug("[wfpad - %s] Buffered %d bytes of outgoing data w/ delay %sms", self.end, len(self._buffer), delay)
 
+        # The tick engine sends the data in the next due slot.
+        if self._engineRow is not None:
+            self.syncEngine()
+            return
+
         # In case there is no scheduled flush of the buffer,
         # make a delayed call to the flushing method.
         if not self._deferData or (self._deferData and self._deferData.called):
-            self._deferData = deferLater(delay, self.flushBuffer)
+            self._deferData = self._timers.deferLater(delay, self.flushBuffer)
             log.debug("[wfpad - %s] Delay buffer flush %s ms delay", self.end, delay)
 
+    def getQueuedBytes(self):
+        """Return the number of bytes of upstream data waiting in the buffer.
+
+        The circuit stops reading from upstream while the defense catches
+        up with a backlog (see network.Circuit.updateBackpressure).
+        """
+        return len(self._buffer)
+
+    def getMemoryUsage(self):
+        """Return the number of bytes held in the data buffer and in the
+        reassembly buffer of the message extractor."""
+        return len(self._buffer) + len(self._msgExtractor.recvBuf)
+
     def elapsedSinceLastMsg(self):
         elapsed = time.time() - self.session.lastSndDownstreamTs
         log.debug("[wfpad - %s] Cancel padding. Elapsed = %s ms", self.end, elapsed)
@@ -383,11 +559,22 @@ class WFPadTransport(BaseTransport, PaddingPrimitivesInterface):
         In case the buffer is not empty, the buffer is flushed and we send
         these data over the wire. When buffer is empty we decide whether we
         start padding.
+
+        Constant-rate defenses follow their schedule instead (see
+        `emitScheduled`), or the tick engine does.
         """
+        if self._engineRow is not None:
+            self.syncEngine()
+            return
+        if self._schedule is not None:
+            self.emitScheduled()
+            return
+
         dataLen = len(self._buffer)
         if dataLen <= 0:
             self.deferBurstPadding('snd')
             log.debug("[wfpad - %s] buffer is empty, pad `snd` burst.", self.end)
+            self.whenBufferDrained()
             return
 
         log.debug("[wfpad - %s] %s bytes of data found in buffer."
@@ -403,28 +590,147 @@ class WFPadTransport(BaseTransport, PaddingPrimitivesInterface):
 
         # If data in buffer fills the specified length, we just
         # encapsulate and send the message.
+        # The payload is handed to the message encoder as a view on the
+        # buffered data, so that it is only copied once, into the frame.
         if dataLen > payloadLen:
-            self.sendDataMessage(self._buffer.read(payloadLen))
+            self.sendDataMessage(self._buffer.read_view(payloadLen))
 
         # If data in buffer does not fill the message's payload,
         # pad so that it reaches the specified length.
         else:
             paddingLen = payloadLen - dataLen
-            self.sendDataMessage(self._buffer.read(), paddingLen)
+            self.sendDataMessage(self._buffer.read_view(), paddingLen)
             log.debug("[wfpad - %s] Padding message to %d (adding %d).", self.end, msgTotalLen, paddingLen)
 
         log.debug("[wfpad - %s] Sent data message of length %d.", self.end, msgTotalLen)
 
         self.session.lastSndDataDownstreamTs = self.session.lastSndDownstreamTs = time.time()
 
+        # We drained the buffer: maybe resume reading from upstream.
+        if self.circuit:
+            self.circuit.updateBackpressure()
+            self.circuit.updateMemoryUsage()
+
         if len(self._buffer) > 0:
             dataDelay = self._delayDataProbdist.randomSample()
-            self._deferData = deferLater(dataDelay, self.flushBuffer)
+            self._deferData = self._timers.deferLater(dataDelay, self.flushBuffer)
             log.debug("[wfpad - %s] data waiting in buffer, flushing again "
                       "after delay of %s ms.", self.end, dataDelay)
         else:  # If buffer is empty, generate padding messages.
             self.deferBurstPadding('snd')
             log.debug("[wfpad - %s] buffer is empty, pad `snd` burst.", self.end)
+            self.whenBufferDrained()
+
+    def emitScheduled(self):
+        """Send the messages of the constant-rate schedule that are due.
+
+        The emission pauses when there is nothing to send, until new
+        data is pushed or a session starts.
+        """
+        sched = self._schedule
+        # With kernel pacing, send the messages of the whole tick.
+        lookahead = sched.period * (self._framesPerTick - 1) / const.SCALE
+        if self.emitSlots(sched.due(time.time() + lookahead)):
+            sched.paused = True
+        if sched.paused:
+            self._deferData = None
+            return
+        delay = max(0, (sched.nextTime() - lookahead - time.time()) * const.SCALE)
+        self._deferData = self._timers.deferLater(delay, self.flushBuffer)
+
+    def emitSlots(self, due):
+        """Send `due` messages of the constant-rate schedule.
+
+        Each slot is filled with data from the buffer or, while we are
+        visiting or padding, with padding. The messages are written at
+        once and accounted in bulk. If there is nothing to send, the
+        schedule is paused. Return whether padding stopped.
+        """
+        sched, session = self._schedule, self.session
+
+        # The padding limits of `sendIgnore`, checked once for all slots
+        paddingLimit, reason = None, None
+        if self.downstreamSocket:
+            paddingLimit, reason = estimate_write_capacity(self.downstreamSocket), 'kist'
+            _kistCapacity.observe((), paddingLimit)
+        if self.circuit and self.circuit.shouldDropPadding():
+            paddingLimit, reason = 0, 'memory'
+
+        now = time.time()
+        direction = const.OUT if self.weAreClient else const.IN
+        frames = []
+        sent = {const.FLAG_DATA: 0, const.FLAG_PADDING: 0}
+        suppressed = 0
+        stop = False
+        for _ in range(due):
+            dataLen = len(self._buffer)
+            if dataLen >= sched.length:
+                frames += (sched.dataHeader, self._buffer.read_view(sched.length))
+                flag, payloadLen = const.FLAG_DATA, sched.length
+            elif dataLen > 0:
+                msg = self._msgFactory.new(self._buffer.read_view(), sched.length - dataLen)
+                frames.append(msg.bytes())
+                self.releaseMessages([msg])
+                flag, payloadLen = const.FLAG_DATA, dataLen
+            elif not (self.isVisiting() or session.is_padding):
+                sched.paused = True
+                break
+            elif session.is_padding and self.stopCondition(self):
+                stop = True
+                break
+            elif paddingLimit is not None and paddingLimit < sched.frameLen:
+                suppressed += 1
+                continue
+            else:
+                frames.append(sched.padding)
+                flag, payloadLen = const.FLAG_PADDING, 0
+                if paddingLimit is not None:
+                    paddingLimit -= sched.frameLen
+            sent[flag] += 1
+            session.numMessages['snd'] += 1
+            session.totalBytes['snd'] += sched.length
+            session.history.append((now, flag, direction, sched.length, payloadLen))
+            if flag == const.FLAG_DATA:
+                session.dataMessages['snd'] += 1
+                session.dataBytes['snd'] += payloadLen
+
+        if frames:
+            self.circuit.downstream.writeSequence(frames)
+            session.lastSndDownstreamTs = now
+        if sent[const.FLAG_DATA]:
+            session.lastSndDataDownstreamTs = now
+            session.consecPaddingMsgs = 0
+        session.consecPaddingMsgs += sent[const.FLAG_PADDING]
+        for flag, count in sent.items():
+            if count:
+                labels = (self._defense, 'snd', mes.getFlagNames(flag).lower())
+                _messagesTotal.inc(labels, count)
+                _bytesTotal.inc(labels, count * sched.frameLen)
+        if suppressed:
+            _paddingSuppressed.inc((self._defense, reason), suppressed)
+        log.debug("[wfpad - %s] Sent %d data and %d padding scheduled messages.",
+                  self.end, sent[const.FLAG_DATA], sent[const.FLAG_PADDING])
+
+        if sent[const.FLAG_DATA] and self.circuit:
+            self.circuit.updateBackpressure()
+            self.circuit.updateMemoryUsage()
+        if len(self._buffer) == 0:
+            self.whenBufferDrained()
+        if stop and session.is_padding:
+            self.onEndPadding()
+        if self._engineRow is not None:
+            self.syncEngine()
+        return stop
+
+    def whenBufferDrained(self):
+        """Called by `flushBuffer` whenever the data buffer is empty.
+
+        Handles the end of a session that was waiting for the buffered
+        data to be sent.
+        """
+        if self._pendingSessionEnd is not None:
+            sessId, self._pendingSessionEnd = self._pendingSessionEnd, None
+            self.onSessionEnds(sessId)
 
     def processMessages(self, data):
         """Extract WFPad protocol messages.
@@ -451,6 +757,7 @@ class WFPadTransport(BaseTransport, PaddingPrimitivesInterface):
         for msg in msgs:
             log.debug("[wfpad - %s] A new message has been parsed!", self.end)
             msg.rcvTime = time.time()
+            self.recordMessageMetrics('rcv', msg)
 
             if msg.flags & const.FLAG_CONTROL:
                 # Process control messages
@@ -491,6 +798,12 @@ class WFPadTransport(BaseTransport, PaddingPrimitivesInterface):
                 log.error("[wfpad - %s] Invalid message flags: %d.", self.end, msg.flags)
         return msgs
 
+    def recordMessageMetrics(self, direction, msg):
+        """Account message `msg` sent or received (`direction`) in the metrics."""
+        labels = (self._defense, direction, mes.getFlagNames(msg.flags).lower())
+        _messagesTotal.inc(labels)
+        _bytesTotal.inc(labels, len(msg))
+
     def deferBurstPadding(self, when):
         """Sample delay from corresponding distribution and wait for data.
 
@@ -500,10 +813,10 @@ class WFPadTransport(BaseTransport, PaddingPrimitivesInterface):
         burstDelay = self._burstHistoProbdist[when].randomSample()
         log.debug("[wfpad - %s] - Delay %sms sampled from burst distribution.", self.end, burstDelay)
         if burstDelay is not const.INF_LABEL:
-            self._deferBurst[when] = deferLater(burstDelay,
-                                                self.timeout,
-                                                when=when,
-                                                cbk=self._deferBurstCallback[when])
+            self._deferBurst[when] = self._timers.deferLater(burstDelay,
+                                                             self.timeout,
+                                                             when=when,
+                                                             cbk=self._deferBurstCallback[when])
 
     def is_channel_idle(self):
         """Return boolean on whether there has passed too much time without communication."""
@@ -531,18 +844,70 @@ class WFPadTransport(BaseTransport, PaddingPrimitivesInterface):
         if delay is const.INF_LABEL:
             return
         log.debug("[wfpad - %s]  Wait for data, pad snd gap otherwise.", self.end)
-        self._deferGap[when] = deferLater(delay,
-                                          self.timeout,
-                                          when=when,
-                                          cbk=self._deferGapCallback[when])
+        self._deferGap[when] = self._timers.deferLater(delay,
+                                                       self.timeout,
+                                                       when=when,
+                                                       cbk=self._deferGapCallback[when])
         return delay
 
     def constantRatePaddingDistrib(self, t):
+        self.stopConstantRatePacing()
         self._delayDataProbdist = histo.uniform(t)
         self._burstHistoProbdist['snd'] = histo.uniform(t)
         self._gapHistoProbdist['snd'] = histo.uniform(t)
 
+    def constantRatePacing(self, t, length=const.MPU):
+        """Send a message of `length` bytes of payload every `t` ms.
+
+        The messages follow a `ConstantRateSchedule` (see `emitScheduled`).
+        With `--kernel-pacing`, the kernel spaces the messages: a timer
+        fires every `const.PACING_TICK` ms and sends the messages of all
+        the periods in the tick at once. If the kernel can't pace the
+        downstream socket, a timer fires for every message.
+
+        With `--tick-engine`, the circuit has no timer of its own: the
+        server-wide engine emits its messages (see `tickengine`).
+        """
+        self.constantRatePaddingDistrib(t)
+        self._schedule = ConstantRateSchedule(t, length)
+        if self.tickEngine:
+            self._engineRow = tickengine.get().register(self, t, length)
+        if not self.kernelPacing:
+            return
+        frames = pacing.framesPerTick(t)
+        if frames <= 1:
+            return
+        sock = sockopts.get_socket(self.circuit.downstream.transport) if self.circuit else None
+        if not pacing.setPacingRate(sock, pacing.pacingRate(t, length + const.MIN_HDR_LEN)):
+            log.debug("[wfpad - %s] The kernel can't pace the socket, "
+                      "falling back to timers.", self.end)
+            _pacing.inc((self._defense, 'timer'))
+            return
+        _pacing.inc((self._defense, 'kernel'))
+        self._pacedSocket, self._framesPerTick = sock, frames
+
+    def stopConstantRatePacing(self):
+        """Go back to the padding distributions and to one message per timer."""
+        self._schedule = None
+        self.leaveEngine()
+        if self._pacedSocket is not None:
+            pacing.clearPacingRate(self._pacedSocket)
+            self._pacedSocket = None
+        self._framesPerTick = 1
+
+    def syncEngine(self):
+        """Report the buffered data and padding quota to the tick engine."""
+        quota = -1 if self.isVisiting() or self.session.is_padding else 0
+        tickengine.get().update(self._engineRow, len(self._buffer), quota)
+
+    def leaveEngine(self):
+        """Remove the circuit from the tick engine, if it is registered."""
+        if self._engineRow is not None:
+            tickengine.get().unregister(self._engineRow)
+            self._engineRow = None
+
     def noPaddingDistrib(self):
+        self.stopConstantRatePacing()
         self._delayDataProbdist = histo.uniform(0)
         self._burstHistoProbdist = {'rcv': histo.uniform(const.INF_LABEL),
                                     'snd': histo.uniform(const.INF_LABEL)}
@@ -574,7 +939,12 @@ class WFPadTransport(BaseTransport, PaddingPrimitivesInterface):
         To be extended at child classes that implement final website
         fingerprinting countermeasures.
         """
-        self.session = Session()
+        self.wakeUp()
+        previous, self.session = self.session, Session()
+        # A new session supersedes the end of the previous one.
+        self._pendingSessionEnd = None
+        if not previous.peer_stop_padding.called:
+            previous.peer_stop_padding.callback(False)
         if self.weAreClient:
             self.sendControlMessage(const.OP_APP_HINT, [self.getSessId(), True])
         else:
@@ -586,7 +956,7 @@ class WFPadTransport(BaseTransport, PaddingPrimitivesInterface):
         # we will start padding.
         delay = self._delayDataProbdist.randomSample()
         if not self._deferData or (self._deferData and self._deferData.called):
-            self._deferData = deferLater(delay, self.flushBuffer)
+            self._deferData = self._timers.deferLater(delay, self.flushBuffer)
             log.debug("[wfpad - %s] Delay buffer flush %s ms delay", self.end, delay)
 
         log.info("[wfpad - %s] - Session has started!(sessid = %s)", self.end, sessId)
@@ -598,13 +968,14 @@ class WFPadTransport(BaseTransport, PaddingPrimitivesInterface):
         final website fingerprinting countermeasures.
         """
         if len(self._buffer) > 0:  # don't end the session until the buffer is empty
-            reactor.callLater(0.5, self.onSessionEnds, sessId)
+            log.debug("[wfpad - %s] - Session ends once the buffer is drained.", self.end)
+            self._pendingSessionEnd = sessId
             return
         self.session.is_padding = True
         self._visiting = False
         log.info("[wfpad - %s] - Session has ended! (sessid = %s)", self.end, sessId)
         if self.weAreClient and self.circuit:
-            self.session.is_peer_padding = True
+            self.session.startPeerPadding()
             self.sendControlMessage(const.OP_APP_HINT, [self.getSessId(), False])
             if self._shim:
                 self._shim.notifyStartPadding()  # padding the tail of the page
@@ -615,8 +986,12 @@ class WFPadTransport(BaseTransport, PaddingPrimitivesInterface):
             return
 
     def _waitServerStopPadding(self):
-        if self.session.is_peer_padding:
-            reactor.callLater(0.5, self._waitServerStopPadding)
+        peerStopPadding = self.session.peer_stop_padding
+        if self.session.is_peer_padding and not peerStopPadding.called:
+            if self._peerStopWaiter is not peerStopPadding:
+                # Fired by `relayEndPadding` (or when a new session starts).
+                self._peerStopWaiter = peerStopPadding
+                peerStopPadding.addCallback(self._peerStoppedPadding)
             return
         self.session.is_peer_padding = False
         self._shim.notifyEndPadding()
@@ -630,9 +1005,15 @@ class WFPadTransport(BaseTransport, PaddingPrimitivesInterface):
         log.info("[wfpad - %s] Sesion last iat: %s", self.end,
                  self.session.current_iat)
 
+    def _peerStoppedPadding(self, result):
+        self._peerStopWaiter = None
+        self._waitServerStopPadding()
+        return result
+
     def onEndPadding(self):
         self.session.is_padding = False
-        self.session.stop_padding.callback(True)
+        if not self.session.stop_padding.called:
+            self.session.stop_padding.callback(True)
 
         # Notify shim observers
         if self.weAreClient:
@@ -647,6 +1028,80 @@ class WFPadTransport(BaseTransport, PaddingPrimitivesInterface):
         self.cancelDeferrers('snd')
         self.cancelDeferrers('rcv')
 
+    def scheduleHibernation(self, delay=None):
+        """Check whether the circuit went idle after `delay` seconds.
+
+        By default, the check happens `hibernateAfter` seconds from now.
+        """
+        if not self.hibernateAfter or self._hibernating:
+            return
+        if self._deferHibernation and not self._deferHibernation.called:
+            return
+        if delay is None:
+            delay = self.hibernateAfter
+        self._deferHibernation = self._timers.deferLater(delay * const.SCALE, self.checkIdle)
+
+    def isBusy(self):
+        """Return whether a session, padding or data keeps the circuit awake."""
+        return (self.isVisiting() or self.session.is_padding
+                or self.session.is_peer_padding or len(self._buffer) > 0
+                or self._pendingSessionEnd is not None)
+
+    def checkIdle(self):
+        """Hibernate if there was no session or traffic for `hibernateAfter` seconds."""
+        if self.isBusy():
+            self.scheduleHibernation()
+            return
+        lastActivity = max(self.session.startTime,
+                           self.session.lastSndDownstreamTs,
+                           self.session.lastRcvDownstreamTs,
+                           self.session.lastRcvUpstreamTs)
+        idle = time.time() - lastActivity
+        if idle < self.hibernateAfter:
+            self.scheduleHibernation(self.hibernateAfter - idle)
+            return
+        self.hibernate()
+
+    def hibernate(self):
+        """Drop the state and the timers of the idle circuit.
+
+        The state of the session is replaced by a fresh one and every
+        pending timer (padding included) is cancelled. The transport
+        wakes up with `wakeUp` on the next data or session start.
+        """
+        log.debug("[wfpad - %s] - Circuit is idle, hibernating.", self.end)
+        self._hibernating = True
+        self._timers.cancelPending()
+        self._deferData = None
+        self._deferBurst = {'rcv': None, 'snd': None}
+        self._deferGap = {'rcv': None, 'snd': None}
+        self._deferHibernation = None
+        self.session = Session()
+        self._buffer = Buffer()
+        if self._engineRow is not None:
+            self.syncEngine()
+        self.whenHibernating()
+        _hibernations.inc((self._defense,))
+        _hibernating.inc((self._defense,))
+        if self.circuit:
+            self.circuit.updateMemoryUsage()
+
+    def whenHibernating(self):
+        """Template method for child WF defense transport.
+
+        Drop the state that can be rebuilt when the next session starts.
+        """
+        pass
+
+    def wakeUp(self):
+        """Leave hibernation, if we are hibernating."""
+        if not self._hibernating:
+            return
+        log.debug("[wfpad - %s] - Waking up from hibernation.", self.end)
+        self._hibernating = False
+        _hibernating.dec((self._defense,))
+        self.scheduleHibernation()
+
     def getSessId(self):
         """Return current session Id."""
         if self.weAreServer: